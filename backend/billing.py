@@ -0,0 +1,225 @@
+"""Recurring fees issued per unit and billing period by an in-process scheduler
+
+A fee schedule (fee_schedules collection) issues one debt of its debt_type
+to every matching unit of a site each billing period. Billing periods are
+months written "YYYY-MM", starting at start_period and repeating every
+interval_months; a period is due from its generate_day on and its debts
+fall due on due_day of the same month.
+
+The unique (apartment_id, debt_type, billing_period) index on debts makes
+issuing idempotent: units already billed for a period are skipped, and a
+concurrent insert of the same debt fails instead of double-billing, so a
+restart or a second worker can run the same tick safely. A lease keeps the
+other workers from repeating the work. Each tick issues every period since
+the schedule's last_period in one bulk write; a catch-up run rescans every
+period from start_period, which also bills units added later.
+"""
+import asyncio
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import ledger
+
+SCHEDULER_INTERVAL_SECONDS = float(os.environ.get("SCHEDULER_INTERVAL_SECONDS", "3600"))
+SCHEDULER_LEASE_SECONDS = float(os.environ.get("SCHEDULER_LEASE_SECONDS", "600"))
+BILLING_BATCH_SIZE = int(os.environ.get("BILLING_BATCH_SIZE", "5000"))
+
+SCHEDULER_LEASE_ID = "recurring_fees"
+
+
+class ScheduleError(Exception):
+    """Raised when a fee schedule is not valid"""
+
+
+def parse_period(period: str) -> Tuple[int, int]:
+    try:
+        year, month = (int(part) for part in period.split("-"))
+    except ValueError:
+        raise ScheduleError(f"Invalid billing period {period!r}, expected YYYY-MM")
+    if not 1 <= month <= 12 or len(period) != 7:
+        raise ScheduleError(f"Invalid billing period {period!r}, expected YYYY-MM")
+    return year, month
+
+
+def add_months(period: str, months: int) -> str:
+    year, month = parse_period(period)
+    index = year * 12 + month - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def validate_schedule(schedule: dict):
+    parse_period(schedule["start_period"])
+    if not 1 <= schedule["interval_months"] <= 12:
+        raise ScheduleError("interval_months must be between 1 and 12")
+    # Every month has these days, so no period needs a special case
+    for field in ("generate_day", "due_day"):
+        if not 1 <= schedule[field] <= 28:
+            raise ScheduleError(f"{field} must be between 1 and 28")
+    if schedule["amount"] <= 0:
+        raise ScheduleError("amount must be positive")
+    if unit_query(schedule["site_id"], schedule["unit_filter"], schedule.get("unit_type")) is None:
+        raise ScheduleError("Invalid unit filter")
+
+
+def unit_query(site_id: str, unit_filter: str, unit_type: Optional[str] = None,
+               apartment_ids: Optional[List[str]] = None) -> Optional[dict]:
+    """Apartments a bulk issue targets, or None for an invalid filter"""
+    if unit_filter == "all":
+        return {"site_id": site_id}
+    if unit_filter == "unit_type" and unit_type:
+        return {"site_id": site_id, "unit_type": unit_type}
+    if unit_filter == "apartments" and apartment_ids:
+        return {"site_id": site_id, "_id": {"$in": apartment_ids}}
+    return None
+
+
+def due_periods(schedule: dict, now: datetime, catch_up: bool = False) -> List[str]:
+    """Billing periods to issue: those after last_period up to the latest due one, or all of them on catch-up"""
+    start = schedule["start_period"]
+    start_year, start_month = parse_period(start)
+    elapsed = (now.year - start_year) * 12 + now.month - start_month
+    latest = elapsed // schedule["interval_months"]
+    if elapsed % schedule["interval_months"] == 0 and now.day < schedule["generate_day"]:
+        latest -= 1
+    periods = [add_months(start, n * schedule["interval_months"]) for n in range(latest + 1)]
+
+    last_period = schedule.get("last_period")
+    if catch_up:
+        return periods
+    if last_period is None:
+        # A new schedule starts billing with the current period; older ones need a catch-up
+        return periods[-1:]
+    return [period for period in periods if period > last_period]
+
+
+def period_due_date(period: str, due_day: int) -> datetime:
+    year, month = parse_period(period)
+    return datetime(year, month, due_day)
+
+
+def billed_query(site_id: str, debt_type: str, periods: List[str], apartment_ids: List[str]) -> dict:
+    """Debts of debt_type already issued to apartment_ids for periods
+
+    Leads with apartment_id so the unique debts_billing_period index serves
+    it; $exists matches that index's partial filter.
+    """
+    return {
+        "apartment_id": {"$in": apartment_ids},
+        "debt_type": debt_type,
+        "billing_period": {"$exists": True, "$in": periods},
+        "site_id": site_id,
+    }
+
+
+async def issue_debts(db, site_id: str, query: dict, template: dict, due_dates: Dict[str, datetime]) -> dict:
+    """Issue template debts to every unit matching query for each billing period it was not billed for yet
+
+    template holds amount, description and debt_type; a "{period}" in the
+    description is replaced with the billing period. Debts are written in
+    batches of BILLING_BATCH_SIZE. A BulkWriteError means another request
+    or worker is issuing the same periods and is left to the caller.
+    """
+    apartment_ids = [apartment["_id"] async for apartment in db.apartments.find(query, {"_id": 1})]
+
+    billed = defaultdict(set)
+    async for debt in db.debts.find(
+        billed_query(site_id, template["debt_type"], list(due_dates), apartment_ids),
+        {"apartment_id": 1, "billing_period": 1}
+    ):
+        billed[debt["billing_period"]].add(debt["apartment_id"])
+
+    now = datetime.utcnow()
+    debt_docs = []
+    for period, due_date in due_dates.items():
+        for apartment_id in apartment_ids:
+            if apartment_id in billed[period]:
+                continue
+            debt_docs.append({
+                "_id": str(uuid.uuid4()),
+                "site_id": site_id,
+                "apartment_id": apartment_id,
+                "amount": template["amount"],
+                "description": template["description"].replace("{period}", period),
+                "due_date": due_date,
+                "debt_type": template["debt_type"],
+                "billing_period": period,
+                "created_date": now,
+                "is_paid": False,
+                "paid_amount": 0.0,
+                "paid_date": None
+            })
+
+    inserted_count = 0
+    for i in range(0, len(debt_docs), BILLING_BATCH_SIZE):
+        inserted_count += await ledger.record_debts(db, debt_docs[i:i + BILLING_BATCH_SIZE])
+
+    return {
+        "inserted_count": inserted_count,
+        "skipped_count": len(apartment_ids) * len(due_dates) - inserted_count
+    }
+
+
+async def run_schedule(db, schedule: dict, now: datetime, catch_up: bool = False) -> dict:
+    """Issue a schedule's due periods in one pass and record the last period issued"""
+    periods = due_periods(schedule, now, catch_up)
+    report = {"schedule_id": schedule["_id"], "periods": periods, "inserted_count": 0, "skipped_count": 0}
+    if not periods:
+        return report
+
+    query = unit_query(schedule["site_id"], schedule["unit_filter"], schedule.get("unit_type"))
+    due_dates = {period: period_due_date(period, schedule["due_day"]) for period in periods}
+    report.update(await issue_debts(db, schedule["site_id"], query, schedule, due_dates))
+    await db.fee_schedules.update_one(
+        {"_id": schedule["_id"]},
+        {"$max": {"last_period": periods[-1]}, "$set": {"last_run_date": now}}
+    )
+    return report
+
+
+async def run_due_schedules(db, now: datetime, catch_up: bool = False) -> List[dict]:
+    """Run every active schedule of every site, leaving one that collides with another worker for the next tick"""
+    reports = []
+    async for schedule in db.fee_schedules.find({"active": True}):
+        try:
+            report = await run_schedule(db, schedule, now, catch_up)
+        except BulkWriteError:
+            print(f"Fee schedule {schedule['_id']} is being issued concurrently, retrying next tick")
+            continue
+        if report["inserted_count"]:
+            print(f"Fee schedule {schedule['_id']} issued {report['inserted_count']} debts "
+                  f"for {', '.join(report['periods'])}")
+        reports.append(report)
+    return reports
+
+
+async def acquire_lease(db, owner: str) -> bool:
+    """Take or renew the scheduler lease, so only one worker runs a tick"""
+    now = datetime.utcnow()
+    try:
+        await db.scheduler_leases.update_one(
+            {"_id": SCHEDULER_LEASE_ID, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=SCHEDULER_LEASE_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Another worker holds an unexpired lease, so the upsert collided with it
+        return False
+    return True
+
+
+async def run_scheduler(db, owner: str):
+    """Issue due recurring fees every SCHEDULER_INTERVAL_SECONDS until cancelled"""
+    while True:
+        try:
+            if await acquire_lease(db, owner):
+                await run_due_schedules(db, datetime.utcnow())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Fee scheduler error: {e!r}")
+        await asyncio.sleep(SCHEDULER_INTERVAL_SECONDS)
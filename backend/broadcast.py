@@ -0,0 +1,105 @@
+"""Cross-worker broadcast over a Mongo capped collection
+
+With several workers each process keeps its own in-process caches and
+event bus. A message published here is inserted into the capped
+"broadcast" collection, and every worker tails that collection with a
+tailable await cursor and hands each message to the handlers registered
+for its kind. Unlike change streams this works on a standalone mongod.
+
+While the tail is not running no message can be trusted to arrive, so
+reset handlers run on every (re)connect and caches must only be used
+while `listening` is true.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+BROADCAST_COLLECTION = "broadcast"
+BROADCAST_CAPPED_BYTES = int(os.environ.get("BROADCAST_CAPPED_BYTES", str(8 * 1024 * 1024)))
+
+# Identifies this process so it can skip messages it already applied locally
+WORKER_ID = str(uuid.uuid4())
+
+Handler = Callable[[dict], Awaitable[None]]
+
+_handlers: Dict[str, List[Handler]] = {}
+_reset_handlers: List[Callable[[], None]] = []
+listening = False
+
+
+def subscribe(kind: str, handler: Handler):
+    _handlers.setdefault(kind, []).append(handler)
+
+
+def on_reset(handler: Callable[[], None]):
+    _reset_handlers.append(handler)
+
+
+async def ensure_channel(db):
+    """Create the capped collection with a first document, as a tailable cursor dies on an empty one"""
+    try:
+        await db.create_collection(BROADCAST_COLLECTION, capped=True, size=BROADCAST_CAPPED_BYTES)
+    except CollectionInvalid:
+        return
+    await db[BROADCAST_COLLECTION].insert_one({"kind": "created", "worker": WORKER_ID, "created_date": datetime.utcnow()})
+
+
+def _message(kind: str, payload: dict) -> dict:
+    return {"kind": kind, "worker": WORKER_ID, "created_date": datetime.utcnow(), **payload}
+
+
+async def publish(db, kind: str, payload: dict):
+    await db[BROADCAST_COLLECTION].insert_one(_message(kind, payload))
+
+
+async def publish_many(db, kind: str, payloads: List[dict]):
+    if payloads:
+        await db[BROADCAST_COLLECTION].insert_many([_message(kind, payload) for payload in payloads], ordered=True)
+
+
+async def _dispatch(message: dict):
+    for handler in _handlers.get(message["kind"], []):
+        try:
+            await handler(message)
+        except Exception as e:
+            print(f"Broadcast handler for {message['kind']} failed: {e!r}")
+
+
+async def listen(db):
+    """Tail the broadcast collection and dispatch new messages until cancelled"""
+    global listening
+    collection = db[BROADCAST_COLLECTION]
+    while True:
+        try:
+            await ensure_channel(db)
+            # Workers insert concurrently, so _id order is not insertion order
+            # and cannot position the cursor. The tail reads from the start
+            # in natural order and only dispatches what follows the message
+            # that was newest when it connected.
+            newest = await collection.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+            for handler in _reset_handlers:
+                handler()
+            cursor = collection.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+            caught_up = False
+            while cursor.alive:
+                async for message in cursor:
+                    if caught_up:
+                        await _dispatch(message)
+                    elif message["_id"] == newest["_id"]:
+                        caught_up = listening = True
+            # The cursor died, e.g. the capped collection wrapped past it and
+            # messages may have been lost, so start over with fresh caches
+            listening = False
+            await asyncio.sleep(0.1)
+        except asyncio.CancelledError:
+            listening = False
+            raise
+        except Exception as e:
+            listening = False
+            print(f"Broadcast channel error, reconnecting: {e!r}")
+            await asyncio.sleep(2)
@@ -0,0 +1,175 @@
+"""Brotli and gzip compression of API responses
+
+CompressionMiddleware compresses responses of a compressible content type
+whose body is at least COMPRESSION_MIN_SIZE bytes, using the encoding the
+client prefers among COMPRESSION_ENCODINGS (server preference breaks ties).
+Brotli is used when the brotli package is installed. Streamed responses
+such as CSV exports are compressed chunk by chunk; server-sent events and
+already compressed bodies like XLSX pass through untouched. Setting
+COMPRESSION_ENCODINGS to an empty string turns compression off, e.g. when
+a proxy in front compresses instead.
+"""
+import os
+import zlib
+from typing import Dict, List, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+# Quality 4 compresses JSON better than gzip -6 at a similar cost; 11 is for static files
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/csv", "text/plain", "text/html", "text/css",
+                      "application/javascript")
+
+
+def _encodings(setting: str) -> List[str]:
+    encodings = [encoding.strip() for encoding in setting.split(",") if encoding.strip()]
+    return [encoding for encoding in encodings if encoding == "gzip" or (encoding == "br" and brotli)]
+
+
+COMPRESSION_ENCODINGS = _encodings(os.environ.get("COMPRESSION_ENCODINGS", "br,gzip"))
+
+
+def choose_encoding(accept_encoding: str, encodings: List[str] = COMPRESSION_ENCODINGS) -> Optional[str]:
+    """Pick the supported encoding with the highest q-value in an Accept-Encoding header"""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            weights[coding] = q
+
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class Compressor:
+    """Incremental compressor for one response body"""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._brotli = None
+            # wbits 31 writes the gzip header and trailer
+            self._zlib = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self._brotli:
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        if self._brotli:
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def _compressible(headers: List[tuple]) -> bool:
+    content_type = b""
+    for name, value in headers:
+        name = name.lower()
+        if name == b"content-encoding":
+            return False
+        if name == b"content-type":
+            content_type = value
+    return content_type.split(b";")[0].strip().decode("latin-1").lower() in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing large response bodies with brotli or gzip"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENCODINGS:
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = choose_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether compressing pays off
+                start_message = message
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = start_message["headers"]
+                compressible = _compressible(headers)
+                if not compressible or (not more_body and len(body) < COMPRESSION_MIN_SIZE):
+                    passthrough = True
+                    if compressible:
+                        # Larger bodies from the same URL are compressed
+                        start_message["headers"] = _with_vary(headers)
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                compressor = Compressor(encoding)
+                headers = [(name, value) for name, value in _with_vary(headers) if name.lower() != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode()))
+                body = compressor.compress(body)
+                if not more_body:
+                    body += compressor.finish()
+                    headers.append((b"content-length", str(len(body)).encode()))
+                start_message["headers"] = headers
+                await send(start_message)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            chunk = compressor.compress(body)
+            if not more_body:
+                chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _with_vary(headers) -> list:
+    """headers with Accept-Encoding added to Vary"""
+    values = []
+    others = []
+    for name, value in headers:
+        if name.lower() == b"vary":
+            values += [part.strip() for part in value.split(b",") if part.strip()]
+        else:
+            others.append((name, value))
+    if b"accept-encoding" not in [value.lower() for value in values]:
+        values.append(b"Accept-Encoding")
+    return others + [(b"vary", b", ".join(values))]
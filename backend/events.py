@@ -0,0 +1,204 @@
+"""In-process pub/sub for pushing announcement and debt changes to connected clients
+
+Handlers publish events on the module-level bus and every open
+/api/events stream receives the ones its user may see. Each subscriber is
+a bounded asyncio.Queue, so an idle connection costs one parked coroutine
+and a slow reader is dropped instead of growing memory.
+
+Debt changes are coalesced: a write touching many debts publishes one
+event per site carrying how many debts changed and for which apartments,
+so bulk billing or an import makes each client reload once, not once per
+debt. Residents only see the part of such an event about their own
+apartment.
+
+With EVENTS_SOURCE=change_stream the handlers stop publishing directly and
+a Mongo change stream feeds the bus instead, so events written by any
+worker or process reach every worker's clients. Change streams need a
+replica set. EVENTS_SOURCE=broadcast does the same over the capped
+collection in broadcast.py, which also works on a standalone mongod.
+"""
+import asyncio
+import itertools
+import os
+from collections import Counter, defaultdict
+from typing import AsyncIterator, Dict, Iterable, Optional, Set
+
+import orjson
+
+import broadcast
+
+EVENTS_SOURCE = os.environ.get("EVENTS_SOURCE", "local")  # local, change_stream or broadcast
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+# Stream tickets only need to outlive opening the connection
+EVENTS_TICKET_SECONDS = int(os.environ.get("EVENTS_TICKET_SECONDS", "60"))
+# Most change stream events read at once before they are published together
+EVENTS_COALESCE_MAX = int(os.environ.get("EVENTS_COALESCE_MAX", "1000"))
+
+ANNOUNCEMENT_EVENT_FIELDS = ("title", "content", "is_urgent", "created_date")
+
+
+class Subscriber:
+    def __init__(self, site_id: str, role: str, apartment_id: Optional[str]):
+        self.site_id = site_id
+        self.role = role
+        self.apartment_id = apartment_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.dropped = False
+
+    def can_see(self, event: dict) -> bool:
+        if event["site_id"] != self.site_id:
+            return False
+        # Apartment-scoped events only go to admins and those apartments' residents
+        apartment_counts = event.get("apartment_counts")
+        return apartment_counts is None or self.role == "admin" or self.apartment_id in apartment_counts
+
+    def event_data(self, event: dict) -> dict:
+        apartment_counts = event.get("apartment_counts")
+        if apartment_counts is None:
+            return event["data"]
+        if self.role != "admin":
+            apartment_counts = {self.apartment_id: apartment_counts[self.apartment_id]}
+        return {**event["data"], "count": sum(apartment_counts.values()), "apartment_ids": list(apartment_counts)}
+
+
+class EventBus:
+    def __init__(self):
+        self.subscribers: Set[Subscriber] = set()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, site_id: str, role: str, apartment_id: Optional[str]) -> Subscriber:
+        subscriber = Subscriber(site_id, role, apartment_id)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, site_id: str, event_type: str, data: dict,
+                apartment_counts: Optional[Dict[str, int]] = None):
+        """Queue an event for every subscriber that may see it
+
+        apartment_counts scopes the event to apartments, mapping each to how
+        many of its debts changed; None makes it site-wide.
+        """
+        event = {"id": next(self._ids), "site_id": site_id, "type": event_type,
+                 "apartment_counts": apartment_counts, "data": data}
+        for subscriber in list(self.subscribers):
+            if not subscriber.can_see(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # The client is not reading; end its stream so it reconnects and reloads
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+
+    async def stream(self, subscriber: Subscriber) -> AsyncIterator[bytes]:
+        """Yield server-sent events for a subscriber, with heartbeat comments while idle"""
+        try:
+            yield b"retry: 5000\n\n"
+            while not subscriber.dropped:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+                    continue
+                yield (f"id: {event['id']}\nevent: {event['type']}\ndata: ".encode()
+                       + orjson.dumps(subscriber.event_data(event)) + b"\n\n")
+        finally:
+            self.unsubscribe(subscriber)
+
+
+bus = EventBus()
+
+
+def _event_data(doc: dict, fields) -> dict:
+    return {"id": doc["_id"], **{field: doc.get(field) for field in fields}}
+
+
+def _debt_events(event_type: str, debts: Iterable[dict]) -> list:
+    """One (site_id, event_type, data, apartment_counts) tuple per site for a batch of changed debts"""
+    counts: Dict[str, Counter] = defaultdict(Counter)
+    for debt in debts:
+        counts[debt["site_id"]][debt["apartment_id"]] += 1
+    return [(site_id, event_type, {}, dict(apartment_counts)) for site_id, apartment_counts in counts.items()]
+
+
+async def _publish(db, events: list):
+    """Publish (site_id, event_type, data, apartment_counts) tuples on the configured source"""
+    if EVENTS_SOURCE == "local":
+        for site_id, event_type, data, apartment_counts in events:
+            bus.publish(site_id, event_type, data, apartment_counts=apartment_counts)
+    elif EVENTS_SOURCE == "broadcast":
+        await broadcast.publish_many(db, "event", [
+            {"site_id": site_id, "event_type": event_type, "data": data, "apartment_counts": apartment_counts}
+            for site_id, event_type, data, apartment_counts in events
+        ])
+
+
+async def _on_broadcast_event(message: dict):
+    bus.publish(message["site_id"], message["event_type"], message["data"],
+                apartment_counts=message.get("apartment_counts"))
+
+
+broadcast.subscribe("event", _on_broadcast_event)
+
+
+async def publish_announcement_created(db, announcement: dict):
+    await _publish(db, [(announcement["site_id"], "announcement_created",
+                         _event_data(announcement, ANNOUNCEMENT_EVENT_FIELDS), None)])
+
+
+async def publish_debt_events(db, event_type: str, debts: list):
+    """Publish one event per site for debts changed by a single write
+
+    event_type is debt_created, debt_updated or debt_paid.
+    """
+    await _publish(db, _debt_events(event_type, debts))
+
+
+def _publish_changes(changes: list):
+    """Publish a batch of change stream events, coalescing the debt changes per site and type"""
+    debts = defaultdict(list)
+    for change in changes:
+        doc = change.get("fullDocument")
+        if not doc:
+            continue
+        if change["ns"]["coll"] == "announcements":
+            if change["operationType"] == "insert":
+                bus.publish(doc["site_id"], "announcement_created", _event_data(doc, ANNOUNCEMENT_EVENT_FIELDS))
+            continue
+        if change["operationType"] == "insert":
+            debts["debt_created"].append(doc)
+        else:
+            debts["debt_paid" if doc.get("is_paid") else "debt_updated"].append(doc)
+    for event_type, docs in debts.items():
+        for site_id, _, data, apartment_counts in _debt_events(event_type, docs):
+            bus.publish(site_id, event_type, data, apartment_counts=apartment_counts)
+
+
+async def watch_change_stream(db):
+    """Feed the bus from a Mongo change stream on debts and announcements until cancelled"""
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": ["debts", "announcements"]},
+        "operationType": {"$in": ["insert", "update", "replace"]}
+    }}]
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup") as changes:
+                async for change in changes:
+                    # A bulk write arrives as a burst of changes; take what is
+                    # already there so it goes out as one event
+                    batch = [change]
+                    while len(batch) < EVENTS_COALESCE_MAX:
+                        change = await changes.try_next()
+                        if change is None:
+                            break
+                        batch.append(change)
+                    _publish_changes(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Change stream error, reconnecting: {e!r}")
+            await asyncio.sleep(2)
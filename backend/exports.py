@@ -0,0 +1,126 @@
+"""Streaming debt ledger exports
+
+Rows are read from a Mongo cursor in batches and written out as they
+arrive, so memory stays flat however many years of history a site has.
+CSV is streamed straight to the client. XLSX cannot be emitted before the
+workbook is closed, so xlsxwriter's constant_memory mode spools it to a
+temporary file which is then streamed and removed.
+"""
+import asyncio
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime
+from typing import AsyncIterator, Dict
+
+import xlsxwriter
+
+import ledger
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_COLUMNS = [
+    "id", "apartment_number", "debt_type", "description", "billing_period", "due_date",
+    "amount", "paid_amount", "remaining_amount", "is_paid", "paid_date", "created_date"
+]
+
+# Only the fields the export writes are read from Mongo
+EXPORT_PROJECTION = {
+    "apartment_id": 1, "debt_type": 1, "description": 1, "billing_period": 1, "due_date": 1,
+    "amount": 1, "paid_amount": 1, "is_paid": 1, "paid_date": 1, "created_date": 1
+}
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def export_row(debt: dict, apartment_numbers: Dict[str, str]) -> list:
+    paid_amount = ledger.debt_paid_amount(debt)
+    return [
+        debt["_id"],
+        apartment_numbers.get(debt["apartment_id"], "Unknown"),
+        debt.get("debt_type"),
+        debt.get("description"),
+        debt.get("billing_period"),
+        debt.get("due_date"),
+        debt["amount"],
+        paid_amount,
+        round(debt["amount"] - paid_amount, 2),
+        debt.get("is_paid", False),
+        debt.get("paid_date"),
+        debt.get("created_date"),
+    ]
+
+
+async def _batches(cursor, apartment_numbers: Dict[str, str]) -> AsyncIterator[list]:
+    batch = []
+    async for debt in cursor:
+        batch.append(export_row(debt, apartment_numbers))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None:
+        return ""
+    return value
+
+
+async def stream_csv(cursor, apartment_numbers: Dict[str, str]) -> AsyncIterator[bytes]:
+    """Yield the ledger as CSV, one encoded chunk per cursor batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The BOM lets Excel detect UTF-8, so Turkish characters survive a double click
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_COLUMNS)
+    async for batch in _batches(cursor, apartment_numbers):
+        writer.writerows([_csv_value(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def stream_xlsx(cursor, apartment_numbers: Dict[str, str]) -> AsyncIterator[bytes]:
+    """Yield the ledger as an XLSX workbook spooled through a temporary file"""
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "remove_timezone": True})
+        worksheet = workbook.add_worksheet("Debts")
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+        worksheet.write_row(0, 0, EXPORT_COLUMNS)
+
+        def write_batch(first_row: int, batch: list):
+            for offset, row in enumerate(batch):
+                for column, value in enumerate(row):
+                    if isinstance(value, datetime):
+                        worksheet.write_datetime(first_row + offset, column, value, date_format)
+                    elif value is not None:
+                        worksheet.write(first_row + offset, column, value)
+
+        # Workbook writes are blocking file I/O, so they run off the event loop
+        next_row = 1
+        async for batch in _batches(cursor, apartment_numbers):
+            await asyncio.to_thread(write_batch, next_row, batch)
+            next_row += len(batch)
+        await asyncio.to_thread(workbook.close)
+
+        with open(path, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, EXPORT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
@@ -0,0 +1,68 @@
+"""WAHA (WhatsApp HTTP API) client"""
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+
+WAHA_BASE_URL = os.environ.get("WAHA_BASE_URL", "http://fatihgezer.tr:3100")
+WAHA_TIMEOUT = float(os.environ.get("WAHA_TIMEOUT", "10"))
+WAHA_MAX_CONCURRENCY = int(os.environ.get("WAHA_MAX_CONCURRENCY", "10"))
+
+
+def format_chat_id(phone_number: str) -> str:
+    """Convert a Turkish phone number to a WhatsApp chat id"""
+    if phone_number.startswith("0"):
+        phone_number = "90" + phone_number[1:]  # Convert 05XX to 905XX
+    elif not phone_number.startswith("90"):
+        phone_number = "90" + phone_number
+    return f"{phone_number}@c.us"
+
+
+class WahaClient:
+    """Async WAHA client with a shared connection pool and bounded concurrent sends"""
+
+    def __init__(self, base_url: str = WAHA_BASE_URL, timeout: float = WAHA_TIMEOUT,
+                 max_concurrency: int = WAHA_MAX_CONCURRENCY):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so the pool is bound to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def send_text(self, phone_number: str, message: str) -> bool:
+        """Send a single text message, returning whether WAHA accepted it"""
+        client = self._get_client()
+        payload = {
+            "chatId": format_chat_id(phone_number),
+            "text": message
+        }
+        async with self._semaphore:
+            try:
+                response = await client.post("/sendText", json=payload)
+                return response.status_code == 200
+            except httpx.HTTPError as e:
+                print(f"WhatsApp send error: {e!r}")
+                return False
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+waha_client = WahaClient()
@@ -0,0 +1,65 @@
+"""Gunicorn settings for running the API on several uvicorn workers
+
+Usage (from backend/): gunicorn -c gunicorn.conf.py server:app
+WEB_CONCURRENCY sets the worker count, defaulting to the CPUs this process
+may use: its affinity mask, capped by a cgroup CPU quota when the container
+has one. Each worker is a separate process with its own Motor pool (so
+Mongo sees up to workers x MONGO_MAX_POOL_SIZE connections), event bus
+and caches, kept coherent over the broadcast channel; with more than one
+worker EVENTS_SOURCE defaults to broadcast so events reach every worker's
+subscribers. Workers share METRICS_DIR so /api/metrics reports all of them.
+"""
+import math
+import os
+import shutil
+import tempfile
+
+
+def cgroup_cpu_limit():
+    """The CPU quota of this container's cgroup in CPUs, or None without one"""
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: a quota of -1 means no limit
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+    if quota in ("max", "-1"):
+        return None
+    return int(quota) / int(period)
+
+
+def available_cpus() -> int:
+    cpus = len(os.sched_getaffinity(0))
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return cpus
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8001')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", available_cpus()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Uvicorn workers report to the arbiter from their event loop, so long event
+# streams do not trip this, but a loop blocked this long gets restarted
+timeout = int(os.environ.get("WORKER_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+accesslog = None
+
+# Read by the workers, which are forked after this file is loaded
+if workers > 1:
+    os.environ.setdefault("EVENTS_SOURCE", "broadcast")
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"fortis-metrics-{bind.rsplit(':', 1)[1]}"))
+
+
+def on_starting(server):
+    # Snapshots left by a previous run would be added to this one's counters
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["METRICS_DIR"])
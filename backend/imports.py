@@ -0,0 +1,148 @@
+"""Batched CSV imports for household data and opening debts
+
+The uploaded file is read one row at a time. Each row is validated by the
+caller's parse function, and valid rows are written in batches of
+IMPORT_BATCH_SIZE, so a file for every unit costs a handful of bulk writes
+instead of one request per apartment. Invalid rows are skipped and listed
+in the report with their line number; with dry_run nothing is written.
+
+Files are UTF-8, or else in IMPORT_FALLBACK_ENCODING, the Turkish code
+page Excel saves CSV in. The whole file is validated before the first
+batch is written, so a file that cannot be decoded or parsed raises
+ImportFileError with nothing imported instead of stopping halfway.
+"""
+import asyncio
+import csv
+import io
+import os
+from typing import Awaitable, Callable, Iterator, List, Tuple
+
+from pydantic import ValidationError
+
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", "1000"))
+IMPORT_FALLBACK_ENCODING = os.environ.get("IMPORT_FALLBACK_ENCODING", "cp1254")
+
+
+class RowError(ValueError):
+    """A row that cannot be imported, with a message for the report"""
+
+
+class ImportFileError(ValueError):
+    """A file that cannot be read as CSV at all"""
+
+
+class ImportReport:
+    def __init__(self, dry_run: bool, encoding: str):
+        self.dry_run = dry_run
+        self.encoding = encoding
+        self.total_rows = 0
+        self.valid_rows = 0
+        self.written_count = 0
+        self.error_count = 0
+        self.errors: List[dict] = []
+
+    def add_error(self, line: int, messages: List[str]):
+        self.error_count += 1
+        # Keep the response bounded when a whole file is malformed
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "errors": messages})
+
+    def as_dict(self) -> dict:
+        return {
+            "dry_run": self.dry_run,
+            "encoding": self.encoding,
+            "total_rows": self.total_rows,
+            "valid_rows": self.valid_rows,
+            "written_count": self.written_count,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+def detect_encoding(file) -> str:
+    """utf-8-sig when the whole binary file is valid UTF-8, otherwise IMPORT_FALLBACK_ENCODING
+
+    Raises ImportFileError naming the first line that is valid in neither.
+    Lines are decoded one by one: a line break never splits a character in
+    either encoding, and the line number is exact.
+    """
+    try:
+        for encoding in ("utf-8-sig", IMPORT_FALLBACK_ENCODING):
+            file.seek(0)
+            line_number = 0
+            try:
+                for line_number, line in enumerate(file, 1):
+                    line.decode(encoding)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        raise ImportFileError(f"Line {line_number}: not valid UTF-8 or {IMPORT_FALLBACK_ENCODING} text")
+    finally:
+        file.seek(0)
+
+
+def read_rows(file, encoding: str) -> Iterator[Tuple[int, dict]]:
+    """Yield (line number, row) from a binary CSV file, with cells stripped
+
+    Raises ImportFileError when the file cannot be decoded or parsed.
+    """
+    text = io.TextIOWrapper(file, encoding=encoding, newline="")
+    reader = csv.DictReader(text)
+    try:
+        for row in reader:
+            yield reader.line_num, {
+                (key or "").strip(): (value or "").strip() for key, value in row.items() if key is not None
+            }
+    except csv.Error as e:
+        # line_num still counts the last line read before the failing one
+        raise ImportFileError(f"Line {reader.line_num + 1}: {e}")
+    finally:
+        # Closing the wrapper would close the upload, which is read twice
+        text.detach()
+
+
+def error_messages(error: Exception) -> List[str]:
+    if isinstance(error, ValidationError):
+        return [f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()]
+    return [str(error)]
+
+
+async def run_import(file, parse_row: Callable[[dict], object],
+                     write_batch: Callable[[list], Awaitable[int]], dry_run: bool) -> dict:
+    """Validate every row with parse_row, then write the valid rows through write_batch in chunks
+
+    Raises ImportFileError, before anything is written, for a file that
+    cannot be read.
+    """
+    encoding = detect_encoding(file)
+    report = ImportReport(dry_run, encoding)
+    for line, row in read_rows(file, encoding):
+        report.total_rows += 1
+        try:
+            parse_row(row)
+        except (ValidationError, RowError) as e:
+            report.add_error(line, error_messages(e))
+            continue
+        report.valid_rows += 1
+        if report.total_rows % IMPORT_BATCH_SIZE == 0:
+            # Parsing is synchronous, so let other requests run between chunks
+            await asyncio.sleep(0)
+    if dry_run or not report.valid_rows:
+        return report.as_dict()
+
+    # The same rows again, now known to be readable to the end
+    file.seek(0)
+    batch = []
+    for _, row in read_rows(file, encoding):
+        try:
+            batch.append(parse_row(row))
+        except (ValidationError, RowError):
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            report.written_count += await write_batch(batch)
+            batch = []
+            await asyncio.sleep(0)
+    if batch:
+        report.written_count += await write_batch(batch)
+    return report.as_dict()
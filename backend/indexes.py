@@ -0,0 +1,170 @@
+"""Declarative index registry ensured at startup"""
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+# Options compared when checking an existing index against its declaration
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds",
+                    "weights", "default_language", "language_override")
+
+# Every site-owned collection leads its indexes with site_id, except where
+# a globally unique apartment_id or job_id already pins the site
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("site_id", ASCENDING), ("username", ASCENDING)], name="users_site_username", unique=True),
+    ],
+    "apartments": [
+        IndexModel([("site_id", ASCENDING), ("apartment_number", ASCENDING)],
+                   name="apartments_site_apartment_number", unique=True),
+    ],
+    "debts": [
+        # Keyset pagination sorts on (due_date, _id), within one apartment or one site
+        IndexModel([("apartment_id", ASCENDING), ("due_date", DESCENDING), ("_id", DESCENDING)],
+                   name="debts_apartment_due_date_id"),
+        IndexModel([("site_id", ASCENDING), ("due_date", DESCENDING), ("_id", DESCENDING)],
+                   name="debts_site_due_date_id"),
+        IndexModel([("site_id", ASCENDING), ("is_paid", ASCENDING), ("apartment_id", ASCENDING)],
+                   name="debts_site_is_paid_apartment"),
+        # Idempotency key for bulk issuance, one debt per unit, type and billing period
+        IndexModel([("apartment_id", ASCENDING), ("debt_type", ASCENDING), ("billing_period", ASCENDING)],
+                   name="debts_billing_period", unique=True,
+                   partialFilterExpression={"billing_period": {"$exists": True}}),
+        # One late fee per source debt and month, see late_fees.py
+        IndexModel([("site_id", ASCENDING), ("source_debt_id", ASCENDING), ("accrual_period", ASCENDING)],
+                   name="debts_late_fee_accrual", unique=True,
+                   partialFilterExpression={"source_debt_id": {"$exists": True}}),
+    ],
+    "announcements": [
+        IndexModel([("site_id", ASCENDING), ("created_date", DESCENDING), ("_id", DESCENDING)],
+                   name="announcements_site_created_date_id"),
+        # Search, see search.py; each element of the search array is stemmed in its own language
+        IndexModel([("site_id", ASCENDING), ("search.title", TEXT), ("search.content", TEXT)],
+                   name="announcements_site_search", weights={"search.title": 3, "search.content": 1},
+                   default_language="turkish", language_override="language"),
+    ],
+    "payments": [
+        IndexModel([("apartment_id", ASCENDING), ("created_date", DESCENDING), ("_id", DESCENDING)],
+                   name="payments_apartment_created_date_id"),
+        IndexModel([("site_id", ASCENDING), ("created_date", DESCENDING), ("_id", DESCENDING)],
+                   name="payments_site_created_date_id"),
+        IndexModel([("debt_id", ASCENDING)], name="payments_debt_id"),
+    ],
+    "reminder_jobs": [
+        # Only one running job per site and type, so a retried click cannot enqueue a duplicate campaign
+        IndexModel([("site_id", ASCENDING), ("job_type", ASCENDING)], name="reminder_jobs_site_running_job_type",
+                   unique=True, partialFilterExpression={"status": "running"}),
+    ],
+    "monthly_rollups": [
+        IndexModel([("site_id", ASCENDING), ("month", ASCENDING)], name="monthly_rollups_site_month"),
+    ],
+    "fee_schedules": [
+        IndexModel([("site_id", ASCENDING), ("created_date", ASCENDING)], name="fee_schedules_site_created_date"),
+    ],
+    "whatsapp_outbox": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="whatsapp_outbox_status_next_attempt"),
+        IndexModel([("job_id", ASCENDING), ("status", ASCENDING)], name="whatsapp_outbox_job_status"),
+    ],
+}
+
+# Indexes replaced by an entry above; dropped at startup because the old
+# unique keys would otherwise block the same username or unit on two sites
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    "users": ["users_username"],
+    "apartments": ["apartments_apartment_number"],
+    "debts": ["debts_due_date_id", "debts_is_paid_apartment"],
+    "announcements": ["announcements_created_date_id"],
+    "payments": ["payments_created_date_id"],
+    "reminder_jobs": ["reminder_jobs_running_job_type"],
+}
+
+
+def _normalize(spec: dict) -> dict:
+    # Declared keys are a SON, live ones a list of pairs
+    fields = spec["key"].items() if isinstance(spec["key"], dict) else spec["key"]
+    key = []
+    for field, direction in fields:
+        # The server lists a text index's fields under weights and keys it on _fts/_ftsx
+        if direction == TEXT or field == "_ftsx":
+            if ("_fts", TEXT) not in key:
+                key += [("_fts", TEXT), ("_ftsx", 1)]
+        else:
+            key.append((field, direction))
+    normalized = {"key": key}
+    for option in COMPARED_OPTIONS:
+        if option in spec:
+            value = spec[option]
+            normalized[option] = dict(value) if option in ("partialFilterExpression", "weights") else value
+    if not normalized.get("unique"):
+        normalized.pop("unique", None)
+    return normalized
+
+
+async def check_index_drift(db) -> Dict[str, dict]:
+    """Compare the live indexes with the registry
+
+    Returns, per collection, the declared indexes that are missing, the ones
+    whose key or options differ, and live indexes the registry does not know.
+    """
+    report = {}
+    for collection_name, models in INDEXES.items():
+        existing = {}
+        if collection_name in await db.list_collection_names(filter={"name": collection_name}):
+            existing = await db[collection_name].index_information()
+        existing.pop("_id_", None)
+
+        missing, changed = [], []
+        for model in models:
+            declared = model.document
+            live = existing.pop(declared["name"], None)
+            if live is None:
+                missing.append(declared["name"])
+            elif _normalize(live) != _normalize(declared):
+                changed.append(declared["name"])
+
+        if missing or changed or existing:
+            report[collection_name] = {"missing": missing, "changed": changed, "unknown": sorted(existing)}
+    return report
+
+
+async def drop_retired_indexes(db):
+    existing_collections = set(await db.list_collection_names())
+    for collection_name, names in RETIRED_INDEXES.items():
+        if collection_name not in existing_collections:
+            continue
+        live = await db[collection_name].index_information()
+        for name in names:
+            if name in live:
+                try:
+                    await db[collection_name].drop_index(name)
+                except OperationFailure as e:
+                    # Another worker dropped it first
+                    if e.code != 27:  # IndexNotFound
+                        raise
+                    continue
+                print(f"Dropped retired index {collection_name}.{name}")
+
+
+async def ensure_indexes(db) -> Dict[str, dict]:
+    """Drop retired indexes, create missing ones and return the drift that could not be fixed automatically
+
+    Changed or unknown indexes are only reported; dropping an index in use
+    is left to an operator unless it is listed in RETIRED_INDEXES.
+    """
+    await drop_retired_indexes(db)
+    drift = await check_index_drift(db)
+    for collection_name, collection_drift in drift.items():
+        models = [model for model in INDEXES[collection_name]
+                  if model.document["name"] in collection_drift["missing"]]
+        if models:
+            await db[collection_name].create_indexes(models)
+            print(f"Created indexes on {collection_name}: {', '.join(collection_drift['missing'])}")
+
+    remaining = {
+        collection_name: {"changed": collection_drift["changed"], "unknown": collection_drift["unknown"]}
+        for collection_name, collection_drift in drift.items()
+        if collection_drift["changed"] or collection_drift["unknown"]
+    }
+    for collection_name, collection_drift in remaining.items():
+        print(f"Index drift on {collection_name}: {collection_drift}")
+    return remaining
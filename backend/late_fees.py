@@ -0,0 +1,244 @@
+"""Late-fee accrual over unpaid debts, computed with pandas
+
+Rate rules apply per site and debt_type. Each rule has:
+- monthly_rate: simple interest on the outstanding amount, per 30 days
+- grace_days: days past due_date before anything accrues
+- flat_fee: charged once a debt is past its grace period
+- max_rate: an optional cap on the total penalty, as a fraction of the
+  outstanding amount
+
+Rules come from "late_fee_rules" in the SITES_FILE entry or from
+LATE_FEE_RULES (JSON). The default is the 5% a month of the Kat
+Mülkiyeti Kanunu, article 20.
+
+A run loads every unpaid debt of the given sites and what earlier runs
+already charged for each of them, then computes the penalties in one
+vectorized pass. The penalty owed on a debt is its accrued total on as_of
+less what earlier runs charged. Each penalty is a separate late_fee debt
+with source_debt_id and accrual_period ("YYYY-MM") set. A unique index on
+those keys allows one accrual per debt and month, so repeating a run in
+the same month issues nothing. All penalty debts are written with one
+ledger.record_debts call, and a dry run returns the same figures without
+writing.
+
+Usage: python late_fees.py [--site SITE_ID] [--as-of 2025-06-30] [--apply]
+"""
+import argparse
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import ledger
+import sites
+
+LATE_FEE_DEBT_TYPE = "late_fee"
+LATE_FEE_MIN_AMOUNT = float(os.environ.get("LATE_FEE_MIN_AMOUNT", "0.01"))
+LATE_FEE_PREVIEW_ROWS = 100
+
+DEFAULT_LATE_FEE_RULES = json.loads(os.environ.get("LATE_FEE_RULES") or json.dumps([
+    {"debt_type": debt_type, "monthly_rate": 0.05} for debt_type in ("monthly_fee", "maintenance", "heating")
+]))
+RULE_DEFAULTS = {"monthly_rate": 0.0, "grace_days": 0, "flat_fee": 0.0, "max_rate": None}
+
+DEBT_COLUMNS = ["_id", "site_id", "apartment_id", "amount", "paid_amount", "description", "due_date", "debt_type"]
+CHARGED_COLUMNS = ["source_debt_id", "charged", "accrued"]
+
+
+class LateFeeError(Exception):
+    """Raised when late-fee rules are not valid"""
+
+
+def validate_rules(rules: List[dict]):
+    debt_types = set()
+    for rule in rules:
+        if rule.get("debt_type") in (None, LATE_FEE_DEBT_TYPE):
+            raise LateFeeError("Every rule needs a debt_type other than late_fee")
+        # Two rules for one debt type would charge its debts twice
+        if rule["debt_type"] in debt_types:
+            raise LateFeeError(f"More than one rule for debt_type {rule['debt_type']}")
+        debt_types.add(rule["debt_type"])
+        for field in ("monthly_rate", "grace_days", "flat_fee", "max_rate"):
+            if (rule.get(field) or 0) < 0:
+                raise LateFeeError(f"{field} cannot be negative")
+
+
+def site_rules(site_ids: List[str]) -> Dict[str, List[dict]]:
+    configured = {site["site_id"]: site.get("late_fee_rules", DEFAULT_LATE_FEE_RULES) for site in sites.load_sites()}
+    return {site_id: configured.get(site_id, DEFAULT_LATE_FEE_RULES) for site_id in site_ids}
+
+
+def accrual_period(as_of: datetime) -> str:
+    return f"{as_of.year:04d}-{as_of.month:02d}"
+
+
+def rules_frame(rules_by_site: Dict[str, List[dict]]) -> pd.DataFrame:
+    rows = [{"site_id": site_id, **RULE_DEFAULTS, **rule}
+            for site_id, rules in rules_by_site.items() for rule in rules]
+    frame = pd.DataFrame(rows, columns=["site_id", "debt_type", *RULE_DEFAULTS])
+    # A missing cap becomes NaN, which np.fmin ignores
+    return frame.astype({"monthly_rate": float, "grace_days": int, "flat_fee": float, "max_rate": float})
+
+
+def compute_penalties(debts: pd.DataFrame, charged: pd.DataFrame, rules: pd.DataFrame,
+                      as_of: datetime) -> pd.DataFrame:
+    """Rows of debts that owe a penalty on as_of, with overdue_days, outstanding and penalty columns
+
+    debts has DEBT_COLUMNS with _id renamed to debt_id. charged has
+    CHARGED_COLUMNS: what earlier runs issued per source debt, and whether
+    one of them was for as_of's month. rules comes from rules_frame.
+    """
+    frame = debts.merge(rules, on=["site_id", "debt_type"], how="inner")
+    frame = frame.merge(charged, left_on="debt_id", right_on="source_debt_id", how="left")
+    charged_amount = frame["charged"].fillna(0.0)
+    accrued = frame["accrued"].fillna(False).astype(bool)
+
+    overdue_days = ((as_of - frame["due_date"]).dt.days - frame["grace_days"]).clip(lower=0)
+    outstanding = (frame["amount"] - frame["paid_amount"]).clip(lower=0)
+    total = outstanding * frame["monthly_rate"] * overdue_days / 30 + np.where(overdue_days > 0, frame["flat_fee"], 0.0)
+    total = np.fmin(total, outstanding * frame["max_rate"])
+
+    frame["overdue_days"] = overdue_days
+    frame["outstanding"] = outstanding
+    # A partial payment can leave the accrued total below what was charged;
+    # that is never refunded, the debt just stops accruing for a while
+    frame["penalty"] = (total - charged_amount).astype(float).round(2)
+    return frame[(frame["penalty"] >= LATE_FEE_MIN_AMOUNT) & ~accrued]
+
+
+def debts_frame(rows: List[dict]) -> pd.DataFrame:
+    """Debt documents as the frame compute_penalties expects, typed even when there are none"""
+    frame = pd.DataFrame(rows, columns=DEBT_COLUMNS).rename(columns={"_id": "debt_id"})
+    frame["due_date"] = pd.to_datetime(frame["due_date"])
+    frame["amount"] = frame["amount"].astype(float)
+    # Debts from before partial payments have no paid_amount
+    frame["paid_amount"] = frame["paid_amount"].astype(float).fillna(0.0)
+    return frame
+
+
+def charged_frame(rows: List[dict]) -> pd.DataFrame:
+    # An empty frame would otherwise have object columns, leaving penalty object too
+    return pd.DataFrame(rows, columns=CHARGED_COLUMNS).astype({"charged": float, "accrued": bool})
+
+
+async def load_open_debts(db, site_ids: List[str], debt_types: List[str], as_of: datetime) -> pd.DataFrame:
+    rows = await db.debts.find(
+        {"site_id": {"$in": site_ids}, "is_paid": False, "debt_type": {"$in": debt_types},
+         "due_date": {"$lt": as_of}},
+        {column: 1 for column in DEBT_COLUMNS}
+    ).to_list(None)
+    return debts_frame(rows)
+
+
+async def load_charged(db, site_ids: List[str], period: str) -> pd.DataFrame:
+    rows = await db.debts.aggregate([
+        {"$match": {"site_id": {"$in": site_ids}, "source_debt_id": {"$exists": True}}},
+        {"$group": {
+            "_id": "$source_debt_id",
+            "charged": {"$sum": "$amount"},
+            "accrued": {"$max": {"$eq": ["$accrual_period", period]}}
+        }},
+        {"$project": {"_id": 0, "source_debt_id": "$_id", "charged": 1, "accrued": 1}}
+    ]).to_list(None)
+    return charged_frame(rows)
+
+
+def penalty_documents(penalties: pd.DataFrame, as_of: datetime, period: str) -> List[dict]:
+    now = datetime.utcnow()
+    return [{
+        "_id": str(uuid.uuid4()),
+        "site_id": row.site_id,
+        "apartment_id": row.apartment_id,
+        "amount": float(row.penalty),
+        "description": f"Gecikme tazminatı {period} - {row.description}",
+        "due_date": as_of,
+        "debt_type": LATE_FEE_DEBT_TYPE,
+        "source_debt_id": row.debt_id,
+        "accrual_period": period,
+        "created_date": now,
+        "is_paid": False,
+        "paid_amount": 0.0,
+        "paid_date": None
+    } for row in penalties.itertuples()]
+
+
+async def preview_rows(db, penalties: pd.DataFrame) -> List[dict]:
+    """The largest penalties with their unit numbers, for a dry run"""
+    top = penalties.nlargest(LATE_FEE_PREVIEW_ROWS, "penalty")
+    numbers = {apartment["_id"]: apartment["apartment_number"] async for apartment in db.apartments.find(
+        {"_id": {"$in": top["apartment_id"].unique().tolist()}}, {"apartment_number": 1}
+    )}
+    return [{
+        "apartment_id": row.apartment_id,
+        "apartment_number": numbers.get(row.apartment_id),
+        "source_debt_id": row.debt_id,
+        "description": row.description,
+        "due_date": row.due_date.to_pydatetime(),
+        "overdue_days": int(row.overdue_days),
+        "outstanding": round(float(row.outstanding), 2),
+        "penalty": float(row.penalty)
+    } for row in top.itertuples()]
+
+
+async def accrue(db, site_ids: List[str], as_of: datetime, dry_run: bool = True,
+                 rules_by_site: Optional[Dict[str, List[dict]]] = None) -> dict:
+    """Compute late fees for the sites on as_of and, unless dry_run, issue them in one bulk write"""
+    rules_by_site = rules_by_site or site_rules(site_ids)
+    for rules in rules_by_site.values():
+        validate_rules(rules)
+    rules = rules_frame(rules_by_site)
+    period = accrual_period(as_of)
+
+    debts = await load_open_debts(db, site_ids, sorted(rules["debt_type"].unique()), as_of)
+    charged = await load_charged(db, site_ids, period)
+    penalties = compute_penalties(debts, charged, rules, as_of)
+
+    by_site = penalties.groupby("site_id")["penalty"].agg(["count", "sum"])
+    report = {
+        "as_of": as_of,
+        "accrual_period": period,
+        "dry_run": dry_run,
+        "open_debt_count": len(debts),
+        "penalty_count": len(penalties),
+        "total_amount": round(float(penalties["penalty"].sum()), 2),
+        "by_site": {site_id: {"penalty_count": int(row["count"]), "total_amount": round(float(row["sum"]), 2)}
+                    for site_id, row in by_site.iterrows()},
+        "inserted_count": 0
+    }
+    if dry_run:
+        report["preview"] = await preview_rows(db, penalties)
+        return report
+
+    penalty_docs = penalty_documents(penalties, as_of, period)
+    report["inserted_count"] = await ledger.record_debts(db, penalty_docs)
+    return report
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--site", action="append", help="Site to accrue for, repeatable; all sites by default")
+    parser.add_argument("--as-of", type=datetime.fromisoformat, default=datetime.utcnow())
+    parser.add_argument("--apply", action="store_true", help="Issue the penalties; without it only a preview is printed")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    try:
+        db = client[os.environ.get("DB_NAME", "residence_site")]
+        site_ids = args.site or [site["site_id"] for site in sites.load_sites()]
+        report = await accrue(db, site_ids, args.as_of, dry_run=not args.apply)
+    finally:
+        client.close()
+    print(json.dumps(report, indent=2, default=str, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,354 @@
+"""Debt and payment writes that keep each apartment's running balance up to date
+
+An apartment's balance is the sum of what is still owed on its debts. Every
+write that changes a debt or records a payment adjusts the balance in the
+same transaction, so reading a balance is a single document lookup. On a
+standalone mongod, which has no transactions, the writes run back to back
+and `python ledger.py reconcile --fix` repairs any drift. The monthly
+collection rollups (see rollups.py) are kept up to date the same way and
+`python ledger.py rebuild-rollups` recomputes them.
+"""
+import argparse
+import asyncio
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import events
+import rollups
+import versions
+
+# Legacy debts have no paid_amount; a paid one counts as fully paid
+PAID_AMOUNT_EXPR = {"$ifNull": ["$paid_amount", {"$cond": ["$is_paid", "$amount", 0]}]}
+REMAINING_AMOUNT_EXPR = {"$subtract": ["$amount", PAID_AMOUNT_EXPR]}
+
+
+def debt_paid_amount(debt: dict) -> float:
+    """PAID_AMOUNT_EXPR for a debt document already in Python"""
+    if debt.get("paid_amount") is not None:
+        return debt["paid_amount"]
+    return debt["amount"] if debt.get("is_paid") else 0.0
+
+
+_transactions_supported = {}
+
+
+class PaymentError(Exception):
+    """Raised when a payment cannot be applied to a debt"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def supports_transactions(client) -> bool:
+    """Transactions need a replica set or a sharded cluster"""
+    key = id(client)
+    if key not in _transactions_supported:
+        hello = await client.admin.command("hello")
+        _transactions_supported[key] = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _transactions_supported[key]
+
+
+async def run_transaction(db, callback):
+    """Run callback(session) in a transaction when the deployment supports one"""
+    if await supports_transactions(db.client):
+        async with await db.client.start_session() as session:
+            return await session.with_transaction(callback)
+    return await callback(None)
+
+
+async def _invalidate_after_commit(db, site_ids):
+    # Stamps bumped inside a transaction are only invalidated once it has
+    # committed; without one, bump() already invalidated them
+    if await supports_transactions(db.client):
+        for site_id in site_ids:
+            await versions.invalidate(db, site_id, "apartments", "monthly_rollups")
+
+
+def balance_updates(amounts_by_apartment: dict) -> List[UpdateOne]:
+    now = datetime.utcnow()
+    return [
+        UpdateOne({"_id": apartment_id}, {"$inc": {"balance": round(amount, 2)}, "$set": {"balance_updated_date": now}})
+        for apartment_id, amount in amounts_by_apartment.items() if amount
+    ]
+
+
+async def record_debts(db, debt_docs: List[dict]) -> int:
+    """Insert debts, raise their apartments' balances and publish debt_created, returning the number inserted
+
+    Debts that collide with one already issued (same billing period or late
+    fee accrual) are skipped rather than failing the batch, since another
+    request or worker is issuing them. Only the debts this call inserted are
+    published.
+    """
+    if not debt_docs:
+        return 0
+
+    for debt in debt_docs:
+        debt.setdefault("paid_amount", 0.0)
+
+    async def write(session):
+        inserted = debt_docs
+        try:
+            await db.debts.insert_many(debt_docs, ordered=False, session=session)
+        except BulkWriteError as e:
+            # Inside a transaction the whole write is rolled back, so only
+            # count around duplicates when the inserted debts are kept
+            if session is not None or any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            failed = {error["index"] for error in e.details["writeErrors"]}
+            inserted = [debt for i, debt in enumerate(debt_docs) if i not in failed]
+
+        amounts = defaultdict(float)
+        for debt in inserted:
+            amounts[debt["apartment_id"]] += debt["amount"] - debt["paid_amount"]
+        if amounts:
+            await db.apartments.bulk_write(balance_updates(amounts), ordered=False, session=session)
+        if inserted:
+            await db.monthly_rollups.bulk_write(
+                rollups.rollup_updates(rollups.debt_increments(inserted)), ordered=False, session=session
+            )
+            for site_id in {debt["site_id"] for debt in inserted}:
+                await versions.bump(db, site_id, "apartments", "monthly_rollups", session=session)
+        return inserted
+
+    inserted = await run_transaction(db, write)
+    await _invalidate_after_commit(db, {debt["site_id"] for debt in debt_docs})
+    if inserted:
+        await events.publish_debt_events(db, "debt_created", inserted)
+    return len(inserted)
+
+
+async def record_payment(db, site_id: str, apartment_id: str, debt_id: str, amount: float, payment_method: str,
+                         notes: Optional[str], created_by: str) -> dict:
+    """Apply a (possibly partial) payment to a debt and lower the apartment balance"""
+    amount = round(amount, 2)
+    if amount <= 0:
+        raise PaymentError("Payment amount must be positive")
+
+    async def write(session):
+        debt = await db.debts.find_one({"_id": debt_id, "site_id": site_id}, session=session)
+        if not debt or debt["apartment_id"] != apartment_id:
+            raise PaymentError("Debt not found", status_code=404)
+
+        previous = debt.get("paid_amount")
+        paid_amount = debt_paid_amount(debt)
+        remaining = round(debt["amount"] - paid_amount, 2)
+        if amount > remaining:
+            raise PaymentError(f"Payment exceeds remaining amount {remaining:.2f}")
+
+        now = datetime.utcnow()
+        paid_amount = round(paid_amount + amount, 2)
+        is_paid = paid_amount >= round(debt["amount"], 2)
+        # Guard on the paid amount we read so concurrent payments cannot both apply
+        result = await db.debts.update_one(
+            {"_id": debt_id, "paid_amount": previous},
+            {"$set": {"paid_amount": paid_amount, "is_paid": is_paid, "paid_date": now if is_paid else None}},
+            session=session
+        )
+        if result.matched_count == 0:
+            raise PaymentError("Debt was updated concurrently, please retry", status_code=409)
+
+        payment_doc = {
+            "_id": str(uuid.uuid4()),
+            "site_id": site_id,
+            "apartment_id": apartment_id,
+            "debt_id": debt_id,
+            "amount": amount,
+            "payment_method": payment_method,
+            "notes": notes,
+            "created_date": now,
+            "created_by": created_by
+        }
+        await db.payments.insert_one(payment_doc, session=session)
+        await db.apartments.bulk_write(balance_updates({apartment_id: -amount}), session=session)
+        await db.monthly_rollups.bulk_write(
+            rollups.rollup_updates(rollups.payment_increments(debt, amount, now)), ordered=False, session=session
+        )
+        await versions.bump(db, site_id, "apartments", "monthly_rollups", session=session)
+        debt.update({"paid_amount": paid_amount, "is_paid": is_paid, "paid_date": now if is_paid else None})
+        return {
+            "payment": payment_doc,
+            "debt": debt,
+            "remaining_amount": round(debt["amount"] - paid_amount, 2),
+            "is_paid": is_paid
+        }
+
+    result = await run_transaction(db, write)
+    await _invalidate_after_commit(db, {site_id})
+    return result
+
+
+async def compute_balances(db, apartment_ids: Optional[List[str]] = None) -> dict:
+    """Recompute every apartment's balance, or only those of apartment_ids, from the debt history"""
+    pipeline = [{"$group": {"_id": "$apartment_id", "balance": {"$sum": REMAINING_AMOUNT_EXPR}}}]
+    if apartment_ids is not None:
+        pipeline.insert(0, {"$match": {"apartment_id": {"$in": apartment_ids}}})
+    balances = {}
+    async for row in db.debts.aggregate(pipeline):
+        balances[row["_id"]] = round(row["balance"], 2)
+    return balances
+
+
+async def backfill_balances(db) -> int:
+    """Set the balance of apartments from before running balances, returning how many were set
+
+    The first $inc on an apartment without a balance would otherwise start
+    it from that one change and ignore its existing debts.
+    """
+    missing = {}
+    async for apartment in db.apartments.find({"balance": None}, {"site_id": 1}):
+        missing[apartment["_id"]] = apartment.get("site_id")
+    if not missing:
+        return 0
+
+    expected = await compute_balances(db, list(missing))
+    now = datetime.utcnow()
+    await db.apartments.bulk_write([
+        # Guarded, so a balance a concurrent write has started since is left alone
+        UpdateOne({"_id": apartment_id, "balance": None},
+                  {"$set": {"balance": expected.get(apartment_id, 0.0), "balance_updated_date": now}})
+        for apartment_id in missing
+    ], ordered=False)
+    for site_id in set(missing.values()):
+        await versions.bump(db, site_id, "apartments")
+    return len(missing)
+
+
+async def reconcile_balances(db, fix: bool = False) -> List[dict]:
+    """Compare stored balances with recomputed ones, optionally overwriting the stored ones"""
+    expected = await compute_balances(db)
+    mismatches = []
+    async for apartment in db.apartments.find({}, {"site_id": 1, "apartment_number": 1, "balance": 1}):
+        stored = apartment.get("balance")
+        actual = expected.get(apartment["_id"], 0.0)
+        if stored is None or abs(stored - actual) >= 0.005:
+            mismatches.append({
+                "apartment_id": apartment["_id"],
+                "site_id": apartment.get("site_id"),
+                "apartment_number": apartment.get("apartment_number"),
+                "stored": stored,
+                "expected": actual
+            })
+
+    if fix and mismatches:
+        now = datetime.utcnow()
+        await db.apartments.bulk_write([
+            UpdateOne({"_id": row["apartment_id"]}, {"$set": {"balance": row["expected"], "balance_updated_date": now}})
+            for row in mismatches
+        ], ordered=False)
+        # Conditional GETs would otherwise keep serving the drifted balances
+        for site_id in {row["site_id"] for row in mismatches}:
+            await versions.bump(db, site_id, "apartments")
+    return mismatches
+
+
+async def rebuild_rollups(db) -> int:
+    """Recompute every site's monthly rollups from the debts and payments, returning how many were written
+
+    Writes that land while the history is being read are lost from the
+    rebuilt rollups, so run it while the ledger is quiet.
+    """
+    debt_type = {"$ifNull": ["$debt_type", "other"]}
+    increments = rollups.new_increments()
+
+    def add(group: dict, changes: dict):
+        key = (group["site_id"], group["month"], group["debt_type"])
+        for field, value in changes.items():
+            increments[key][field] += value
+
+    async for row in db.debts.aggregate([
+        {"$group": {
+            "_id": {"site_id": "$site_id", "month": {"$dateToString": {"format": "%Y-%m", "date": "$due_date"}},
+                    "debt_type": debt_type},
+            "billed_amount": {"$sum": "$amount"},
+            "billed_count": {"$sum": 1},
+            "settled_amount": {"$sum": PAID_AMOUNT_EXPR}
+        }}
+    ]):
+        add(row.pop("_id"), row)
+
+    async for row in db.payments.aggregate([
+        {"$lookup": {"from": "debts", "localField": "debt_id", "foreignField": "_id", "as": "debt"}},
+        {"$unwind": "$debt"},
+        {"$group": {
+            "_id": {"site_id": "$site_id", "month": {"$dateToString": {"format": "%Y-%m", "date": "$created_date"}},
+                    "debt_type": {"$ifNull": ["$debt.debt_type", "other"]}},
+            "collected_amount": {"$sum": "$amount"}
+        }}
+    ]):
+        add(row.pop("_id"), row)
+
+    # Paid amounts no payment accounts for: debts paid before payments were
+    # recorded, or created as paid, count as collected when they were paid
+    async for row in db.debts.aggregate([
+        {"$match": {"$or": [{"is_paid": True}, {"paid_amount": {"$gt": 0}}]}},
+        {"$lookup": {"from": "payments", "localField": "_id", "foreignField": "debt_id", "as": "payments"}},
+        {"$project": {
+            "site_id": 1,
+            "debt_type": debt_type,
+            "paid_date": {"$ifNull": ["$paid_date", "$created_date"]},
+            "unrecorded": {"$subtract": [PAID_AMOUNT_EXPR, {"$sum": "$payments.amount"}]}
+        }},
+        {"$match": {"unrecorded": {"$gt": 0.005}}},
+        {"$group": {
+            "_id": {"site_id": "$site_id", "month": {"$dateToString": {"format": "%Y-%m", "date": "$paid_date"}},
+                    "debt_type": "$debt_type"},
+            "collected_amount": {"$sum": "$unrecorded"}
+        }}
+    ]):
+        add(row.pop("_id"), row)
+
+    rollup_docs = rollups.rollup_documents(increments)
+    site_ids = set(await db.monthly_rollups.distinct("site_id")) | {doc["site_id"] for doc in rollup_docs}
+
+    async def write(session):
+        await db.monthly_rollups.delete_many({}, session=session)
+        if rollup_docs:
+            # Upserts, so two workers rebuilding at once both end with the same documents
+            await db.monthly_rollups.bulk_write(
+                [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in rollup_docs],
+                ordered=False, session=session
+            )
+
+    await run_transaction(db, write)
+    # Reports cached by clients would otherwise keep matching the old stamp
+    for site_id in site_ids:
+        await versions.bump(db, site_id, "monthly_rollups")
+    return len(rollup_docs)
+
+
+async def _main(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[args.db]
+    if args.command == "rebuild-rollups":
+        print(f"Wrote {await rebuild_rollups(db)} monthly rollups")
+        return 0
+    mismatches = await reconcile_balances(db, fix=args.fix)
+    for row in mismatches:
+        print(f"{row['apartment_number']}: stored={row['stored']} expected={row['expected']}")
+    action = "Fixed" if args.fix else "Found"
+    print(f"{action} {len(mismatches)} apartment balance mismatches")
+    return 1 if mismatches and not args.fix else 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Apartment balance maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    reconcile = subcommands.add_parser("reconcile", help="Rebuild apartment balances from the debt history")
+    reconcile.add_argument("--fix", action="store_true", help="Overwrite stored balances that do not match")
+    reconcile.add_argument("--db", default="residence_site", help="Database name")
+    rebuild = subcommands.add_parser("rebuild-rollups", help="Recompute the monthly collection rollups")
+    rebuild.add_argument("--db", default="residence_site", help="Database name")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,289 @@
+"""Per-route request metrics and Mongo command attribution in Prometheus text format
+
+MetricsMiddleware times every HTTP request and labels it with the matched
+route template, so /api/apartments/{apartment_id} is one series rather than
+one per apartment. The Mongo CommandListener adds each command's count and
+duration to the request it ran for: Motor runs pymongo in a thread pool but
+copies the caller's contextvars into it, so the listener sees the request's
+stats object. A route whose commands-per-request histogram moves with the
+data size is an N+1 query.
+
+The registry is per process. Under gunicorn, METRICS_DIR (set by
+gunicorn.conf.py) is a directory every worker writes a snapshot of its
+registry to every METRICS_FLUSH_SECONDS. A scrape, whichever worker
+answers it, renders the sum of all snapshots. Snapshots of exited
+workers are kept, so counters never go backwards while the server runs.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+import orjson
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+
+class RequestStats:
+    __slots__ = ("mongo_commands", "mongo_seconds")
+
+    def __init__(self):
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+
+
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+    def merge(self, counts: list, total: float, count: int):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+        self.sum += total
+        self.count += count
+
+    def render(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    def __init__(self):
+        # Request series are only touched from the event loop; command series
+        # are updated from Motor's executor threads and take the lock
+        self.requests: Dict[tuple, int] = defaultdict(int)
+        self.latency: Dict[tuple, Histogram] = {}
+        self.request_commands: Dict[tuple, Histogram] = {}
+        self.request_mongo_seconds: Dict[tuple, float] = defaultdict(float)
+        self.commands: Dict[str, list] = defaultdict(lambda: [0, 0.0, 0])  # count, seconds, failures
+        self.lock = threading.Lock()
+
+    def observe_request(self, method: str, route: str, status_code: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        self.requests[(method, route, status_code)] += 1
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.request_commands[key] = Histogram(COMMAND_COUNT_BUCKETS)
+        self.latency[key].observe(seconds)
+        self.request_commands[key].observe(stats.mongo_commands)
+        self.request_mongo_seconds[key] += stats.mongo_seconds
+
+    def observe_command(self, command_name: str, seconds: float, failed: bool):
+        with self.lock:
+            totals = self.commands[command_name]
+            totals[0] += 1
+            totals[1] += seconds
+            if failed:
+                totals[2] += 1
+
+    def snapshot(self) -> dict:
+        """The registry's series as JSON-serializable lists, for merge in another process"""
+        with self.lock:
+            commands = [[name, *totals] for name, totals in self.commands.items()]
+        return {
+            "requests": [[*key, count] for key, count in self.requests.items()],
+            "latency": [[*key, h.counts, h.sum, h.count] for key, h in self.latency.items()],
+            "request_commands": [[*key, h.counts, h.sum, h.count] for key, h in self.request_commands.items()],
+            "request_mongo_seconds": [[*key, seconds] for key, seconds in self.request_mongo_seconds.items()],
+            "commands": commands
+        }
+
+    def merge(self, snapshot: dict):
+        """Add another registry's snapshot to this one"""
+        for method, route, status_code, count in snapshot["requests"]:
+            self.requests[(method, route, status_code)] += count
+        for name, series, buckets in (("latency", self.latency, LATENCY_BUCKETS),
+                                      ("request_commands", self.request_commands, COMMAND_COUNT_BUCKETS)):
+            for method, route, counts, total, count in snapshot[name]:
+                series.setdefault((method, route), Histogram(buckets)).merge(counts, total, count)
+        for method, route, seconds in snapshot["request_mongo_seconds"]:
+            self.request_mongo_seconds[(method, route)] += seconds
+        with self.lock:
+            for name, count, seconds, failures in snapshot["commands"]:
+                totals = self.commands[name]
+                totals[0] += count
+                totals[1] += seconds
+                totals[2] += failures
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_total HTTP requests by route and status",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status_code), count in sorted(self.requests.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{_label(route)}",status="{status_code}"}} {count}')
+
+        lines += [
+            "# HELP http_request_duration_seconds HTTP request latency by route",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in sorted(self.latency.items()):
+            lines += histogram.render("http_request_duration_seconds", f'method="{method}",route="{_label(route)}"')
+
+        lines += [
+            "# HELP http_request_mongo_commands Mongo commands issued per HTTP request",
+            "# TYPE http_request_mongo_commands histogram",
+        ]
+        for (method, route), histogram in sorted(self.request_commands.items()):
+            lines += histogram.render("http_request_mongo_commands", f'method="{method}",route="{_label(route)}"')
+
+        lines += [
+            "# HELP http_request_mongo_seconds_total Time spent in Mongo commands by route",
+            "# TYPE http_request_mongo_seconds_total counter",
+        ]
+        for (method, route), seconds in sorted(self.request_mongo_seconds.items()):
+            lines.append(f'http_request_mongo_seconds_total{{method="{method}",route="{_label(route)}"}} {seconds}')
+
+        with self.lock:
+            commands = sorted((name, list(totals)) for name, totals in self.commands.items())
+        lines += [
+            "# HELP mongo_commands_total Mongo commands by name, including background work",
+            "# TYPE mongo_commands_total counter",
+        ]
+        lines += [f'mongo_commands_total{{command="{_label(name)}"}} {totals[0]}' for name, totals in commands]
+        lines += [
+            "# HELP mongo_command_seconds_total Time spent in Mongo commands by name",
+            "# TYPE mongo_command_seconds_total counter",
+        ]
+        lines += [f'mongo_command_seconds_total{{command="{_label(name)}"}} {totals[1]}' for name, totals in commands]
+        lines += [
+            "# HELP mongo_command_failures_total Failed Mongo commands by name",
+            "# TYPE mongo_command_failures_total counter",
+        ]
+        lines += [f'mongo_command_failures_total{{command="{_label(name)}"}} {totals[2]}' for name, totals in commands]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _write_snapshot(data: bytes):
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    # Written aside and renamed, so a scrape never reads half a snapshot
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+
+
+def render() -> str:
+    """This process's metrics, or with METRICS_DIR the sum over every worker's snapshot"""
+    if not METRICS_DIR:
+        return registry.render()
+    _write_snapshot(orjson.dumps(registry.snapshot()))
+    combined = Registry()
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), "rb") as f:
+                combined.merge(orjson.loads(f.read()))
+        except (OSError, ValueError):
+            continue
+    return combined.render()
+
+
+async def flush_snapshots():
+    """Write this worker's snapshot to METRICS_DIR every METRICS_FLUSH_SECONDS until cancelled"""
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_SECONDS)
+        # Taken on the event loop, which owns the request series
+        data = orjson.dumps(registry.snapshot())
+        try:
+            await asyncio.to_thread(_write_snapshot, data)
+        except OSError as e:
+            print(f"Could not write metrics snapshot: {e!r}")
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Attribute Mongo command counts and durations to the current request"""
+
+    def _record(self, event, failed: bool):
+        seconds = event.duration_micros / 1_000_000
+        registry.observe_command(event.command_name, seconds, failed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.mongo_commands += 1
+            stats.mongo_seconds += seconds
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+
+command_listener = CommandMetrics()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and Mongo usage per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            # FastAPI stores the matched route in the scope; unmatched paths
+            # share one series so scanners cannot create unbounded labels
+            route = scope.get("route")
+            registry.observe_request(
+                scope["method"], getattr(route, "path", "unmatched"), status_code, elapsed, stats
+            )
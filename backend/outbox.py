@@ -0,0 +1,184 @@
+"""Persistent Mongo outbox for WhatsApp reminder campaigns"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import ledger
+from external_integrations.waha import WahaClient
+
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_BACKOFF_SECONDS = float(os.environ.get("OUTBOX_BACKOFF_SECONDS", "30"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_LEASE_SECONDS = float(os.environ.get("OUTBOX_LEASE_SECONDS", "120"))
+
+
+async def enqueue_job(db, site_id: str, job_type: str, created_by: str, messages: List[dict],
+                      skipped_count: int = 0):
+    """Persist a job and its outbox messages, returning (job, created)
+
+    Each message is a dict with apartment_id, phone, text and optionally the
+    debt_ids it reminds about, whose reminder state is updated once the
+    message is delivered. When a job of the same type is still running for
+    the site the existing job is returned instead, relying on the partial
+    unique index on reminder_jobs. The job and its messages are written in
+    one transaction where the deployment has them; otherwise a crash between
+    the two writes leaves a running job with nothing to send, which the
+    worker completes once it is older than the lease (expire_orphaned_jobs).
+    """
+    now = datetime.utcnow()
+    job = {
+        "_id": str(uuid.uuid4()),
+        "site_id": site_id,
+        "job_type": job_type,
+        "status": "running" if messages else "completed",
+        "created_by": created_by,
+        "created_date": now,
+        "total_count": len(messages),
+        "skipped_count": skipped_count,
+        "completed_date": None if messages else now
+    }
+    message_docs = [{
+        "_id": str(uuid.uuid4()),
+        "site_id": site_id,
+        "job_id": job["_id"],
+        "apartment_id": message["apartment_id"],
+        "phone": message["phone"],
+        "text": message["text"],
+        "debt_ids": message.get("debt_ids", []),
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "last_error": None,
+        "sent_date": None
+    } for message in messages]
+
+    async def write(session):
+        await db.reminder_jobs.insert_one(job, session=session)
+        if message_docs:
+            await db.whatsapp_outbox.insert_many(message_docs, ordered=False, session=session)
+
+    try:
+        await ledger.run_transaction(db, write)
+    except DuplicateKeyError:
+        existing = await db.reminder_jobs.find_one({"site_id": site_id, "job_type": job_type, "status": "running"})
+        if existing:
+            return existing, False
+        # The running job finished between the insert and the lookup
+        await ledger.run_transaction(db, write)
+    return job, True
+
+
+async def get_job_progress(db, site_id: str, job_id: str) -> Optional[dict]:
+    """Report sent, failed and pending counts for a job"""
+    job = await db.reminder_jobs.find_one({"_id": job_id, "site_id": site_id})
+    if not job:
+        return None
+
+    counts = {"pending": 0, "sending": 0, "sent": 0, "failed": 0}
+    async for row in db.whatsapp_outbox.aggregate([
+        {"$match": {"job_id": job_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]):
+        counts[row["_id"]] = row["count"]
+
+    return {
+        "job_id": job["_id"],
+        "job_type": job["job_type"],
+        "status": job["status"],
+        "created_date": job["created_date"],
+        "completed_date": job.get("completed_date"),
+        "total_count": job["total_count"],
+        "skipped_count": job.get("skipped_count", 0),
+        "sent_count": counts["sent"],
+        "failed_count": counts["failed"],
+        "pending_count": counts["pending"] + counts["sending"]
+    }
+
+
+async def claim_message(db) -> Optional[dict]:
+    """Atomically lease the next due message so concurrent workers never send it twice"""
+    now = datetime.utcnow()
+    return await db.whatsapp_outbox.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "lease_expires_at": {"$lte": now}}
+        ]},
+        {"$set": {"status": "sending", "lease_expires_at": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)},
+         "$inc": {"attempts": 1}},
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def deliver_message(db, waha: WahaClient, message: dict):
+    """Send one leased message and record the outcome with exponential backoff on failure"""
+    success = await waha.send_text(message["phone"], message["text"])
+    now = datetime.utcnow()
+    if success:
+        update = {"status": "sent", "sent_date": now, "last_error": None}
+    elif message["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+        update = {"status": "failed", "last_error": "WAHA send failed"}
+    else:
+        backoff = OUTBOX_BACKOFF_SECONDS * (2 ** (message["attempts"] - 1))
+        update = {"status": "pending", "next_attempt_at": now + timedelta(seconds=backoff),
+                  "last_error": "WAHA send failed"}
+
+    await db.whatsapp_outbox.update_one({"_id": message["_id"]}, {"$set": update})
+    if success and message.get("debt_ids"):
+        # Reminder state decides what the next "changed" campaign targets
+        await db.debts.update_many(
+            {"_id": {"$in": message["debt_ids"]}},
+            {"$set": {"last_reminded_date": now}, "$inc": {"reminder_count": 1}}
+        )
+    if update["status"] != "pending":
+        await complete_job_if_drained(db, message["job_id"])
+
+
+async def complete_job_if_drained(db, job_id: str):
+    remaining = await db.whatsapp_outbox.count_documents(
+        {"job_id": job_id, "status": {"$in": ["pending", "sending"]}}, limit=1
+    )
+    if remaining == 0:
+        await db.reminder_jobs.update_one(
+            {"_id": job_id, "status": "running"},
+            {"$set": {"status": "completed", "completed_date": datetime.utcnow()}}
+        )
+
+
+async def expire_orphaned_jobs(db):
+    """Complete running jobs older than the lease that have no message left to send"""
+    cutoff = datetime.utcnow() - timedelta(seconds=OUTBOX_LEASE_SECONDS)
+    async for job in db.reminder_jobs.find({"status": "running", "created_date": {"$lte": cutoff}}, {"_id": 1}):
+        await complete_job_if_drained(db, job["_id"])
+
+
+async def drain_once(db, waha: WahaClient) -> int:
+    """Claim up to one batch of due messages and send them concurrently"""
+    claimed = []
+    for _ in range(waha.max_concurrency):
+        message = await claim_message(db)
+        if message is None:
+            break
+        claimed.append(message)
+
+    await asyncio.gather(*(deliver_message(db, waha, message) for message in claimed))
+    return len(claimed)
+
+
+async def run_worker(db, waha: WahaClient):
+    """Drain the outbox until cancelled"""
+    while True:
+        try:
+            if await drain_once(db, waha) == 0:
+                await expire_orphaned_jobs(db)
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Outbox worker error: {e!r}")
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
@@ -0,0 +1,60 @@
+"""Keyset pagination and field projection helpers for list endpoints"""
+import base64
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bson import json_util
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(doc: dict, sort: Sequence[Tuple[str, int]]) -> str:
+    """Encode the sort key values of the last document on a page"""
+    values = [doc[field] for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: Sequence[Tuple[str, int]]) -> list:
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def keyset_filter(cursor: str, sort: Sequence[Tuple[str, int]]) -> dict:
+    """Build the filter selecting documents strictly after the cursor in sort order
+
+    For a sort on (a desc, b desc) this is {a < va} or {a == va and b < vb},
+    which the matching compound index answers with a single range scan.
+    """
+    values = decode_cursor(cursor, sort)
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prefix: values[j] for j, (prefix, _) in enumerate(sort[:i])}
+        clause[field] = {"$lt" if direction < 0 else "$gt": values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """Parse a comma separated fields= parameter, defaulting to every allowed field"""
+    if not fields:
+        return list(allowed)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    # "id" is always returned so rows stay addressable
+    return ["id"] + [field for field in requested if field != "id"]
+
+
+def mongo_projection(fields: Sequence[str], sort: Sequence[Tuple[str, int]]) -> Dict[str, int]:
+    """Project the requested fields plus the sort keys needed to build the next cursor"""
+    projection = {field: 1 for field in fields if field != "id"}
+    for field, _ in sort:
+        if field != "_id":
+            projection[field] = 1
+    return projection
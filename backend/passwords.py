@@ -0,0 +1,71 @@
+"""Password hashing with bcrypt, executed in a bounded thread pool
+
+A bcrypt verification takes around 100-200 ms of CPU, which would stall
+every other request if it ran on the event loop. bcrypt releases the GIL,
+so a small thread pool lets logins proceed in parallel while the loop keeps
+serving. Legacy unsalted SHA-256 hashes are still accepted and reported as
+needing a rehash.
+
+Seeded resident accounts have no hash at all: their default password is
+their username, which hashing would not keep secret, and hashing one per
+unit at startup held readiness back by minutes on large sites. It is
+checked against the username and hashed at the first login instead.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+_LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_legacy_hash(hashed: str) -> bool:
+    return bool(_LEGACY_SHA256.match(hashed))
+
+
+def _verify_sync(password: str, hashed: Optional[str], default: Optional[str]) -> Tuple[bool, Optional[str]]:
+    if hashed is None:
+        # As slow as a real verification, so unhashed accounts do not stand out
+        pwd_context.dummy_verify()
+        if default is None or not hmac.compare_digest(password.encode(), default.encode()):
+            return False, None
+        return True, pwd_context.hash(password)
+    if is_legacy_hash(hashed):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        if not hmac.compare_digest(legacy, hashed):
+            return False, None
+        return True, pwd_context.hash(password)
+    return pwd_context.verify_and_update(password, hashed)
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed: Optional[str],
+                          default: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+    """Return (valid, new_hash), where new_hash is set when the stored hash should be replaced
+
+    An account without a hash accepts only its default password.
+    """
+    return await _run(_verify_sync, password, hashed, default)
+
+
+async def dummy_verify():
+    """Spend the same time as a real verification so unknown usernames are not revealed by timing"""
+    await _run(pwd_context.dummy_verify)
@@ -0,0 +1,46 @@
+"""Which apartments a debt reminder campaign messages
+
+Every debt records when it was last part of a delivered reminder
+(last_reminded_date) and how many reminders included it (reminder_count).
+The outbox worker updates both once WAHA accepts the message. An "all"
+campaign messages every indebted apartment. A "changed" campaign only
+messages apartments with a debt that was never reminded, or that fell due
+after its last reminder, and skips apartments reminded within the
+cooldown, so a routine weekly send only reaches what changed.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+REMINDER_COOLDOWN_HOURS = float(os.environ.get("REMINDER_COOLDOWN_HOURS", "72"))
+
+# Fields a campaign reads from each unpaid debt
+REMINDER_DEBT_PROJECTION = {
+    "apartment_id": 1, "amount": 1, "paid_amount": 1, "description": 1, "due_date": 1, "last_reminded_date": 1
+}
+
+
+def needs_reminder(debt: dict, now: datetime) -> bool:
+    """New since the last campaign, or overdue since its last reminder"""
+    last_reminded = debt.get("last_reminded_date")
+    if last_reminded is None:
+        return True
+    return last_reminded < debt["due_date"] <= now
+
+
+def select_apartments(debts_by_apartment: Dict[str, List[dict]], mode: str, now: datetime,
+                      cooldown: timedelta) -> Tuple[List[str], Dict[str, int]]:
+    """Return the apartment ids to message and how many were skipped as unchanged or cooling down"""
+    targets = []
+    skipped = {"unchanged": 0, "cooldown": 0}
+    for apartment_id, debts in debts_by_apartment.items():
+        if mode == "changed":
+            if not any(needs_reminder(debt, now) for debt in debts):
+                skipped["unchanged"] += 1
+                continue
+            reminded = [debt["last_reminded_date"] for debt in debts if debt.get("last_reminded_date")]
+            if reminded and now - max(reminded) < cooldown:
+                skipped["cooldown"] += 1
+                continue
+        targets.append(apartment_id)
+    return targets, skipped
@@ -0,0 +1,40 @@
+"""orjson-backed JSON responses
+
+FastAPI normally walks every returned value through jsonable_encoder and
+then json.dumps, which dominates the cost of large listings. Handlers that
+return many rows build plain dicts shaped like their declared response
+model and hand them to json_response, which renders them with orjson in a
+single pass. orjson encodes datetimes natively as ISO 8601, matching what
+jsonable_encoder produced.
+"""
+from decimal import Decimal
+from typing import Any, Optional
+
+import orjson
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+
+def _default(value: Any):
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+
+def json_response(content: Any, response: Optional[Response] = None, status_code: int = 200) -> FastJSONResponse:
+    """Render content directly, keeping headers already set on the handler's injected response"""
+    headers = None
+    if response is not None:
+        headers = {key: value for key, value in response.headers.items()
+                   if key not in ("content-length", "content-type")}
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
@@ -0,0 +1,87 @@
+"""Full-text search over announcements in Turkish and English
+
+A Mongo text index stems each document in one language, which would leave
+English notices unfindable by English word forms in a Turkish index and
+the other way round. So every announcement carries a "search" array with
+its title and content once per supported language, each element stemmed
+in its own language through the index's language override. A query is
+stemmed in one language (detected from its words, or chosen by the
+caller) and always finds a copy of every document stemmed the same way.
+Mongo's $search syntax applies: "quoted phrases" and -excluded words.
+
+The index leads with site_id, so a search only touches its own site's
+entries. Results rank by text score, boosted for urgent announcements, and
+page with a keyset cursor over (rank, created_date, _id).
+"""
+import re
+from typing import List, Optional
+
+from pymongo import UpdateOne
+
+import pagination
+
+SEARCH_LANGUAGES = ("turkish", "english")
+SEARCH_URGENT_BOOST = 1.5
+SEARCH_SORT = [("rank", -1), ("created_date", -1), ("_id", -1)]
+BACKFILL_BATCH_SIZE = 1000
+
+TURKISH_LETTERS = set("çğıöşüÇĞİÖŞÜ")
+TURKISH_WORDS = {"ve", "bir", "bu", "için", "ile", "da", "de", "ki", "olarak", "nedeniyle", "tarihinde", "saat",
+                 "su", "kesintisi", "toplantı", "aidat", "duyuru", "yarın", "bugün", "hakkında"}
+ENGLISH_WORDS = {"the", "and", "of", "to", "for", "is", "are", "will", "be", "on", "in", "at", "with", "about",
+                 "water", "meeting", "outage", "notice", "fee", "tomorrow", "today"}
+
+
+def search_fields(title: str, content: str) -> List[dict]:
+    """The "search" array stored on an announcement, one element per language"""
+    return [{"language": language, "title": title, "content": content} for language in SEARCH_LANGUAGES]
+
+
+def detect_language(text: str) -> str:
+    """Guess whether a query is Turkish or English, defaulting to Turkish"""
+    if any(letter in TURKISH_LETTERS for letter in text):
+        return "turkish"
+    words = re.findall(r"\w+", text.lower())
+    english = sum(word in ENGLISH_WORDS for word in words)
+    turkish = sum(word in TURKISH_WORDS for word in words)
+    return "english" if english > turkish else "turkish"
+
+
+def search_pipeline(site_id: str, query: str, language: str, projection: dict, limit: int,
+                    cursor: Optional[str] = None) -> List[dict]:
+    """Aggregation returning one page of a site's announcements matching query, best first
+
+    Raises ValueError for a malformed cursor.
+    """
+    pipeline = [
+        {"$match": {"site_id": site_id, "$text": {"$search": query, "$language": language}}},
+        {"$addFields": {"rank": {"$multiply": [
+            {"$meta": "textScore"}, {"$cond": ["$is_urgent", SEARCH_URGENT_BOOST, 1]}
+        ]}}},
+    ]
+    if cursor:
+        pipeline.append({"$match": pagination.keyset_filter(cursor, SEARCH_SORT)})
+    pipeline += [
+        {"$sort": dict(SEARCH_SORT)},
+        {"$limit": limit},
+        {"$project": projection},
+    ]
+    return pipeline
+
+
+async def backfill_announcements(db):
+    """Add the search array to announcements written before search existed"""
+    updates = []
+    updated = 0
+    async for announcement in db.announcements.find({"search": {"$exists": False}}, {"title": 1, "content": 1}):
+        updates.append(UpdateOne(
+            {"_id": announcement["_id"]},
+            {"$set": {"search": search_fields(announcement["title"], announcement["content"])}}
+        ))
+        if len(updates) == BACKFILL_BATCH_SIZE:
+            updated += (await db.announcements.bulk_write(updates, ordered=False)).modified_count
+            updates = []
+    if updates:
+        updated += (await db.announcements.bulk_write(updates, ordered=False)).modified_count
+    if updated:
+        print(f"Indexed {updated} announcements for search")
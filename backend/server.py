@@ -1,22 +1,48 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, UploadFile, File, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import hmac
 import os
 import uuid
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from motor.motor_asyncio import AsyncIOMotorClient
 import asyncio
-import hashlib
 import jwt
-import requests
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI(title="Residence Site Management API", version="1.0.0")
+from external_integrations.waha import waha_client
+import outbox
+import indexes
+import pagination
+import ledger
+import passwords
+import versions
+import events
+import exports
+import imports
+import metrics
+import sites
+import broadcast
+import reminders
+import billing
+import search
+import compression
+import late_fees
+import rollups
+from responses import FastJSONResponse, json_response
+
+app = FastAPI(
+    title="Residence Site Management API",
+    version="1.0.0",
+    default_response_class=FastJSONResponse
+)
 
 # CORS middleware
 app.add_middleware(
@@ -25,26 +51,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER],
 )
 
+# Brotli or gzip for large JSON and CSV bodies, configured by COMPRESSION_* variables
+app.add_middleware(compression.CompressionMiddleware)
+
+# Per-route latency, status and Mongo command metrics, served on /api/metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
 # MongoDB connection
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-DB_NAME = "residence_site"
-client = AsyncIOMotorClient(MONGO_URL)
+DB_NAME = os.environ.get('DB_NAME', 'residence_site')
+# One pool shared by every site; each request is scoped by the site_id in its token
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+client = AsyncIOMotorClient(MONGO_URL, maxPoolSize=MONGO_MAX_POOL_SIZE, event_listeners=[metrics.command_listener])
 db = client[DB_NAME]
 
 # Security
 security = HTTPBearer()
 SECRET_KEY = "your-secret-key-change-in-production"
-
-# WAHA WhatsApp Integration
-WAHA_BASE_URL = "http://fatihgezer.tr:3100"
+# /api/metrics requires "Authorization: Bearer <METRICS_TOKEN>" and is off while it is unset,
+# since nginx proxies all of /api to the public
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
 
 # Pydantic Models
 class UserLogin(BaseModel):
     username: str
     password: str
     language: Optional[str] = "tr"
+    site_id: Optional[str] = None  # defaults to DEFAULT_SITE_ID
 
 class UserResponse(BaseModel):
     id: str
@@ -53,6 +89,13 @@ class UserResponse(BaseModel):
     apartment_number: Optional[str] = None
     unit_type: str  # apartment or shop
     language: str = "tr"
+    must_change_password: bool = False
+    site_id: Optional[str] = None
+
+class LoginResponse(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    user: UserResponse
 
 class DebtCreate(BaseModel):
     apartment_id: str
@@ -61,16 +104,56 @@ class DebtCreate(BaseModel):
     due_date: datetime
     debt_type: str = "monthly_fee"  # monthly_fee, maintenance, heating, other
 
+class DebtTemplate(BaseModel):
+    amount: float
+    description: str
+    due_date: datetime
+    debt_type: str = "monthly_fee"
+
+class BulkDebtCreate(BaseModel):
+    template: DebtTemplate
+    billing_period: str  # Idempotency key, e.g. "2025-06"
+    unit_filter: str = "all"  # all, unit_type, apartments
+    unit_type: Optional[str] = None  # apartment or shop, with unit_filter="unit_type"
+    apartment_ids: Optional[List[str]] = None  # with unit_filter="apartments"
+
+class FeeScheduleCreate(BaseModel):
+    amount: float
+    description: str  # "{period}" is replaced with the billing period, e.g. "Aidat - {period}"
+    debt_type: str = "monthly_fee"
+    start_period: str  # First billing period, e.g. "2025-01"
+    interval_months: int = 1  # 1 monthly, 3 quarterly, 12 yearly
+    generate_day: int = 1  # Day of the month a period's debts are issued
+    due_day: int = 10  # Day of the month they fall due
+    unit_filter: str = "all"  # all, unit_type
+    unit_type: Optional[str] = None
+
+class LateFeeRule(BaseModel):
+    debt_type: str
+    monthly_rate: float = 0.0  # Per 30 days on the outstanding amount, e.g. 0.05
+    grace_days: int = 0
+    flat_fee: float = 0.0
+    max_rate: Optional[float] = None  # Cap on the total penalty as a fraction of the outstanding amount
+
+class LateFeeRun(BaseModel):
+    dry_run: bool = True
+    as_of: Optional[datetime] = None
+    rules: Optional[List[LateFeeRule]] = None  # The site's configured rules when omitted
+
 class DebtResponse(BaseModel):
     id: str
     apartment_id: str
+    apartment_number: Optional[str] = None
     amount: float
+    paid_amount: float = 0.0
     description: str
     due_date: datetime
     debt_type: str
     created_date: datetime
     is_paid: bool = False
     paid_date: Optional[datetime] = None
+    last_reminded_date: Optional[datetime] = None
+    reminder_count: int = 0
 
 class PaymentCreate(BaseModel):
     apartment_id: str
@@ -79,11 +162,27 @@ class PaymentCreate(BaseModel):
     payment_method: str = "bank_transfer"
     notes: Optional[str] = None
 
+class PaymentResponse(BaseModel):
+    id: str
+    apartment_id: str
+    debt_id: str
+    amount: float
+    payment_method: str
+    notes: Optional[str] = None
+    created_date: datetime
+
 class AnnouncementCreate(BaseModel):
     title: str
     content: str
     is_urgent: bool = False
 
+class AnnouncementResponse(BaseModel):
+    id: str
+    title: str
+    content: str
+    is_urgent: bool
+    created_date: datetime
+
 class VehicleInfo(BaseModel):
     vehicle_type: str  # car or motorcycle
     has_vehicle: bool = False
@@ -95,17 +194,33 @@ class HouseholdUpdate(BaseModel):
     contact_phone: Optional[str] = None
     vehicles: Optional[List[VehicleInfo]] = []
 
+class ApartmentResponse(BaseModel):
+    id: str
+    apartment_number: str
+    unit_type: str
+    occupant_count: int
+    contact_phone: Optional[str] = None
+    vehicles: List[VehicleInfo] = []
+    balance: float = 0.0
+
 class WhatsAppMessage(BaseModel):
     apartment_id: str
     message: str
 
-# Utility Functions
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+# List endpoint fields follow the response models; fields= selects a subset
+APARTMENT_FIELDS = list(ApartmentResponse.model_fields)
+APARTMENT_SORT = [("apartment_number", 1)]
+DEBT_FIELDS = list(DebtResponse.model_fields)
+DEBT_SORT = [("due_date", -1), ("_id", -1)]
+ANNOUNCEMENT_FIELDS = list(AnnouncementResponse.model_fields)
+ANNOUNCEMENT_SORT = [("created_date", -1), ("_id", -1)]
+PAYMENT_FIELDS = list(PaymentResponse.model_fields)
+PAYMENT_SORT = [("created_date", -1), ("_id", -1)]
 
-def verify_password(password: str, hashed: str) -> bool:
-    return hash_password(password) == hashed
+# Stream tickets put a short-lived token in the /api/events URL instead of the login token
+STREAM_TICKET_PURPOSE = "stream"
 
+# Utility Functions
 def create_jwt_token(data: dict):
     return jwt.encode(data, SECRET_KEY, algorithm="HS256")
 
@@ -115,155 +230,291 @@ def decode_jwt_token(token: str):
     except jwt.ExpiredSignatureError:
         return None
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_jwt_token(token)
-    if payload is None:
+def token_user(token: Optional[str], purpose: Optional[str] = None) -> dict:
+    """The user a token was issued to, raising 401 unless it is valid and issued for purpose"""
+    payload = decode_jwt_token(token) if token else None
+    # A leaked stream ticket must not work as an API token, nor the other way round
+    if payload is None or payload.get("purpose") != purpose:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    # Tokens issued before multi-site support belong to the default site
+    payload.setdefault("site_id", sites.DEFAULT_SITE_ID)
     return payload
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return token_user(credentials.credentials)
+
+async def get_stream_user(request: Request, ticket: Optional[str] = None):
+    """Authenticate an event stream by bearer token or, as EventSource cannot send headers, by ?ticket="""
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return token_user(authorization[7:])
+    return token_user(ticket, STREAM_TICKET_PURPOSE)
+
 async def send_whatsapp_message(phone_number: str, message: str) -> bool:
     """Send WhatsApp message via WAHA API"""
-    try:
-        # Format phone number for WhatsApp (Turkish format)
-        if phone_number.startswith("0"):
-            phone_number = "90" + phone_number[1:]  # Convert 05XX to 905XX
-        elif not phone_number.startswith("90"):
-            phone_number = "90" + phone_number
-        
-        chat_id = f"{phone_number}@c.us"
-        
-        payload = {
-            "chatId": chat_id,
-            "text": message
-        }
-        
-        response = requests.post(f"{WAHA_BASE_URL}/sendText", json=payload, timeout=30)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"WhatsApp send error: {e}")
-        return False
+    return await waha_client.send_text(phone_number, message)
+
+def debt_document(site_id: str, debt: DebtCreate, created_date: datetime) -> dict:
+    return {
+        "_id": str(uuid.uuid4()),
+        "site_id": site_id,
+        "apartment_id": debt.apartment_id,
+        "amount": debt.amount,
+        "description": debt.description,
+        "due_date": debt.due_date,
+        "debt_type": debt.debt_type,
+        "created_date": created_date,
+        "is_paid": False,
+        "paid_amount": 0.0,
+        "paid_date": None
+    }
+
+def household_fields(household: HouseholdUpdate) -> dict:
+    return {
+        "occupant_count": household.occupant_count,
+        "contact_phone": household.contact_phone,
+        "vehicles": [vehicle.dict() for vehicle in household.vehicles] if household.vehicles else []
+    }
+
+def household_vehicles(row: dict) -> List[dict]:
+    """Vehicles from the car_* and motorcycle_* columns of a household import row"""
+    vehicles = []
+    for vehicle_type in ("car", "motorcycle"):
+        plate_number = row.get(f"{vehicle_type}_plate")
+        model = row.get(f"{vehicle_type}_model")
+        if plate_number or model:
+            vehicles.append({
+                "vehicle_type": vehicle_type,
+                "has_vehicle": True,
+                "plate_number": plate_number or None,
+                "model": model or None
+            })
+    return vehicles
+
+async def site_apartment_ids(site_id: str) -> Dict[str, str]:
+    """Map apartment numbers to ids for a site"""
+    apartment_ids = {}
+    async for apartment in db.apartments.find({"site_id": site_id}, {"apartment_number": 1}):
+        apartment_ids[apartment["apartment_number"]] = apartment["_id"]
+    return apartment_ids
 
 # Initialize database collections and default data
 async def init_database():
-    """Initialize database with apartments and default admin"""
+    """Initialize every configured site with its units and default admin"""
+    # Sites are independent, so they are seeded concurrently
+    await asyncio.gather(*(init_site(site) for site in sites.load_sites()))
+
+async def init_site(site: dict):
+    """Initialize a site with apartments and default admin
     
-    # Create apartments (apartment01 to apartment62)
+    Every write is an idempotent upsert keyed on site_id and apartment_number
+    or username, so a warm restart costs a handful of round trips. Only a
+    new admin's password is hashed; residents start without a hash (see
+    passwords.py), so seeding costs at most one bcrypt hash per site.
+    """
     apartments_collection = db.apartments
     users_collection = db.users
+    site_id = site["site_id"]
+    units = sites.site_units(site)
+    now = datetime.utcnow()
     
-    # Check if apartments already exist
-    existing_count = await apartments_collection.count_documents({})
-    if existing_count == 0:
-        apartments = []
-        users = []
-        
-        # Create apartments
-        for i in range(1, 63):
-            apartment_num = f"apartment{i:02d}"
-            apartment_id = str(uuid.uuid4())
-            
-            apartment = {
-                "_id": apartment_id,
-                "apartment_number": apartment_num,
-                "unit_type": "apartment",
-                "occupant_count": 1,
-                "contact_phone": "",
-                "vehicles": [],
-                "created_date": datetime.utcnow()
-            }
-            apartments.append(apartment)
-            
-            # Create user for this apartment
-            user = {
+    # Create any missing apartments and shops
+    result = await apartments_collection.bulk_write([
+        UpdateOne(
+            {"site_id": site_id, "apartment_number": unit_number},
+            {"$setOnInsert": {
                 "_id": str(uuid.uuid4()),
-                "username": apartment_num,
-                "password": hash_password(apartment_num),  # Default password same as username
-                "role": "resident",
-                "apartment_id": apartment_id,
-                "apartment_number": apartment_num,
-                "unit_type": "apartment",
-                "language": "tr",
-                "must_change_password": True,
-                "created_date": datetime.utcnow()
-            }
-            users.append(user)
-        
-        # Create shops
-        for i in range(1, 3):
-            shop_num = f"shop{i:02d}"
-            shop_id = str(uuid.uuid4())
-            
-            shop = {
-                "_id": shop_id,
-                "apartment_number": shop_num,
-                "unit_type": "shop",
+                "unit_type": unit_type,
                 "occupant_count": 1,
                 "contact_phone": "",
                 "vehicles": [],
-                "created_date": datetime.utcnow()
-            }
-            apartments.append(shop)
-            
-            # Create user for this shop
-            user = {
-                "_id": str(uuid.uuid4()),
-                "username": shop_num,
-                "password": hash_password(shop_num),
-                "role": "resident",
-                "apartment_id": shop_id,
-                "apartment_number": shop_num,
-                "unit_type": "shop",
-                "language": "tr",
-                "must_change_password": True,
-                "created_date": datetime.utcnow()
-            }
-            users.append(user)
-        
-        # Insert all apartments and users
-        await apartments_collection.insert_many(apartments)
-        await users_collection.insert_many(users)
-        
-        # Create admin user
-        admin_user = {
+                "balance": 0.0,
+                "created_date": now
+            }},
+            upsert=True
+        )
+        for unit_number, unit_type in units
+    ], ordered=False)
+    if result.upserted_count:
+        await versions.bump(db, site_id, "apartments")
+    
+    apartment_ids = {}
+    async for apartment in apartments_collection.find(
+        {"site_id": site_id, "apartment_number": {"$in": [unit_number for unit_number, _ in units]}},
+        {"apartment_number": 1}
+    ):
+        apartment_ids[apartment["apartment_number"]] = apartment["_id"]
+    
+    existing_usernames = set()
+    async for user in users_collection.find(
+        {"site_id": site_id, "username": {"$in": [unit_number for unit_number, _ in units] + ["admin"]}},
+        {"username": 1}
+    ):
+        existing_usernames.add(user["username"])
+    
+    # Create a user for each unit, default password same as username
+    users = [{
+        "_id": str(uuid.uuid4()),
+        "username": unit_number,
+        "password": None,
+        "role": "resident",
+        "apartment_id": apartment_ids[unit_number],
+        "apartment_number": unit_number,
+        "unit_type": unit_type,
+        "language": "tr",
+        "must_change_password": True,
+        "created_date": now
+    } for unit_number, unit_type in units if unit_number not in existing_usernames]
+    
+    # Create admin user
+    if "admin" not in existing_usernames:
+        users.append({
             "_id": str(uuid.uuid4()),
             "username": "admin",
-            "password": hash_password("admin123"),  # Change this in production
+            # Change this in production
+            "password": await passwords.hash_password(site.get("admin_password", "admin123")),
             "role": "admin",
             "apartment_id": None,
             "apartment_number": None,
             "unit_type": "admin",
             "language": "tr",
             "must_change_password": False,
-            "created_date": datetime.utcnow()
-        }
-        await users_collection.insert_one(admin_user)
-        
-        print("Database initialized with 62 apartments, 2 shops, and admin user")
+            "created_date": now
+        })
+    
+    if users:
+        await users_collection.bulk_write([
+            UpdateOne(
+                {"site_id": site_id, "username": user.pop("username")},
+                {"$setOnInsert": user},
+                upsert=True
+            )
+            for user in users
+        ], ordered=False)
+        print(f"Site {site_id} initialized with {len(users)} new users for {len(units)} units")
+
+async def prepare_database():
+    """Create indexes and seed data in the background until it succeeds, recording progress for /api/ready"""
+    readiness = app.state.readiness
+    while True:
+        try:
+            # Documents from before multi-site support need a site_id before
+            # the site-scoped unique indexes can be built
+            await sites.backfill_site_id(db)
+            await search.backfill_announcements(db)
+            # Indexes first, so the unique keys back the seeding upserts
+            app.state.index_drift = await indexes.ensure_indexes(db)
+            readiness["indexes"] = True
+            # Apartments from before running balances get theirs computed once
+            backfilled = await ledger.backfill_balances(db)
+            if backfilled:
+                print(f"Backfilled the balance of {backfilled} apartments")
+            # Databases from before the rollups existed get them computed once
+            if not await db.monthly_rollups.find_one({}, {"_id": 1}) and await db.debts.find_one({}, {"_id": 1}):
+                print(f"Built {await ledger.rebuild_rollups(db)} monthly rollups")
+            await init_database()
+            readiness["seeded"] = True
+            readiness["error"] = None
+            return
+        except Exception as e:
+            readiness["error"] = repr(e)
+            print(f"Database preparation failed, retrying: {e!r}")
+            await asyncio.sleep(2)
 
 # API Endpoints
 
 @app.on_event("startup")
 async def startup_event():
-    await init_database()
+    # Start serving immediately; /api/ready reports when the database is prepared
+    app.state.readiness = {"indexes": False, "seeded": False, "error": None}
+    app.state.index_drift = {}
+    app.state.prepare_task = asyncio.create_task(prepare_database())
+    app.state.outbox_worker = asyncio.create_task(outbox.run_worker(db, waha_client))
+    # Cross-worker cache invalidation, and events when EVENTS_SOURCE=broadcast
+    app.state.broadcast_listener = asyncio.create_task(broadcast.listen(db))
+    app.state.fee_scheduler = asyncio.create_task(billing.run_scheduler(db, broadcast.WORKER_ID))
+    app.state.change_stream = None
+    if events.EVENTS_SOURCE == "change_stream":
+        app.state.change_stream = asyncio.create_task(events.watch_change_stream(db))
+    # Under gunicorn each worker's metrics are summed from snapshots in METRICS_DIR
+    app.state.metrics_flush = None
+    if metrics.METRICS_DIR:
+        app.state.metrics_flush = asyncio.create_task(metrics.flush_snapshots())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.prepare_task.cancel()
+    app.state.outbox_worker.cancel()
+    app.state.broadcast_listener.cancel()
+    app.state.fee_scheduler.cancel()
+    if app.state.change_stream:
+        app.state.change_stream.cancel()
+    if app.state.metrics_flush:
+        app.state.metrics_flush.cancel()
+    await waha_client.aclose()
 
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "database": DB_NAME}
 
-@app.post("/api/auth/login")
+@app.get("/api/ready")
+async def readiness_check(response: Response):
+    """Readiness probe: Mongo answers a ping and indexes and seed data are in place"""
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=2)
+        mongo = True
+    except Exception:
+        mongo = False
+    
+    readiness = app.state.readiness
+    ready = mongo and readiness["indexes"] and readiness["seeded"]
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    
+    return {
+        "status": "ready" if ready else "starting",
+        "database": DB_NAME,
+        "mongo": mongo,
+        "indexes": readiness["indexes"],
+        "seeded": readiness["seeded"],
+        "error": readiness["error"],
+        "broadcast": broadcast.listening,
+        "index_drift": app.state.index_drift
+    }
+
+@app.get("/api/metrics")
+async def get_metrics(request: Request):
+    """Prometheus metrics for request latency, status codes and Mongo commands (needs METRICS_TOKEN)"""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.post("/api/auth/login", response_model=LoginResponse)
 async def login(user_data: UserLogin):
     """Login for both residents and admin"""
     users_collection = db.users
     
-    user = await users_collection.find_one({"username": user_data.username})
-    if not user or not verify_password(user_data.password, user["password"]):
+    site_id = user_data.site_id or sites.DEFAULT_SITE_ID
+    user = await users_collection.find_one({"site_id": site_id, "username": user_data.username})
+    if not user:
+        await passwords.dummy_verify()
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # Verification runs in the hashing thread pool, not on the event loop
+    # Seeded residents have no hash until their first login; the default password is the username
+    valid, new_hash = await passwords.verify_password(user_data.password, user.get("password"), user["username"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    # Update user language preference
+    # Update user language preference, upgrading legacy password hashes on the way
+    update = {"language": user_data.language}
+    if new_hash:
+        update["password"] = new_hash
     await users_collection.update_one(
         {"_id": user["_id"]},
-        {"$set": {"language": user_data.language}}
+        {"$set": update}
     )
     
     token_data = {
@@ -271,6 +522,7 @@ async def login(user_data: UserLogin):
         "username": user["username"],
         "role": user["role"],
         "apartment_id": user.get("apartment_id"),
+        "site_id": site_id,
         "exp": datetime.utcnow() + timedelta(hours=24)
     }
     
@@ -286,28 +538,50 @@ async def login(user_data: UserLogin):
             "apartment_number": user.get("apartment_number"),
             "unit_type": user.get("unit_type"),
             "language": user_data.language,
-            "must_change_password": user.get("must_change_password", False)
+            "must_change_password": user.get("must_change_password", False),
+            "site_id": site_id
         }
     }
 
-@app.get("/api/apartments")
-async def get_apartments(current_user: dict = Depends(get_current_user)):
-    """Get all apartments (admin only)"""
+@app.get("/api/apartments", response_model=List[ApartmentResponse])
+async def get_apartments(
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get apartments page by page (admin only)"""
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
+    query = {"site_id": current_user["site_id"]}
+    try:
+        selected = pagination.parse_fields(fields, APARTMENT_FIELDS)
+        if cursor:
+            query.update(pagination.keyset_filter(cursor, APARTMENT_SORT))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    not_modified = await versions.conditional_response(
+        db, request, response, current_user["site_id"], "apartments", current_user["role"]
+    )
+    if not_modified:
+        return not_modified
+    
     apartments = []
-    async for apartment in db.apartments.find():
-        apartments.append({
-            "id": apartment["_id"],
-            "apartment_number": apartment["apartment_number"],
-            "unit_type": apartment["unit_type"],
-            "occupant_count": apartment["occupant_count"],
-            "contact_phone": apartment["contact_phone"],
-            "vehicles": apartment["vehicles"]
-        })
+    last = None
+    projection = pagination.mongo_projection(selected, APARTMENT_SORT)
+    async for apartment in db.apartments.find(query, projection).sort(APARTMENT_SORT).limit(limit):
+        apartment["id"] = apartment["_id"]
+        apartments.append({field: apartment.get(field) for field in selected})
+        last = apartment
+    
+    if len(apartments) == limit:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last, APARTMENT_SORT)
     
-    return apartments
+    return json_response(apartments, response)
 
 @app.post("/api/debts")
 async def create_debt(debt: DebtCreate, current_user: dict = Depends(get_current_user)):
@@ -315,50 +589,374 @@ async def create_debt(debt: DebtCreate, current_user: dict = Depends(get_current
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    debt_doc = {
+    # The apartment must belong to the caller's site
+    apartment = await db.apartments.find_one({"_id": debt.apartment_id, "site_id": current_user["site_id"]}, {"_id": 1})
+    if not apartment:
+        raise HTTPException(status_code=404, detail="Apartment not found")
+    
+    debt_doc = debt_document(current_user["site_id"], debt, datetime.utcnow())
+    
+    await ledger.record_debts(db, [debt_doc])
+    return {"message": "Debt created successfully", "debt_id": debt_doc["_id"]}
+
+@app.post("/api/debts/import")
+async def import_debts(
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Create opening debts from a CSV file (admin only)
+    
+    Columns: apartment_number, amount, description, due_date, debt_type.
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    site_id = current_user["site_id"]
+    apartment_ids = await site_apartment_ids(site_id)
+    now = datetime.utcnow()
+    
+    def parse_row(row: dict) -> dict:
+        apartment_id = apartment_ids.get(row.get("apartment_number"))
+        if not apartment_id:
+            raise imports.RowError(f"apartment_number: unknown unit {row.get('apartment_number')!r}")
+        debt = DebtCreate(
+            apartment_id=apartment_id,
+            amount=row.get("amount"),
+            description=row.get("description"),
+            due_date=row.get("due_date"),
+            debt_type=row.get("debt_type") or "monthly_fee"
+        )
+        if debt.amount <= 0:
+            raise imports.RowError("amount: must be positive")
+        return debt_document(site_id, debt, now)
+    
+    async def write_batch(debt_docs: List[dict]) -> int:
+        return await ledger.record_debts(db, debt_docs)
+    
+    try:
+        return await imports.run_import(file.file, parse_row, write_batch, dry_run)
+    except imports.ImportFileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/debts/bulk")
+async def create_debts_bulk(bulk: BulkDebtCreate, current_user: dict = Depends(get_current_user)):
+    """Issue the same debt to many units in one write (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    site_id = current_user["site_id"]
+    query = billing.unit_query(site_id, bulk.unit_filter, bulk.unit_type, bulk.apartment_ids)
+    if query is None:
+        raise HTTPException(status_code=400, detail="Invalid unit filter")
+    
+    # Units already billed for this period are skipped, and the unique
+    # (apartment_id, debt_type, billing_period) index backs this up for
+    # concurrent requests, so a repeated request only fills gaps
+    try:
+        result = await billing.issue_debts(
+            db, site_id, query, bulk.template.dict(), {bulk.billing_period: bulk.template.due_date}
+        )
+    except BulkWriteError:
+        raise HTTPException(status_code=409, detail="Billing period is being issued concurrently, please retry")
+    
+    return {
+        "message": "Debts created successfully",
+        "billing_period": bulk.billing_period,
+        **result
+    }
+
+@app.post("/api/fee-schedules")
+async def create_fee_schedule(schedule: FeeScheduleCreate, current_user: dict = Depends(get_current_user)):
+    """Add a recurring fee the scheduler issues every billing period (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    schedule_doc = {
         "_id": str(uuid.uuid4()),
-        "apartment_id": debt.apartment_id,
-        "amount": debt.amount,
-        "description": debt.description,
-        "due_date": debt.due_date,
-        "debt_type": debt.debt_type,
-        "created_date": datetime.utcnow(),
-        "is_paid": False,
-        "paid_date": None
+        "site_id": current_user["site_id"],
+        **schedule.dict(),
+        "active": True,
+        "last_period": None,
+        "last_run_date": None,
+        "created_by": current_user["user_id"],
+        "created_date": datetime.utcnow()
     }
+    try:
+        billing.validate_schedule(schedule_doc)
+    except billing.ScheduleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.fee_schedules.insert_one(schedule_doc)
     
-    await db.debts.insert_one(debt_doc)
-    return {"message": "Debt created successfully", "debt_id": debt_doc["_id"]}
+    return {"message": "Fee schedule created successfully", "id": schedule_doc["_id"]}
+
+@app.get("/api/fee-schedules")
+async def get_fee_schedules(current_user: dict = Depends(get_current_user)):
+    """List the site's recurring fees (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    schedules = await db.fee_schedules.find(
+        {"site_id": current_user["site_id"]}
+    ).sort("created_date", 1).to_list(None)
+    return [{"id": schedule.pop("_id"), **schedule} for schedule in schedules]
+
+@app.delete("/api/fee-schedules/{schedule_id}")
+async def delete_fee_schedule(schedule_id: str, current_user: dict = Depends(get_current_user)):
+    """Stop a recurring fee; debts it already issued are kept (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    result = await db.fee_schedules.update_one(
+        {"_id": schedule_id, "site_id": current_user["site_id"]}, {"$set": {"active": False}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Fee schedule not found")
+    
+    return {"message": "Fee schedule stopped successfully"}
 
-@app.get("/api/debts")
-async def get_debts(apartment_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    """Get debts - admin sees all, residents see only their own"""
+@app.post("/api/fee-schedules/{schedule_id}/run")
+async def run_fee_schedule(
+    schedule_id: str,
+    catch_up: bool = Query(False, description="Rescan every period since start_period, e.g. after adding units"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Issue a recurring fee's due periods now instead of waiting for the scheduler (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    schedule = await db.fee_schedules.find_one({"_id": schedule_id, "site_id": current_user["site_id"], "active": True})
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Fee schedule not found")
+    
+    try:
+        report = await billing.run_schedule(db, schedule, datetime.utcnow(), catch_up)
+    except BulkWriteError:
+        raise HTTPException(status_code=409, detail="Fee schedule is being issued concurrently, please retry")
+    
+    return {"message": "Fee schedule run completed", **report}
+
+@app.post("/api/late-fees/accrue")
+async def accrue_late_fees(run: LateFeeRun, current_user: dict = Depends(get_current_user)):
+    """Preview or issue late fees on the site's overdue debts (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
     
-    query = {}
+    now = datetime.utcnow()
+    as_of = run.as_of or now
+    if as_of.tzinfo:
+        # Stored dates are naive UTC
+        as_of = as_of.astimezone(timezone.utc).replace(tzinfo=None)
+    if not run.dry_run and as_of > now:
+        raise HTTPException(status_code=400, detail="Late fees can only be issued up to today")
+    
+    site_id = current_user["site_id"]
+    rules_by_site = {site_id: [rule.dict() for rule in run.rules]} if run.rules is not None else None
+    try:
+        return await late_fees.accrue(db, [site_id], as_of, run.dry_run, rules_by_site)
+    except late_fees.LateFeeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BulkWriteError:
+        raise HTTPException(status_code=409, detail="Late fees are being issued concurrently, please retry")
+
+@app.get("/api/reports/monthly")
+async def get_monthly_report(
+    request: Request,
+    response: Response,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    debt_type: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Billing, collection rate and arrears per month from the precomputed rollups (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    # The last 12 months by default
+    now = datetime.utcnow()
+    end = end or rollups.month_of(now)
+    start = start or rollups.month_of(now.replace(day=1) - timedelta(days=334))
+    
+    # The resolved range goes into the ETag, so the default one rolls over with the month
+    not_modified = await versions.conditional_response(
+        db, request, response, current_user["site_id"], "monthly_rollups", f"{start}:{end}"
+    )
+    if not_modified:
+        return not_modified
+    
+    try:
+        months = await rollups.monthly_report(db, current_user["site_id"], start, end, debt_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return json_response({
+        "site_id": current_user["site_id"],
+        "start": start,
+        "end": end,
+        "debt_type": debt_type,
+        "months": months
+    }, response)
+
+@app.get("/api/debts", response_model=List[DebtResponse])
+async def get_debts(
+    response: Response,
+    apartment_id: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get debts page by page - admin sees all, residents see only their own"""
+    
+    query = {"site_id": current_user["site_id"]}
     if current_user["role"] == "resident":
         query["apartment_id"] = current_user["apartment_id"]
     elif apartment_id:
         query["apartment_id"] = apartment_id
     
+    try:
+        selected = pagination.parse_fields(fields, DEBT_FIELDS)
+        if cursor:
+            query.update(pagination.keyset_filter(cursor, DEBT_SORT))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    pipeline = [
+        {"$match": query},
+        {"$sort": dict(DEBT_SORT)},
+        {"$limit": limit}
+    ]
+    projection = pagination.mongo_projection(selected, DEBT_SORT)
+    if "paid_amount" in selected:
+        projection["paid_amount"] = ledger.PAID_AMOUNT_EXPR
+    if "reminder_count" in selected:
+        projection["reminder_count"] = {"$ifNull": ["$reminder_count", 0]}
+    if "apartment_number" in selected:
+        # Join apartment numbers server-side so the whole page is a single
+        # aggregate command instead of one find_one per debt
+        pipeline.append({"$lookup": {
+            "from": "apartments",
+            "localField": "apartment_id",
+            "foreignField": "_id",
+            "as": "apartment"
+        }})
+        projection["apartment_number"] = {
+            "$ifNull": [{"$arrayElemAt": ["$apartment.apartment_number", 0]}, "Unknown"]
+        }
+    pipeline.append({"$project": projection})
+    
     debts = []
-    async for debt in db.debts.find(query).sort("due_date", -1):
-        # Get apartment info
-        apartment = await db.apartments.find_one({"_id": debt["apartment_id"]})
+    last = None
+    async for debt in db.debts.aggregate(pipeline):
+        debt["id"] = debt["_id"]
+        debts.append({field: debt.get(field) for field in selected})
+        last = debt
+    
+    if len(debts) == limit:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last, DEBT_SORT)
+    
+    return json_response(debts, response)
+
+@app.get("/api/debts/summary")
+async def get_debt_summary(by_debt_type: bool = False, current_user: dict = Depends(get_current_user)):
+    """Get outstanding, paid and overdue totals per apartment and overall - residents see only their own"""
+    
+    query = {"site_id": current_user["site_id"]}
+    if current_user["role"] == "resident":
+        query["apartment_id"] = current_user["apartment_id"]
+    
+    group_id = {"apartment_id": "$apartment_id"}
+    if by_debt_type:
+        group_id["debt_type"] = "$debt_type"
+    
+    unpaid = {"$eq": ["$is_paid", False]}
+    overdue = {"$and": [unpaid, {"$lt": ["$due_date", datetime.utcnow()]}]}
+    pipeline = [
+        {"$match": query},
+        {"$group": {
+            "_id": group_id,
+            "outstanding": {"$sum": {"$cond": [unpaid, ledger.REMAINING_AMOUNT_EXPR, 0]}},
+            "outstanding_count": {"$sum": {"$cond": [unpaid, 1, 0]}},
+            "paid": {"$sum": ledger.PAID_AMOUNT_EXPR},
+            "overdue": {"$sum": {"$cond": [overdue, ledger.REMAINING_AMOUNT_EXPR, 0]}},
+            "overdue_count": {"$sum": {"$cond": [overdue, 1, 0]}}
+        }},
+        {"$lookup": {
+            "from": "apartments",
+            "localField": "_id.apartment_id",
+            "foreignField": "_id",
+            "as": "apartment"
+        }},
+        {"$project": {
+            "outstanding": 1, "outstanding_count": 1, "paid": 1, "overdue": 1, "overdue_count": 1,
+            "apartment_number": {"$ifNull": [{"$arrayElemAt": ["$apartment.apartment_number", 0]}, "Unknown"]}
+        }},
+        {"$sort": {"apartment_number": 1, "_id.debt_type": 1}}
+    ]
+    
+    total_keys = ["outstanding", "outstanding_count", "paid", "overdue", "overdue_count"]
+    totals = {key: 0 for key in total_keys}
+    apartments = {}
+    async for row in db.debts.aggregate(pipeline):
+        apartment_id = row["_id"]["apartment_id"]
+        if apartment_id not in apartments:
+            apartments[apartment_id] = {
+                "apartment_id": apartment_id,
+                "apartment_number": row["apartment_number"],
+                **{key: 0 for key in total_keys}
+            }
+            if by_debt_type:
+                apartments[apartment_id]["by_debt_type"] = {}
         
-        debts.append({
-            "id": debt["_id"],
-            "apartment_id": debt["apartment_id"],
-            "apartment_number": apartment["apartment_number"] if apartment else "Unknown",
-            "amount": debt["amount"],
-            "description": debt["description"],
-            "due_date": debt["due_date"],
-            "debt_type": debt["debt_type"],
-            "created_date": debt["created_date"],
-            "is_paid": debt["is_paid"],
-            "paid_date": debt.get("paid_date")
-        })
+        apartment = apartments[apartment_id]
+        for key in total_keys:
+            apartment[key] += row[key]
+            totals[key] += row[key]
+        if by_debt_type:
+            apartment["by_debt_type"][row["_id"]["debt_type"]] = {key: row[key] for key in total_keys}
+    
+    return {"totals": totals, "apartments": list(apartments.values())}
+
+@app.get("/api/debts/export")
+async def export_debts(
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    apartment_id: Optional[str] = None,
+    is_paid: Optional[bool] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream the debt ledger as CSV or XLSX, filtered by due date, apartment and paid status (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
     
-    return debts
+    site_id = current_user["site_id"]
+    query = {"site_id": site_id}
+    if date_from or date_to:
+        query["due_date"] = {}
+        if date_from:
+            query["due_date"]["$gte"] = date_from
+        if date_to:
+            query["due_date"]["$lte"] = date_to
+    if apartment_id:
+        query["apartment_id"] = apartment_id
+    if is_paid is not None:
+        query["is_paid"] = is_paid
+    
+    # A site has at most a few hundred units, so their numbers are mapped
+    # up front instead of joining on every exported row
+    apartment_numbers = {}
+    async for apartment in db.apartments.find({"site_id": site_id}, {"apartment_number": 1}):
+        apartment_numbers[apartment["_id"]] = apartment["apartment_number"]
+    
+    cursor = db.debts.find(query, exports.EXPORT_PROJECTION).sort(DEBT_SORT).batch_size(exports.EXPORT_BATCH_SIZE)
+    stream = exports.stream_xlsx if format == "xlsx" else exports.stream_csv
+    filename = f"debts-{site_id}-{datetime.utcnow():%Y%m%d}.{format}"
+    return StreamingResponse(
+        stream(cursor, apartment_numbers),
+        media_type=exports.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @app.post("/api/debts/{debt_id}/pay")
 async def mark_debt_paid(debt_id: str, current_user: dict = Depends(get_current_user)):
@@ -366,16 +964,86 @@ async def mark_debt_paid(debt_id: str, current_user: dict = Depends(get_current_
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    result = await db.debts.update_one(
-        {"_id": debt_id},
-        {"$set": {"is_paid": True, "paid_date": datetime.utcnow()}}
-    )
-    
-    if result.matched_count == 0:
+    debt = await db.debts.find_one({"_id": debt_id, "site_id": current_user["site_id"]})
+    if not debt:
         raise HTTPException(status_code=404, detail="Debt not found")
     
+    # Settle the remaining amount as a payment so the apartment balance follows
+    if not debt["is_paid"]:
+        remaining = debt["amount"] - debt.get("paid_amount", 0.0)
+        try:
+            result = await ledger.record_payment(
+                db, current_user["site_id"], debt["apartment_id"], debt_id, remaining, "manual", None,
+                current_user["user_id"]
+            )
+        except ledger.PaymentError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        await events.publish_debt_events(db, "debt_paid", [result["debt"]])
+    
     return {"message": "Debt marked as paid"}
 
+@app.post("/api/payments")
+async def create_payment(payment: PaymentCreate, current_user: dict = Depends(get_current_user)):
+    """Record a full or partial payment against a debt (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    try:
+        result = await ledger.record_payment(
+            db, current_user["site_id"], payment.apartment_id, payment.debt_id, payment.amount,
+            payment.payment_method, payment.notes, current_user["user_id"]
+        )
+    except ledger.PaymentError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    await events.publish_debt_events(db, "debt_paid" if result["is_paid"] else "debt_updated", [result["debt"]])
+    
+    return {
+        "message": "Payment recorded successfully",
+        "payment_id": result["payment"]["_id"],
+        "remaining_amount": result["remaining_amount"],
+        "is_paid": result["is_paid"]
+    }
+
+@app.get("/api/payments", response_model=List[PaymentResponse])
+async def get_payments(
+    response: Response,
+    apartment_id: Optional[str] = None,
+    debt_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get payments page by page - admin sees all, residents see only their own"""
+    
+    query = {"site_id": current_user["site_id"]}
+    if current_user["role"] == "resident":
+        query["apartment_id"] = current_user["apartment_id"]
+    elif apartment_id:
+        query["apartment_id"] = apartment_id
+    if debt_id:
+        query["debt_id"] = debt_id
+    
+    try:
+        selected = pagination.parse_fields(fields, PAYMENT_FIELDS)
+        if cursor:
+            query.update(pagination.keyset_filter(cursor, PAYMENT_SORT))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    payments = []
+    last = None
+    projection = pagination.mongo_projection(selected, PAYMENT_SORT)
+    async for payment in db.payments.find(query, projection).sort(PAYMENT_SORT).limit(limit):
+        payment["id"] = payment["_id"]
+        payments.append({field: payment.get(field) for field in selected})
+        last = payment
+    
+    if len(payments) == limit:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last, PAYMENT_SORT)
+    
+    return json_response(payments, response)
+
 @app.post("/api/announcements")
 async def create_announcement(announcement: AnnouncementCreate, current_user: dict = Depends(get_current_user)):
     """Create announcement (admin only)"""
@@ -384,40 +1052,141 @@ async def create_announcement(announcement: AnnouncementCreate, current_user: di
     
     announcement_doc = {
         "_id": str(uuid.uuid4()),
+        "site_id": current_user["site_id"],
         "title": announcement.title,
         "content": announcement.content,
         "is_urgent": announcement.is_urgent,
         "created_date": datetime.utcnow(),
-        "created_by": current_user["user_id"]
+        "created_by": current_user["user_id"],
+        "search": search.search_fields(announcement.title, announcement.content)
     }
     
     await db.announcements.insert_one(announcement_doc)
+    await versions.bump(db, current_user["site_id"], "announcements")
+    await events.publish_announcement_created(db, announcement_doc)
     return {"message": "Announcement created successfully"}
 
-@app.get("/api/announcements")
-async def get_announcements(current_user: dict = Depends(get_current_user)):
-    """Get all announcements"""
+@app.get("/api/announcements", response_model=List[AnnouncementResponse])
+async def get_announcements(
+    request: Request,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get announcements page by page, newest first"""
+    query = {"site_id": current_user["site_id"]}
+    try:
+        selected = pagination.parse_fields(fields, ANNOUNCEMENT_FIELDS)
+        if cursor:
+            query.update(pagination.keyset_filter(cursor, ANNOUNCEMENT_SORT))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    not_modified = await versions.conditional_response(
+        db, request, response, current_user["site_id"], "announcements", "all"
+    )
+    if not_modified:
+        return not_modified
+    
     announcements = []
-    async for announcement in db.announcements.find().sort("created_date", -1).limit(20):
-        announcements.append({
-            "id": announcement["_id"],
-            "title": announcement["title"],
-            "content": announcement["content"],
-            "is_urgent": announcement["is_urgent"],
-            "created_date": announcement["created_date"]
-        })
+    last = None
+    projection = pagination.mongo_projection(selected, ANNOUNCEMENT_SORT)
+    async for announcement in db.announcements.find(query, projection).sort(ANNOUNCEMENT_SORT).limit(limit):
+        announcement["id"] = announcement["_id"]
+        announcements.append({field: announcement.get(field) for field in selected})
+        last = announcement
+    
+    if len(announcements) == limit:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last, ANNOUNCEMENT_SORT)
+    
+    return json_response(announcements, response)
+
+@app.get("/api/announcements/search", response_model=List[AnnouncementResponse])
+async def search_announcements(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    language: Optional[str] = Query(None, description="turkish or english; detected from q when omitted"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Search announcements by title and content, most relevant and urgent first"""
+    if language is None:
+        language = search.detect_language(q)
+    elif language not in search.SEARCH_LANGUAGES:
+        raise HTTPException(status_code=400, detail="Unsupported search language")
+    try:
+        selected = pagination.parse_fields(fields, ANNOUNCEMENT_FIELDS)
+        pipeline = search.search_pipeline(
+            current_user["site_id"], q, language,
+            pagination.mongo_projection(selected, search.SEARCH_SORT), limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    not_modified = await versions.conditional_response(
+        db, request, response, current_user["site_id"], "announcements", "search"
+    )
+    if not_modified:
+        return not_modified
+    
+    announcements = []
+    last = None
+    async for announcement in db.announcements.aggregate(pipeline):
+        announcement["id"] = announcement["_id"]
+        announcements.append({field: announcement.get(field) for field in selected})
+        last = announcement
+    
+    if len(announcements) == limit:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last, search.SEARCH_SORT)
     
-    return announcements
+    return json_response(announcements, response)
+
+@app.post("/api/events/ticket")
+async def create_stream_ticket(current_user: dict = Depends(get_current_user)):
+    """Issue a short-lived ticket for opening the event stream, which ends up in access logs"""
+    ticket = create_jwt_token({
+        **{field: current_user.get(field) for field in ("user_id", "username", "role", "apartment_id", "site_id")},
+        "purpose": STREAM_TICKET_PURPOSE,
+        "exp": datetime.utcnow() + timedelta(seconds=events.EVENTS_TICKET_SECONDS)
+    })
+    return {"ticket": ticket, "expires_in": events.EVENTS_TICKET_SECONDS}
+
+@app.get("/api/events")
+async def stream_events(current_user: dict = Depends(get_stream_user)):
+    """Server-sent events for new announcements and debt changes the user may see"""
+    subscriber = events.bus.subscribe(current_user["site_id"], current_user["role"], current_user.get("apartment_id"))
+    return StreamingResponse(
+        events.bus.stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/whatsapp/send-debt-reminders")
-async def send_debt_reminders(current_user: dict = Depends(get_current_user)):
-    """Send WhatsApp debt reminders to all residents with unpaid debts (admin only)"""
+async def send_debt_reminders(
+    mode: str = Query("all", pattern="^(all|changed)$"),
+    cooldown_hours: Optional[float] = Query(None, ge=0),
+    current_user: dict = Depends(get_current_user)
+):
+    """Queue WhatsApp debt reminders to residents with unpaid debts (admin only)
+    
+    mode=changed only messages apartments with new or newly overdue debts
+    that were not reminded within the cooldown.
+    """
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
+    site_id = current_user["site_id"]
+    now = datetime.utcnow()
+    cooldown = timedelta(hours=reminders.REMINDER_COOLDOWN_HOURS if cooldown_hours is None else cooldown_hours)
+    
     # Find all unpaid debts
     unpaid_debts = []
-    async for debt in db.debts.find({"is_paid": False}):
+    async for debt in db.debts.find({"site_id": site_id, "is_paid": False}, reminders.REMINDER_DEBT_PROJECTION):
         unpaid_debts.append(debt)
     
     # Group debts by apartment
@@ -428,18 +1197,26 @@ async def send_debt_reminders(current_user: dict = Depends(get_current_user)):
             debts_by_apartment[apartment_id] = []
         debts_by_apartment[apartment_id].append(debt)
     
-    sent_count = 0
+    targets, skipped = reminders.select_apartments(debts_by_apartment, mode, now, cooldown)
+    
+    # Fetch every targeted apartment in one query
+    apartments = {}
+    async for apartment in db.apartments.find({"site_id": site_id, "_id": {"$in": targets}}):
+        apartments[apartment["_id"]] = apartment
+    
     failed_count = 0
+    outgoing = []
     
-    for apartment_id, debts in debts_by_apartment.items():
-        # Get apartment info
-        apartment = await db.apartments.find_one({"_id": apartment_id})
+    for apartment_id in targets:
+        debts = debts_by_apartment[apartment_id]
+        apartment = apartments.get(apartment_id)
         if not apartment or not apartment.get("contact_phone"):
             failed_count += 1
             continue
         
-        # Calculate total debt
-        total_debt = sum(debt["amount"] for debt in debts)
+        # Partial payments are left out of both the lines and the total
+        remaining = {debt["_id"]: debt["amount"] - (debt.get("paid_amount") or 0.0) for debt in debts}
+        total_debt = sum(remaining.values())
         
         # Create message
         message = f"""Sayın {apartment['apartment_number']} Sakini,
@@ -451,24 +1228,44 @@ Borç Detayları:"""
         
         for debt in debts:
             due_date = debt["due_date"].strftime("%d.%m.%Y")
-            message += f"\n• {debt['description']}: {debt['amount']:.2f} TL (Vade: {due_date})"
+            message += f"\n• {debt['description']}: {remaining[debt['_id']]:.2f} TL (Vade: {due_date})"
         
         message += "\n\nLütfen en kısa sürede ödemenizi yapınız.\nTeşekkürler."
-        
-        # Send WhatsApp message
-        success = await send_whatsapp_message(apartment["contact_phone"], message)
-        if success:
-            sent_count += 1
-        else:
-            failed_count += 1
+        outgoing.append({
+            "apartment_id": apartment_id,
+            "phone": apartment["contact_phone"],
+            "text": message,
+            "debt_ids": [debt["_id"] for debt in debts]
+        })
+    
+    # Hand the fan-out to the outbox worker and return immediately
+    job, created = await outbox.enqueue_job(
+        db, site_id, "debt_reminders", current_user["user_id"], outgoing, skipped_count=failed_count
+    )
     
     return {
-        "message": f"Debt reminders sent",
-        "sent_count": sent_count,
-        "failed_count": failed_count,
-        "total_apartments_with_debt": len(debts_by_apartment)
+        "message": "Debt reminders queued" if created else "Debt reminders already in progress",
+        "job_id": job["_id"],
+        "queued_count": job["total_count"],
+        "failed_count": job["skipped_count"],
+        "total_apartments_with_debt": len(debts_by_apartment),
+        "mode": mode,
+        "unchanged_count": skipped["unchanged"],
+        "cooldown_count": skipped["cooldown"]
     }
 
+@app.get("/api/whatsapp/jobs/{job_id}")
+async def get_reminder_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Get progress of a reminder job (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    progress = await outbox.get_job_progress(db, current_user["site_id"], job_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return progress
+
 @app.put("/api/apartments/{apartment_id}/household")
 async def update_household_info(apartment_id: str, household: HouseholdUpdate, current_user: dict = Depends(get_current_user)):
     """Update household information"""
@@ -476,30 +1273,72 @@ async def update_household_info(apartment_id: str, household: HouseholdUpdate, c
     if current_user["role"] == "resident" and current_user["apartment_id"] != apartment_id:
         raise HTTPException(status_code=403, detail="Can only update your own apartment")
     
-    update_data = {
-        "occupant_count": household.occupant_count,
-        "contact_phone": household.contact_phone,
-        "vehicles": [vehicle.dict() for vehicle in household.vehicles] if household.vehicles else []
-    }
-    
     result = await db.apartments.update_one(
-        {"_id": apartment_id},
-        {"$set": update_data}
+        {"_id": apartment_id, "site_id": current_user["site_id"]},
+        {"$set": household_fields(household)}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Apartment not found")
+    await versions.bump(db, current_user["site_id"], "apartments")
     
     return {"message": "Household information updated successfully"}
 
-@app.get("/api/apartments/{apartment_id}")
-async def get_apartment_details(apartment_id: str, current_user: dict = Depends(get_current_user)):
+@app.post("/api/apartments/import")
+async def import_households(
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Update household information for many units from a CSV file (admin only)
+    
+    Columns: apartment_number, occupant_count, contact_phone, car_plate,
+    car_model, motorcycle_plate, motorcycle_model.
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    site_id = current_user["site_id"]
+    apartment_ids = await site_apartment_ids(site_id)
+    
+    def parse_row(row: dict) -> UpdateOne:
+        apartment_id = apartment_ids.get(row.get("apartment_number"))
+        if not apartment_id:
+            raise imports.RowError(f"apartment_number: unknown unit {row.get('apartment_number')!r}")
+        household = HouseholdUpdate(
+            occupant_count=row.get("occupant_count"),
+            contact_phone=row.get("contact_phone") or None,
+            vehicles=household_vehicles(row)
+        )
+        return UpdateOne({"_id": apartment_id, "site_id": site_id}, {"$set": household_fields(household)})
+    
+    async def write_batch(operations: List[UpdateOne]) -> int:
+        result = await db.apartments.bulk_write(operations, ordered=False)
+        return result.matched_count
+    
+    try:
+        report = await imports.run_import(file.file, parse_row, write_batch, dry_run)
+    except imports.ImportFileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if report["written_count"]:
+        await versions.bump(db, site_id, "apartments")
+    return report
+
+@app.get("/api/apartments/{apartment_id}", response_model=ApartmentResponse)
+async def get_apartment_details(apartment_id: str, request: Request, response: Response,
+                                current_user: dict = Depends(get_current_user)):
     """Get apartment details"""
     # Residents can only view their own apartment, admins can view any
     if current_user["role"] == "resident" and current_user["apartment_id"] != apartment_id:
         raise HTTPException(status_code=403, detail="Can only view your own apartment")
     
-    apartment = await db.apartments.find_one({"_id": apartment_id})
+    not_modified = await versions.conditional_response(
+        db, request, response, current_user["site_id"], "apartments", current_user["role"]
+    )
+    if not_modified:
+        return not_modified
+    
+    apartment = await db.apartments.find_one({"_id": apartment_id, "site_id": current_user["site_id"]})
     if not apartment:
         raise HTTPException(status_code=404, detail="Apartment not found")
     
@@ -509,7 +1348,8 @@ async def get_apartment_details(apartment_id: str, current_user: dict = Depends(
         "unit_type": apartment["unit_type"],
         "occupant_count": apartment["occupant_count"],
         "contact_phone": apartment["contact_phone"],
-        "vehicles": apartment["vehicles"]
+        "vehicles": apartment["vehicles"],
+        "balance": apartment.get("balance", 0.0)
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+"""Residence sites served by one deployment and how each one is seeded
+
+Every document in a site-owned collection carries a site_id, and the
+site_id in the caller's JWT scopes every query. Sites come from the JSON
+file named by SITES_FILE, for example:
+
+    [{"site_id": "gul-sitesi", "name": "Gül Sitesi", "admin_password": "...",
+      "units": [{"prefix": "apartment", "unit_type": "apartment", "count": 120},
+                {"prefix": "shop", "unit_type": "shop", "count": 4}]}]
+
+Without SITES_FILE a single site with 62 apartments and 2 shops is served,
+matching the original single-site layout.
+"""
+import json
+import os
+from typing import List, Tuple
+
+DEFAULT_SITE_ID = os.environ.get("DEFAULT_SITE_ID", "default")
+SITES_FILE = os.environ.get("SITES_FILE")
+
+DEFAULT_UNITS = [
+    {"prefix": "apartment", "unit_type": "apartment", "count": 62},
+    {"prefix": "shop", "unit_type": "shop", "count": 2},
+]
+
+# Collections whose documents belong to exactly one site
+SITE_COLLECTIONS = ["users", "apartments", "debts", "payments", "announcements", "reminder_jobs", "whatsapp_outbox"]
+
+
+def load_sites() -> List[dict]:
+    if not SITES_FILE:
+        return [{"site_id": DEFAULT_SITE_ID, "name": "Residence Site", "units": DEFAULT_UNITS}]
+    with open(SITES_FILE) as f:
+        return json.load(f)
+
+
+def site_units(site: dict) -> List[Tuple[str, str]]:
+    """(unit number, unit type) pairs for a site, e.g. apartment01 to apartment62"""
+    units = []
+    for group in site.get("units", DEFAULT_UNITS):
+        width = max(2, len(str(group["count"])))
+        units += [(f"{group['prefix']}{i:0{width}d}", group["unit_type"]) for i in range(1, group["count"] + 1)]
+    return units
+
+
+async def backfill_site_id(db):
+    """Assign documents written before multi-site support to the default site"""
+    for collection in SITE_COLLECTIONS:
+        result = await db[collection].update_many(
+            {"site_id": {"$exists": False}}, {"$set": {"site_id": DEFAULT_SITE_ID}}
+        )
+        if result.modified_count:
+            print(f"Assigned {result.modified_count} {collection} documents to site {DEFAULT_SITE_ID}")
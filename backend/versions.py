@@ -0,0 +1,129 @@
+"""Per-collection version stamps backing conditional GETs
+
+Every write to a collection served with an ETag bumps that collection's
+stamp for the site in the collection_versions collection. A read first
+loads the stamp with a single _id lookup, and when it matches the client's
+If-None-Match or If-Modified-Since the list query is skipped and a 304 is
+returned.
+
+Stamps are also cached in process while the broadcast channel is
+listening. A bump drops the local entry and broadcasts an invalidation so
+every other worker drops its own. Bumps made inside a transaction are
+invalidated by the caller once it commits, so no worker reloads the
+pre-commit stamp.
+"""
+import calendar
+import hashlib
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+import broadcast
+
+_cache: Dict[str, Tuple[int, Optional[datetime]]] = {}
+# Bumped on every invalidation so a load that raced with one is not cached
+_generations: Dict[str, int] = {}
+
+
+def _stamp_id(site_id: str, collection: str) -> str:
+    return f"{site_id}:{collection}"
+
+
+def _drop(stamp_ids):
+    for stamp_id in stamp_ids:
+        _generations[stamp_id] = _generations.get(stamp_id, 0) + 1
+        _cache.pop(stamp_id, None)
+
+
+def _clear():
+    for stamp_id in list(_cache):
+        _drop([stamp_id])
+
+
+async def _on_invalidate(message: dict):
+    if message["worker"] != broadcast.WORKER_ID:
+        _drop(message["stamps"])
+
+
+broadcast.subscribe("invalidate", _on_invalidate)
+broadcast.on_reset(_clear)
+
+
+async def invalidate(db, site_id: str, *collections: str):
+    """Drop cached stamps here and in every other worker"""
+    stamp_ids = [_stamp_id(site_id, collection) for collection in collections]
+    _drop(stamp_ids)
+    await broadcast.publish(db, "invalidate", {"stamps": stamp_ids})
+
+
+async def bump(db, site_id: str, *collections: str, session=None):
+    """Mark collections of a site as modified"""
+    now = datetime.utcnow()
+    for collection in collections:
+        await db.collection_versions.update_one(
+            {"_id": _stamp_id(site_id, collection)},
+            {"$inc": {"version": 1}, "$set": {"modified": now}},
+            upsert=True,
+            session=session
+        )
+    if session is None:
+        await invalidate(db, site_id, *collections)
+
+
+async def get_version(db, site_id: str, collection: str) -> Tuple[int, Optional[datetime]]:
+    stamp_id = _stamp_id(site_id, collection)
+    if broadcast.listening and stamp_id in _cache:
+        return _cache[stamp_id]
+
+    generation = _generations.get(stamp_id, 0)
+    stamp = await db.collection_versions.find_one({"_id": stamp_id})
+    version = (stamp["version"], stamp["modified"]) if stamp else (0, None)
+    if broadcast.listening and _generations.get(stamp_id, 0) == generation:
+        _cache[stamp_id] = version
+    return version
+
+
+def make_etag(collection: str, version: int, variant: str) -> str:
+    # The variant covers the query string and the caller's visibility, which
+    # change the body without changing the collection
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:12]
+    return f'W/"{collection}-{version}-{digest}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored on both sides
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+async def conditional_response(db, request: Request, response: Response, site_id: str, collection: str,
+                               scope: str) -> Optional[Response]:
+    """Set ETag and Last-Modified on response, returning a 304 response when the client copy is current"""
+    version, modified = await get_version(db, site_id, collection)
+    etag = make_etag(collection, version, f"{site_id}|{scope}|{request.url.path}?{request.url.query}")
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if modified:
+        # HTTP dates have second resolution
+        modified = modified.replace(microsecond=0)
+        headers["Last-Modified"] = formatdate(calendar.timegm(modified.utctimetuple()), usegmt=True)
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return None
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return None
+        if modified <= since:
+            return Response(status_code=304, headers=headers)
+    return None
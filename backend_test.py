@@ -1,8 +1,12 @@
 import requests
 import json
+import csv
 from datetime import datetime, timedelta
 import sys
+import os
 import time
+import uuid
+import asyncio
 
 class ResidenceSiteAPITester:
     def __init__(self, base_url):
@@ -15,6 +19,7 @@ class ResidenceSiteAPITester:
         self.tests_passed = 0
         self.created_debt_id = None
         self.apartment_id = None
+        self.reminder_job_id = None
         
     def run_test(self, name, method, endpoint, expected_status, data=None, headers=None, params=None):
         """Run a single API test"""
@@ -29,6 +34,8 @@ class ResidenceSiteAPITester:
                 response = requests.post(url, json=data, headers=headers, timeout=10)
             elif method == 'PUT':
                 response = requests.put(url, json=data, headers=headers, timeout=10)
+            elif method == 'DELETE':
+                response = requests.delete(url, headers=headers, timeout=10)
             
             success = response.status_code == expected_status
             if success:
@@ -50,6 +57,20 @@ class ResidenceSiteAPITester:
             print(f"❌ Failed - Error: {str(e)}")
             return False, {}
     
+    def test_readiness(self):
+        """Test the readiness probe reports Mongo, indexes and seeding"""
+        success, response = self.run_test(
+            "Readiness Probe",
+            "GET",
+            "api/ready",
+            200
+        )
+        
+        if success:
+            print(f"Readiness: {response}")
+            return response["mongo"] and response["indexes"] and response["seeded"]
+        return False
+    
     def test_admin_login(self):
         """Test admin login"""
         success, response = self.run_test(
@@ -86,6 +107,64 @@ class ResidenceSiteAPITester:
             return True
         return False
     
+    def test_legacy_password_rehash(self):
+        """Test legacy SHA-256 hashes still verify and are upgraded to bcrypt"""
+        self.tests_run += 1
+        print("\n🔍 Testing Legacy Password Rehash...")
+        
+        try:
+            import hashlib
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import passwords
+            
+            legacy = hashlib.sha256(b"apartment01").hexdigest()
+            
+            async def run():
+                wrong = await passwords.verify_password("wrong", legacy)
+                valid, new_hash = await passwords.verify_password("apartment01", legacy)
+                upgraded = await passwords.verify_password("apartment01", new_hash)
+                return wrong, valid, new_hash, upgraded
+            
+            wrong, valid, new_hash, upgraded = asyncio.run(run())
+            if not wrong[0] and valid and new_hash.startswith("$2") and upgraded == (True, None):
+                self.tests_passed += 1
+                print("✅ Passed - Legacy hash verified and upgraded to bcrypt")
+                return True
+            print("❌ Failed - Legacy hash was not upgraded")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_default_password_unhashed(self):
+        """Test a seeded account without a hash accepts only its default password, then gets a bcrypt hash"""
+        self.tests_run += 1
+        print("\n🔍 Testing Unhashed Default Password...")
+        
+        try:
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import passwords
+            
+            async def run():
+                wrong = await passwords.verify_password("wrong", None, "apartment01")
+                no_default = await passwords.verify_password("apartment01", None)
+                valid, new_hash = await passwords.verify_password("apartment01", None, "apartment01")
+                hashed = await passwords.verify_password("apartment01", new_hash)
+                return wrong, no_default, valid, new_hash, hashed
+            
+            wrong, no_default, valid, new_hash, hashed = asyncio.run(run())
+            if not wrong[0] and not no_default[0] and valid and new_hash.startswith("$2") and hashed == (True, None):
+                self.tests_passed += 1
+                print("✅ Passed - Default password verified and hashed on first login")
+                return True
+            print("❌ Failed - Unhashed account did not verify as expected")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
     def test_get_apartments_admin(self):
         """Test getting apartments as admin"""
         if not self.admin_headers:
@@ -155,6 +234,234 @@ class ResidenceSiteAPITester:
             return True
         return False
     
+    def test_create_debts_bulk(self):
+        """Test bulk debt issuance is idempotent per billing period"""
+        if not self.admin_headers or not self.apartment_id:
+            print("❌ Admin not logged in or no apartment ID, skipping test")
+            return False
+        
+        data = {
+            "template": {
+                "amount": 150.0,
+                "description": "Monthly Fee - Bulk Test",
+                "due_date": (datetime.now() + timedelta(days=30)).isoformat(),
+                "debt_type": "monthly_fee"
+            },
+            "billing_period": f"test-{uuid.uuid4()}",
+            "unit_filter": "apartments",
+            "apartment_ids": [self.apartment_id]
+        }
+        
+        success_first, first = self.run_test(
+            "Create Debts Bulk",
+            "POST",
+            "api/debts/bulk",
+            200,
+            headers=self.admin_headers,
+            data=data
+        )
+        success_repeat, repeat = self.run_test(
+            "Create Debts Bulk (Repeated Period)",
+            "POST",
+            "api/debts/bulk",
+            200,
+            headers=self.admin_headers,
+            data=data
+        )
+        
+        if success_first and success_repeat:
+            print(f"First: {first['inserted_count']} inserted, repeat: {repeat['skipped_count']} skipped")
+            return first["inserted_count"] == 1 and repeat["inserted_count"] == 0
+        return False
+    
+    def test_fee_schedule_catch_up(self):
+        """Test a recurring fee backfills missed periods once and a repeated run issues nothing"""
+        if not self.admin_headers:
+            print("❌ Admin not logged in, skipping test")
+            return False
+        
+        today = datetime.now()
+        start = today.year * 12 + today.month - 1 - 2
+        success, created = self.run_test(
+            "Create Fee Schedule",
+            "POST",
+            "api/fee-schedules",
+            200,
+            headers=self.admin_headers,
+            data={
+                "amount": 75.0,
+                "description": "Test Fee - {period}",
+                # A type of its own keeps the test out of the site's real billing periods
+                "debt_type": f"test-{uuid.uuid4()}",
+                "start_period": f"{start // 12:04d}-{start % 12 + 1:02d}",
+                "generate_day": 1,
+                "due_day": 10,
+                "unit_filter": "unit_type",
+                "unit_type": "shop"
+            }
+        )
+        if not success:
+            return False
+        
+        schedule_path = f"api/fee-schedules/{created['id']}"
+        success_first, first = self.run_test(
+            "Run Fee Schedule (Catch-Up)",
+            "POST",
+            f"{schedule_path}/run?catch_up=true",
+            200,
+            headers=self.admin_headers
+        )
+        success_repeat, repeat = self.run_test(
+            "Run Fee Schedule (Repeated)",
+            "POST",
+            f"{schedule_path}/run?catch_up=true",
+            200,
+            headers=self.admin_headers
+        )
+        self.run_test("Stop Fee Schedule", "DELETE", schedule_path, 200, headers=self.admin_headers)
+        
+        if success_first and success_repeat:
+            print(f"Periods: {', '.join(first['periods'])}, first: {first['inserted_count']} inserted, "
+                  f"repeat: {repeat['skipped_count']} skipped")
+            return (len(first["periods"]) == 3 and first["inserted_count"] > 0
+                    and repeat["inserted_count"] == 0 and repeat["skipped_count"] == first["inserted_count"])
+        return False
+    
+    def test_late_fee_preview(self):
+        """Test a late-fee dry run previews penalties without issuing any (admin only)"""
+        if not self.admin_headers:
+            print("❌ Admin not logged in, skipping test")
+            return False
+        
+        success, response = self.run_test(
+            "Preview Late Fees",
+            "POST",
+            "api/late-fees/accrue",
+            200,
+            headers=self.admin_headers,
+            data={
+                "dry_run": True,
+                "rules": [{"debt_type": "monthly_fee", "monthly_rate": 0.05, "grace_days": 5, "max_rate": 0.5}]
+            }
+        )
+        duplicate_rejected, _ = self.run_test(
+            "Preview Late Fees With Duplicate Rules (Should Fail)",
+            "POST",
+            "api/late-fees/accrue",
+            400,
+            headers=self.admin_headers,
+            data={
+                "dry_run": True,
+                "rules": [{"debt_type": "monthly_fee", "monthly_rate": 0.05},
+                          {"debt_type": "monthly_fee", "flat_fee": 10.0}]
+            }
+        )
+        
+        if success and duplicate_rejected:
+            print(f"Open debts: {response['open_debt_count']}, penalties: {response['penalty_count']} "
+                  f"totalling {response['total_amount']}")
+            return (response["inserted_count"] == 0
+                    and len(response["preview"]) == min(response["penalty_count"], 100))
+        return False
+    
+    def test_monthly_report(self):
+        """Test the monthly report picks up a new debt and its payment straight away (admin only)"""
+        if not self.admin_headers or not self.apartment_id:
+            print("❌ Admin not logged in or no apartment ID, skipping test")
+            return False
+        
+        month = datetime.utcnow().strftime("%Y-%m")
+        params = {"start": month, "end": month, "debt_type": "maintenance"}
+        
+        def current_month():
+            success, response = self.run_test(
+                "Get Monthly Report", "GET", "api/reports/monthly", 200, headers=self.admin_headers, params=params
+            )
+            return response["months"][0] if success and len(response["months"]) == 1 else None
+        
+        before = current_month()
+        success, debt = self.run_test(
+            "Create Debt For Report",
+            "POST",
+            "api/debts",
+            200,
+            headers=self.admin_headers,
+            data={
+                "apartment_id": self.apartment_id,
+                "amount": 100.0,
+                "description": "Monthly Report Test",
+                "due_date": datetime.utcnow().isoformat(),
+                "debt_type": "maintenance"
+            }
+        )
+        if not before or not success:
+            return False
+        self.run_test(
+            "Record Payment For Report",
+            "POST",
+            "api/payments",
+            200,
+            headers=self.admin_headers,
+            data={"apartment_id": self.apartment_id, "debt_id": debt["debt_id"], "amount": 40.0}
+        )
+        after = current_month()
+        self.run_test(
+            "Get Monthly Report With Bad Range (Should Fail)",
+            "GET",
+            "api/reports/monthly",
+            400,
+            headers=self.admin_headers,
+            params={"start": month, "end": "2000-01"}
+        )
+        
+        if not after:
+            return False
+        print(f"{month}: collection rate {after['collection_rate']}, arrears {after['arrears']}")
+        return (after["billed_count"] == before["billed_count"] + 1
+                and abs(after["billed_amount"] - before["billed_amount"] - 100.0) < 0.01
+                and abs(after["settled_amount"] - before["settled_amount"] - 40.0) < 0.01
+                and abs(after["collected_amount"] - before["collected_amount"] - 40.0) < 0.01
+                and abs(after["arrears"] - before["arrears"] - 60.0) < 0.01)
+    
+    def test_late_fee_empty_frames(self):
+        """Test late-fee penalties stay numeric with no open debts or no earlier charges (in-process)"""
+        self.tests_run += 1
+        print("\n🔍 Testing Late Fee Empty Frames...")
+        
+        try:
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import late_fees
+            
+            rules = late_fees.rules_frame({"default": late_fees.DEFAULT_LATE_FEE_RULES})
+            overdue = {
+                "_id": str(uuid.uuid4()),
+                "site_id": "default",
+                "apartment_id": str(uuid.uuid4()),
+                "amount": 100.0,
+                "paid_amount": None,
+                "description": "Overdue",
+                "due_date": datetime(2025, 1, 1),
+                "debt_type": "monthly_fee"
+            }
+            counts = []
+            for debts in ([], [overdue]):
+                penalties = late_fees.compute_penalties(
+                    late_fees.debts_frame(debts), late_fees.charged_frame([]), rules, datetime(2025, 3, 2)
+                )
+                # nlargest is what the dry-run preview uses, and it rejects object columns
+                counts.append(len(penalties.nlargest(late_fees.LATE_FEE_PREVIEW_ROWS, "penalty")))
+            
+            if counts == [0, 1]:
+                self.tests_passed += 1
+                print("✅ Passed - Penalties are computed for empty frames")
+                return True
+            print(f"❌ Failed - Expected [0, 1] penalties, got {counts}")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
     def test_get_debts_admin(self):
         """Test getting all debts as admin"""
         if not self.admin_headers:
@@ -179,6 +486,40 @@ class ResidenceSiteAPITester:
             return True
         return False
     
+    def test_get_debts_pagination(self):
+        """Test keyset pagination and field projection on debts"""
+        if not self.admin_headers:
+            print("❌ Admin not logged in, skipping test")
+            return False
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Get Debts Pagination...")
+        
+        try:
+            url = f"{self.base_url}/api/debts"
+            params = {"limit": 1, "fields": "amount,due_date"}
+            first = requests.get(url, headers=self.admin_headers, params=params, timeout=10)
+            cursor = first.headers.get("X-Next-Cursor")
+            page = first.json()
+            
+            if first.status_code != 200 or len(page) > 1 or (page and set(page[0]) != {"id", "amount", "due_date"}):
+                print(f"❌ Failed - Unexpected first page: {first.status_code} {page}")
+                return False
+            
+            if cursor:
+                second = requests.get(url, headers=self.admin_headers, params={**params, "cursor": cursor}, timeout=10)
+                if second.status_code != 200 or (second.json() and second.json()[0]["id"] == page[0]["id"]):
+                    print(f"❌ Failed - Second page repeats the first: {second.json()}")
+                    return False
+            
+            self.tests_passed += 1
+            print("✅ Passed - Pages are disjoint and projected")
+            return True
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
     def test_get_debts_resident(self):
         """Test getting debts as resident (should only see their own)"""
         if not self.resident_headers:
@@ -198,6 +539,38 @@ class ResidenceSiteAPITester:
             return True
         return False
     
+    def test_get_debt_summary(self):
+        """Test the server-side debt summary (admin and resident)"""
+        if not self.admin_headers:
+            print("❌ Admin not logged in, skipping test")
+            return False
+            
+        success, response = self.run_test(
+            "Get Debt Summary (Admin)",
+            "GET",
+            "api/debts/summary",
+            200,
+            headers=self.admin_headers,
+            params={"by_debt_type": "true"}
+        )
+        
+        if success:
+            print(f"Site totals: {response['totals']} across {len(response['apartments'])} apartments")
+        
+        if not self.resident_headers:
+            return success
+        
+        success_resident, response_resident = self.run_test(
+            "Get Debt Summary (Resident)",
+            "GET",
+            "api/debts/summary",
+            200,
+            headers=self.resident_headers
+        )
+        
+        # Residents only see their own apartment
+        return success and success_resident and len(response_resident["apartments"]) <= 1
+    
     def test_pay_debt(self):
         """Test marking a debt as paid (admin only)"""
         if not self.admin_headers or not self.created_debt_id:
@@ -214,6 +587,65 @@ class ResidenceSiteAPITester:
         
         return success
     
+    def test_partial_payment(self):
+        """Test a partial payment lowers the debt and the apartment balance"""
+        if not self.admin_headers or not self.apartment_id:
+            print("❌ Admin not logged in or no apartment ID, skipping test")
+            return False
+        
+        success, debt = self.run_test(
+            "Create Debt For Payment",
+            "POST",
+            "api/debts",
+            200,
+            headers=self.admin_headers,
+            data={
+                "apartment_id": self.apartment_id,
+                "amount": 150.0,
+                "description": "Partial Payment Test",
+                "due_date": (datetime.now() + timedelta(days=30)).isoformat(),
+                "debt_type": "maintenance"
+            }
+        )
+        if not success:
+            return False
+        
+        _, before = self.run_test(
+            "Get Apartment Balance (Before Payment)",
+            "GET",
+            f"api/apartments/{self.apartment_id}",
+            200,
+            headers=self.admin_headers
+        )
+        success, payment = self.run_test(
+            "Record Partial Payment",
+            "POST",
+            "api/payments",
+            200,
+            headers=self.admin_headers,
+            data={"apartment_id": self.apartment_id, "debt_id": debt["debt_id"], "amount": 50.0}
+        )
+        _, after = self.run_test(
+            "Get Apartment Balance (After Payment)",
+            "GET",
+            f"api/apartments/{self.apartment_id}",
+            200,
+            headers=self.admin_headers
+        )
+        self.run_test(
+            "Record Overpayment (Should Fail)",
+            "POST",
+            "api/payments",
+            400,
+            headers=self.admin_headers,
+            data={"apartment_id": self.apartment_id, "debt_id": debt["debt_id"], "amount": 500.0}
+        )
+        
+        if success and before and after:
+            print(f"Balance {before['balance']} -> {after['balance']}, remaining {payment['remaining_amount']}")
+            return payment["remaining_amount"] == 100.0 and round(before["balance"] - after["balance"], 2) == 50.0
+        return False
+    
     def test_pay_debt_resident(self):
         """Test marking a debt as paid as resident (should fail)"""
         if not self.resident_headers or not self.created_debt_id:
@@ -251,6 +683,95 @@ class ResidenceSiteAPITester:
         
         return success
     
+    def test_announcement_event_stream(self):
+        """Test a new announcement is pushed to a resident's event stream"""
+        if not self.admin_headers or not self.resident_token:
+            print("❌ Admin or resident not logged in, skipping test")
+            return False
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Announcement Event Stream...")
+        
+        try:
+            import threading
+            
+            received = []
+            ticket = requests.post(
+                f"{self.base_url}/api/events/ticket",
+                headers={"Authorization": f"Bearer {self.resident_token}"},
+                timeout=10
+            ).json()["ticket"]
+            stream = requests.get(
+                f"{self.base_url}/api/events",
+                params={"ticket": ticket},
+                stream=True,
+                timeout=10
+            )
+            
+            def read_events():
+                for line in stream.iter_lines(decode_unicode=True):
+                    if line.startswith("event: "):
+                        received.append(line[len("event: "):])
+                        break
+            
+            reader = threading.Thread(target=read_events, daemon=True)
+            reader.start()
+            requests.post(
+                f"{self.base_url}/api/announcements",
+                json={"title": "Event Stream Test", "content": "Pushed to open streams.", "is_urgent": False},
+                headers=self.admin_headers,
+                timeout=10
+            )
+            reader.join(timeout=10)
+            stream.close()
+            
+            if received == ["announcement_created"]:
+                self.tests_passed += 1
+                print("✅ Passed - Announcement pushed to the stream")
+                return True
+            print(f"❌ Failed - Received {received}")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_debt_events_coalesced(self):
+        """Test a write touching many debts publishes one event per site, scoped for residents (in-process)"""
+        self.tests_run += 1
+        print("\n🔍 Testing Debt Event Coalescing...")
+        
+        try:
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import events
+            
+            admin = events.bus.subscribe("coalesce-test", "admin", None)
+            resident = events.bus.subscribe("coalesce-test", "resident", "apartment-a")
+            debts = [{"site_id": "coalesce-test", "apartment_id": apartment_id}
+                     for apartment_id in ["apartment-a", "apartment-b", "apartment-b"]]
+            # The local source publishes straight to this process's bus
+            events.EVENTS_SOURCE = "local"
+            asyncio.run(events.publish_debt_events(None, "debt_created", debts))
+            
+            admin_events = [admin.event_data(admin.queue.get_nowait()) for _ in range(admin.queue.qsize())]
+            resident_events = [resident.event_data(resident.queue.get_nowait())
+                               for _ in range(resident.queue.qsize())]
+            events.bus.unsubscribe(admin)
+            events.bus.unsubscribe(resident)
+            print(f"Admin received {admin_events}, resident received {resident_events}")
+            
+            if (admin_events == [{"count": 3, "apartment_ids": ["apartment-a", "apartment-b"]}]
+                    and resident_events == [{"count": 1, "apartment_ids": ["apartment-a"]}]):
+                self.tests_passed += 1
+                print("✅ Passed - One event per write, narrowed to the resident's apartment")
+                return True
+            print("❌ Failed - Events were not coalesced or not scoped")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
     def test_create_announcement_resident(self):
         """Test creating an announcement as resident (should fail)"""
         if not self.resident_headers:
@@ -272,6 +793,43 @@ class ResidenceSiteAPITester:
         
         return success
     
+    def test_search_announcements(self):
+        """Test a resident finds an announcement by a word of its content"""
+        if not self.admin_headers or not self.resident_headers:
+            print("❌ Admin or resident not logged in, skipping test")
+            return False
+        
+        token = uuid.uuid4().hex
+        success_create, _ = self.run_test(
+            "Create Announcement For Search",
+            "POST",
+            "api/announcements",
+            200,
+            headers=self.admin_headers,
+            data={
+                "title": f"Su kesintisi {token}",
+                "content": "Yarın 10:00-14:00 arasında su kesintileri yaşanacaktır. Water outages expected tomorrow.",
+                "is_urgent": False
+            }
+        )
+        if not success_create:
+            return False
+        
+        results = {}
+        for language, words in (("turkish", "kesinti"), ("english", "outage")):
+            success, response = self.run_test(
+                f"Search Announcements ({language})",
+                "GET",
+                "api/announcements/search",
+                200,
+                headers=self.resident_headers,
+                params={"q": f'"{token}" {words}', "language": language, "limit": 5}
+            )
+            results[language] = success and any(token in item["title"] for item in response)
+        
+        print(f"Found by Turkish query: {results['turkish']}, by English query: {results['english']}")
+        return all(results.values())
+    
     def test_get_announcements(self):
         """Test getting announcements (both admin and resident)"""
         if not self.admin_headers:
@@ -306,6 +864,103 @@ class ResidenceSiteAPITester:
         
         return success_admin and success_resident
     
+    def test_announcements_conditional_get(self):
+        """Test a matching If-None-Match on announcements gets a 304"""
+        if not self.resident_headers:
+            print("❌ Resident not logged in, skipping test")
+            return False
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Announcements Conditional GET...")
+        
+        try:
+            url = f"{self.base_url}/api/announcements"
+            first = requests.get(url, headers=self.resident_headers, timeout=10)
+            etag = first.headers.get("ETag")
+            second = requests.get(url, headers={**self.resident_headers, "If-None-Match": etag}, timeout=10)
+            
+            if first.status_code == 200 and etag and second.status_code == 304:
+                self.tests_passed += 1
+                print(f"✅ Passed - ETag {etag} revalidated with 304")
+                return True
+            print(f"❌ Failed - Got {first.status_code} with ETag {etag}, then {second.status_code}")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_export_debts(self):
+        """Test the debt ledger streams as CSV with the paid filter applied"""
+        if not self.admin_headers:
+            print("❌ Admin not logged in, skipping test")
+            return False
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Debt Export...")
+        
+        try:
+            response = requests.get(
+                f"{self.base_url}/api/debts/export",
+                headers=self.admin_headers,
+                params={"format": "csv", "is_paid": "false"},
+                timeout=30
+            )
+            lines = response.content.decode("utf-8-sig").splitlines()
+            header = lines[0].split(",") if lines else []
+            is_paid_column = header.index("is_paid") if "is_paid" in header else None
+            rows = list(csv.reader(lines[1:]))
+            
+            # Legacy debts have no paid_amount: a paid one exports as fully paid
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import exports
+            legacy = {"_id": "legacy", "apartment_id": "a1", "amount": 70.0, "is_paid": True}
+            legacy_row = exports.export_row(legacy, {"a1": "1"})
+            legacy_amounts = legacy_row[exports.EXPORT_COLUMNS.index("paid_amount"):][:2]
+            
+            if (response.status_code == 200 and response.headers.get("Content-Type", "").startswith("text/csv")
+                    and is_paid_column is not None and all(row[is_paid_column] == "False" for row in rows)
+                    and legacy_amounts == [70.0, 0.0]):
+                self.tests_passed += 1
+                print(f"✅ Passed - Exported {len(rows)} unpaid debts")
+                return True
+            print(f"❌ Failed - Got {response.status_code} with header {header}, legacy row {legacy_row}")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_compressed_debts(self):
+        """Test a large debt listing is sent gzip-compressed and a small one as is"""
+        if not self.admin_headers:
+            print("❌ Admin not logged in, skipping test")
+            return False
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Response Compression...")
+        
+        try:
+            large = requests.get(f"{self.base_url}/api/debts", params={"limit": 500}, timeout=30,
+                                 headers={**self.admin_headers, "Accept-Encoding": "gzip"})
+            small = requests.get(f"{self.base_url}/api/debts", params={"limit": 1, "fields": "id"}, timeout=30,
+                                 headers={**self.admin_headers, "Accept-Encoding": "gzip"})
+            large_encoding = large.headers.get("Content-Encoding")
+            small_encoding = small.headers.get("Content-Encoding")
+            
+            # requests decodes the body transparently, so the JSON must still parse
+            if (large.status_code == 200 and small.status_code == 200 and isinstance(large.json(), list)
+                    and (large_encoding == "gzip" or len(large.content) < 1024) and small_encoding is None):
+                self.tests_passed += 1
+                print(f"✅ Passed - {len(large.json())} debts sent with Content-Encoding {large_encoding}")
+                return True
+            print(f"❌ Failed - Got Content-Encoding {large_encoding} and {small_encoding}")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
     def test_whatsapp_integration(self):
         """Test WhatsApp debt reminder integration (admin only)"""
         if not self.admin_headers:
@@ -322,6 +977,47 @@ class ResidenceSiteAPITester:
         
         if success:
             print(f"WhatsApp integration response: {response}")
+            self.reminder_job_id = response.get('job_id')
+        
+        return success
+    
+    def test_whatsapp_job_progress(self):
+        """Test getting reminder job progress (admin only)"""
+        if not self.admin_headers or not self.reminder_job_id:
+            print("❌ Admin not logged in or no reminder job ID, skipping test")
+            return False
+            
+        success, response = self.run_test(
+            "Get Reminder Job Progress",
+            "GET",
+            f"api/whatsapp/jobs/{self.reminder_job_id}",
+            200,
+            headers=self.admin_headers
+        )
+        
+        if success:
+            print(f"Sent: {response['sent_count']}, Failed: {response['failed_count']}, Pending: {response['pending_count']}")
+        
+        return success
+    
+    def test_whatsapp_changed_campaign(self):
+        """Test a changed-only reminder campaign reports what it skipped (admin only)"""
+        if not self.admin_headers:
+            print("❌ Admin not logged in, skipping test")
+            return False
+            
+        success, response = self.run_test(
+            "Send Changed-Only Debt Reminders",
+            "POST",
+            "api/whatsapp/send-debt-reminders?mode=changed&cooldown_hours=24",
+            200,
+            headers=self.admin_headers
+        )
+        
+        if success:
+            print(f"Queued: {response['queued_count']}, Unchanged: {response['unchanged_count']}, "
+                  f"Cooling down: {response['cooldown_count']}")
+            return response["mode"] == "changed"
         
         return success
     
@@ -353,6 +1049,86 @@ class ResidenceSiteAPITester:
         
         return success
     
+    def test_import_households_dry_run(self):
+        """Test a household CSV import validates rows and reports errors without writing"""
+        if not self.admin_headers:
+            print("❌ Admin not logged in, skipping test")
+            return False
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Household Import Dry Run...")
+        
+        try:
+            csv_data = (
+                "apartment_number,occupant_count,contact_phone,car_plate,car_model\n"
+                "apartment01,3,+905551234567,34 ABC 123,Fiat Egea\n"
+                "apartment999,2,,,\n"
+                "apartment02,not-a-number,,,\n"
+            )
+            response = requests.post(
+                f"{self.base_url}/api/apartments/import",
+                headers=self.admin_headers,
+                params={"dry_run": "true"},
+                files={"file": ("households.csv", csv_data, "text/csv")},
+                timeout=30
+            )
+            report = response.json() if response.status_code == 200 else {}
+            error_lines = [error["line"] for error in report.get("errors", [])]
+            
+            if (report.get("valid_rows") == 1 and report.get("written_count") == 0
+                    and error_lines == [3, 4]):
+                self.tests_passed += 1
+                print(f"✅ Passed - Report: {report}")
+                return True
+            print(f"❌ Failed - Got {response.status_code}: {response.text}")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_import_households_cp1254(self):
+        """Test a Windows-1254 household CSV imports and an undecodable one is rejected whole"""
+        if not self.admin_headers:
+            print("❌ Admin not logged in, skipping test")
+            return False
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Household Import Encodings...")
+        
+        try:
+            header = "apartment_number,occupant_count,contact_phone,car_plate,car_model\n"
+            turkish = (header + "apartment01,3,,34 ABC 123,Tofaş Şahin\n").encode("cp1254")
+            response = requests.post(
+                f"{self.base_url}/api/apartments/import",
+                headers=self.admin_headers,
+                params={"dry_run": "true"},
+                files={"file": ("households.csv", turkish, "text/csv")},
+                timeout=30
+            )
+            report = response.json() if response.status_code == 200 else {}
+            
+            # 0x81 is undefined in both UTF-8 and Windows-1254
+            unreadable = (header + "apartment01,3,,,\n").encode() + b"apartment02,2,,,Ford\x81\n"
+            rejected = requests.post(
+                f"{self.base_url}/api/apartments/import",
+                headers=self.admin_headers,
+                files={"file": ("households.csv", unreadable, "text/csv")},
+                timeout=30
+            )
+            
+            if (report.get("encoding") == "cp1254" and report.get("valid_rows") == 1
+                    and rejected.status_code == 400 and "Line 3" in rejected.json().get("detail", "")):
+                self.tests_passed += 1
+                print(f"✅ Passed - Report: {report}, rejected: {rejected.json()}")
+                return True
+            print(f"❌ Failed - Got {response.status_code}: {response.text}, {rejected.status_code}: {rejected.text}")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
     def test_get_apartment_details(self):
         """Test getting apartment details"""
         if not self.resident_headers or not self.apartment_id:
@@ -372,10 +1148,402 @@ class ResidenceSiteAPITester:
         
         return success
     
+    def test_get_debts_query_count(self):
+        """Test GET /api/debts issues a constant number of Mongo commands (needs local MongoDB)"""
+        self.tests_run += 1
+        print("\n🔍 Testing Get Debts Query Count...")
+        
+        try:
+            from pymongo import monitoring
+            from fastapi import Response
+            
+            class CommandCounter(monitoring.CommandListener):
+                def __init__(self):
+                    self.commands = []
+                def started(self, event):
+                    self.commands.append(event.command_name)
+                def succeeded(self, event):
+                    pass
+                def failed(self, event):
+                    pass
+            
+            # Listeners must be registered before the server creates its client
+            counter = CommandCounter()
+            monitoring.register(counter)
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import server
+            
+            server.db = server.client["residence_site_query_count_test"]
+            admin = {"user_id": "test-admin", "role": "admin", "apartment_id": None, "site_id": "default"}
+            
+            async def count_for(row_count):
+                await server.db.debts.delete_many({})
+                await server.db.apartments.delete_many({})
+                apartment_ids = [str(uuid.uuid4()) for _ in range(10)]
+                await server.db.apartments.insert_many([
+                    {"_id": apartment_id, "site_id": "default", "apartment_number": f"apartment{i:02d}"}
+                    for i, apartment_id in enumerate(apartment_ids, 1)
+                ])
+                await server.db.debts.insert_many([{
+                    "_id": str(uuid.uuid4()),
+                    "site_id": "default",
+                    "apartment_id": apartment_ids[i % len(apartment_ids)],
+                    "amount": 100.0,
+                    "description": f"Debt {i}",
+                    "due_date": datetime.utcnow(),
+                    "debt_type": "monthly_fee",
+                    "created_date": datetime.utcnow(),
+                    "is_paid": False,
+                    "paid_date": None
+                } for i in range(row_count)])
+                
+                counter.commands.clear()
+                result = await server.get_debts(
+                    Response(), apartment_id=None, limit=1000, cursor=None, fields=None, current_user=admin
+                )
+                debts = json.loads(result.body)
+                # getMore only pages the same cursor, it is not a new query
+                queries = [name for name in counter.commands if name != "getMore"]
+                return len(debts), len(queries)
+            
+            async def run():
+                try:
+                    return await count_for(10), await count_for(2000)
+                finally:
+                    await server.client.drop_database("residence_site_query_count_test")
+            
+            (small_rows, small_queries), (large_rows, large_queries) = asyncio.run(run())
+            print(f"{small_rows} debts -> {small_queries} queries, {large_rows} debts -> {large_queries} queries")
+            
+            if small_queries == large_queries:
+                self.tests_passed += 1
+                print("✅ Passed - Query count is independent of row count")
+                return True
+            print("❌ Failed - Query count grows with row count")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_balance_backfill(self):
+        """Test apartments without a stored balance get one from their unpaid debts (needs local MongoDB)"""
+        self.tests_run += 1
+        print("\n🔍 Testing Balance Backfill...")
+        
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import ledger
+            
+            async def run():
+                client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+                db = client["residence_site_balance_test"]
+                try:
+                    apartment_id = str(uuid.uuid4())
+                    # Seeded before running balances existed: no balance field
+                    await db.apartments.insert_one({"_id": apartment_id, "site_id": "default",
+                                                    "apartment_number": "apartment01"})
+                    now = datetime.utcnow()
+                    debt = {"site_id": "default", "apartment_id": apartment_id, "description": "Old debt",
+                            "due_date": now, "debt_type": "monthly_fee", "created_date": now}
+                    unpaid_id = str(uuid.uuid4())
+                    await db.debts.insert_many([
+                        {**debt, "_id": unpaid_id, "amount": 100.0, "is_paid": False, "paid_date": None},
+                        {**debt, "_id": str(uuid.uuid4()), "amount": 50.0, "paid_amount": 20.0, "is_paid": False,
+                         "paid_date": None},
+                        {**debt, "_id": str(uuid.uuid4()), "amount": 70.0, "is_paid": True, "paid_date": now}
+                    ])
+                    backfilled = await ledger.backfill_balances(db)
+                    after_backfill = (await db.apartments.find_one({"_id": apartment_id}))["balance"]
+                    await ledger.record_payment(db, "default", apartment_id, unpaid_id, 100.0, "cash", None, "test")
+                    after_payment = (await db.apartments.find_one({"_id": apartment_id}))["balance"]
+                    return backfilled, after_backfill, after_payment
+                finally:
+                    await client.drop_database("residence_site_balance_test")
+                    client.close()
+            
+            backfilled, after_backfill, after_payment = asyncio.run(run())
+            print(f"Backfilled {backfilled}: balance {after_backfill}, after paying the 100 TL debt {after_payment}")
+            
+            if backfilled == 1 and after_backfill == 130.0 and after_payment == 30.0:
+                self.tests_passed += 1
+                print("✅ Passed - Balance backfilled from the unpaid debts")
+                return True
+            print("❌ Failed - Expected a balance of 130 then 30")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_billed_query_plan(self):
+        """Test the already-billed lookup of bulk issuance is served by an index (needs local MongoDB)"""
+        self.tests_run += 1
+        print("\n🔍 Testing Billed Period Query Plan...")
+        
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import billing
+            import indexes
+            
+            def index_names(plan):
+                names = [plan["indexName"]] if "indexName" in plan else []
+                for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+                    if child:
+                        names += index_names(child)
+                return names
+            
+            async def run():
+                client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+                db = client["residence_site_billed_query_test"]
+                try:
+                    await indexes.ensure_indexes(db)
+                    apartment_ids = [str(uuid.uuid4()) for _ in range(20)]
+                    periods = [f"2024-{month:02d}" for month in range(1, 13)]
+                    await db.debts.insert_many([
+                        {"_id": str(uuid.uuid4()), "site_id": "default", "apartment_id": apartment_id,
+                         "debt_type": "monthly_fee", "billing_period": period, "amount": 100.0,
+                         "due_date": datetime.utcnow(), "is_paid": False}
+                        for apartment_id in apartment_ids for period in periods
+                    ])
+                    query = billing.billed_query("default", "monthly_fee", periods[-2:], apartment_ids)
+                    plan = await db.debts.find(query, {"apartment_id": 1, "billing_period": 1}).explain()
+                    return index_names(plan["queryPlanner"]["winningPlan"]), plan["executionStats"]["totalDocsExamined"]
+                finally:
+                    await client.drop_database("residence_site_billed_query_test")
+                    client.close()
+            
+            used_indexes, docs_examined = asyncio.run(run())
+            print(f"Winning plan indexes {used_indexes}, {docs_examined} documents examined")
+            
+            if "debts_billing_period" in used_indexes and docs_examined == 40:
+                self.tests_passed += 1
+                print("✅ Passed - Served by debts_billing_period")
+                return True
+            print("❌ Failed - Expected an index scan of debts_billing_period examining 40 debts")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_partial_issue_published(self):
+        """Test debts inserted around an already-issued one are still published (needs local MongoDB)"""
+        self.tests_run += 1
+        print("\n🔍 Testing Partial Issue Events...")
+        
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import events
+            import indexes
+            import ledger
+            
+            def debt(apartment_id):
+                return {"_id": str(uuid.uuid4()), "site_id": "partial-test", "apartment_id": apartment_id,
+                        "amount": 100.0, "description": "Aidat", "due_date": datetime.utcnow(),
+                        "debt_type": "monthly_fee", "billing_period": "2025-01", "created_date": datetime.utcnow(),
+                        "is_paid": False}
+            
+            async def run():
+                client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+                db = client["residence_site_partial_issue_test"]
+                try:
+                    await indexes.ensure_indexes(db)
+                    await ledger.record_debts(db, [debt("apartment-a")])
+                    # Without a transaction the duplicate is skipped and the rest kept
+                    if await ledger.supports_transactions(client):
+                        return None
+                    subscriber = events.bus.subscribe("partial-test", "admin", None)
+                    inserted_count = await ledger.record_debts(db, [debt("apartment-a"), debt("apartment-b")])
+                    published = [subscriber.event_data(subscriber.queue.get_nowait())
+                                 for _ in range(subscriber.queue.qsize())]
+                    events.bus.unsubscribe(subscriber)
+                    return inserted_count, published
+                finally:
+                    await client.drop_database("residence_site_partial_issue_test")
+                    client.close()
+            
+            events.EVENTS_SOURCE = "local"
+            result = asyncio.run(run())
+            if result is None:
+                self.tests_passed += 1
+                print("✅ Passed - Skipped, transactions roll a partial insert back")
+                return True
+            inserted_count, published = result
+            print(f"Inserted {inserted_count}, published {published}")
+            
+            if inserted_count == 1 and published == [{"count": 1, "apartment_ids": ["apartment-b"]}]:
+                self.tests_passed += 1
+                print("✅ Passed - Only the debt actually inserted was published")
+                return True
+            print("❌ Failed - Expected one debt_created event for apartment-b")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_outbox_concurrency(self):
+        """Test the outbox worker delivers a campaign concurrently to a local fake WAHA (needs local MongoDB)"""
+        self.tests_run += 1
+        print("\n🔍 Testing Outbox Delivery Concurrency...")
+        
+        try:
+            import threading
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            from motor.motor_asyncio import AsyncIOMotorClient
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import outbox
+            from external_integrations.waha import WahaClient
+            
+            received = []
+            
+            class FakeWahaHandler(BaseHTTPRequestHandler):
+                def do_POST(self):
+                    body = self.rfile.read(int(self.headers["Content-Length"]))
+                    received.append(json.loads(body))
+                    time.sleep(0.2)  # Simulate a slow WAHA response
+                    self.send_response(200 if self.path == "/sendText" else 404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                def log_message(self, *args):
+                    pass
+            
+            fake_waha = ThreadingHTTPServer(("127.0.0.1", 0), FakeWahaHandler)
+            threading.Thread(target=fake_waha.serve_forever, daemon=True).start()
+            
+            async def run():
+                client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+                db = client["residence_site_outbox_test"]
+                waha = WahaClient(base_url=f"http://127.0.0.1:{fake_waha.server_port}", timeout=5, max_concurrency=10)
+                try:
+                    job, _ = await outbox.enqueue_job(db, "default", "debt_reminders", "test-admin", [
+                        {"apartment_id": str(uuid.uuid4()), "phone": f"0555000{i:04d}", "text": f"Message {i}"}
+                        for i in range(20)
+                    ])
+                    start = time.perf_counter()
+                    # The same batches run_worker drains, without its idle polling
+                    while await outbox.drain_once(db, waha):
+                        pass
+                    elapsed = time.perf_counter() - start
+                    return await outbox.get_job_progress(db, "default", job["_id"]), elapsed
+                finally:
+                    await waha.aclose()
+                    await client.drop_database("residence_site_outbox_test")
+                    client.close()
+            
+            progress, elapsed = asyncio.run(run())
+            fake_waha.shutdown()
+            
+            print(f"Sent {progress['sent_count']}/{progress['total_count']} messages in {elapsed:.2f}s")
+            # 20 sequential sends would take at least 4s
+            if (progress["sent_count"] == 20 and progress["status"] == "completed" and elapsed < 2
+                    and received[0]["chatId"].startswith("90555")):
+                self.tests_passed += 1
+                print("✅ Passed - The outbox delivered the campaign concurrently")
+                return True
+            print("❌ Failed - The campaign was not delivered concurrently")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_outbox_orphaned_job(self):
+        """Test a running job left without messages stops blocking campaigns after the lease (needs local MongoDB)"""
+        self.tests_run += 1
+        print("\n🔍 Testing Outbox Orphaned Job Expiry...")
+        
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+            import indexes
+            import outbox
+            
+            async def run():
+                client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+                db = client["residence_site_outbox_orphan_test"]
+                message = {"apartment_id": str(uuid.uuid4()), "phone": "05550000001", "text": "Message"}
+                try:
+                    await indexes.ensure_indexes(db)
+                    # What a crash between the job and message writes leaves behind
+                    created_date = datetime.utcnow() - timedelta(seconds=outbox.OUTBOX_LEASE_SECONDS + 60)
+                    await db.reminder_jobs.insert_one({
+                        "_id": "orphan", "site_id": "default", "job_type": "debt_reminders", "status": "running",
+                        "created_by": "test-admin", "created_date": created_date, "total_count": 1,
+                        "skipped_count": 0, "completed_date": None
+                    })
+                    enqueue = [db, "default", "debt_reminders", "test-admin", [message]]
+                    _, created_before = await outbox.enqueue_job(*enqueue)
+                    await outbox.expire_orphaned_jobs(db)
+                    _, created_after = await outbox.enqueue_job(*enqueue)
+                    orphan = await db.reminder_jobs.find_one({"_id": "orphan"})
+                    return created_before, created_after, orphan["status"]
+                finally:
+                    await client.drop_database("residence_site_outbox_orphan_test")
+                    client.close()
+            
+            created_before, created_after, orphan_status = asyncio.run(run())
+            print(f"Created before expiry: {created_before}, after: {created_after}, orphan {orphan_status}")
+            
+            if not created_before and created_after and orphan_status == "completed":
+                self.tests_passed += 1
+                print("✅ Passed - The orphaned job was completed and a new campaign started")
+                return True
+            print("❌ Failed - The orphaned job still blocks new campaigns")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
+    def test_metrics(self):
+        """Test /api/metrics reports per-route latency and Mongo commands for earlier requests"""
+        self.tests_run += 1
+        print("\n🔍 Testing Prometheus Metrics...")
+        
+        try:
+            anonymous = requests.get(f"{self.base_url}/api/metrics", timeout=10)
+            if not os.environ.get("METRICS_TOKEN"):
+                # Without a token configured the endpoint is off
+                if anonymous.status_code == 404:
+                    self.tests_passed += 1
+                    print("✅ Passed - Metrics disabled without METRICS_TOKEN")
+                    return True
+                print(f"❌ Failed - Got {anonymous.status_code} without METRICS_TOKEN")
+                return False
+            if anonymous.status_code != 401:
+                print(f"❌ Failed - Got {anonymous.status_code} without a token")
+                return False
+            headers = {"Authorization": f"Bearer {os.environ['METRICS_TOKEN']}"}
+            response = requests.get(f"{self.base_url}/api/metrics", headers=headers, timeout=10)
+            expected = [
+                'http_request_duration_seconds_count{method="GET",route="/api/debts"}',
+                'http_request_mongo_commands_count{method="GET",route="/api/debts"}',
+                'mongo_commands_total{command="aggregate"}',
+            ]
+            missing = [series for series in expected if series not in response.text]
+            
+            if response.status_code == 200 and not missing:
+                self.tests_passed += 1
+                print("✅ Passed - Route latency and Mongo command series present")
+                return True
+            print(f"❌ Failed - Got {response.status_code}, missing {missing}")
+            return False
+        
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+    
     def run_all_tests(self):
         """Run all API tests"""
         print("\n🚀 Starting Residence Site API Tests\n")
         
+        self.test_readiness()
+        
         # Authentication tests
         admin_login_success = self.test_admin_login()
         resident_login_success = self.test_resident_login()
@@ -384,28 +1552,62 @@ class ResidenceSiteAPITester:
             print("\n❌ Authentication failed, cannot continue with tests")
             return
         
+        self.test_legacy_password_rehash()
+        self.test_default_password_unhashed()
+        
         # Admin-only endpoint tests
         self.test_get_apartments_admin()
         self.test_get_apartments_resident()  # Should fail for resident
         
         # Debt management tests
         self.test_create_debt()
+        self.test_create_debts_bulk()
+        self.test_fee_schedule_catch_up()
+        self.test_late_fee_preview()
+        self.test_late_fee_empty_frames()
         self.test_get_debts_admin()
+        self.test_get_debts_pagination()
         self.test_get_debts_resident()
+        self.test_get_debt_summary()
         self.test_pay_debt()
+        self.test_partial_payment()
+        self.test_monthly_report()
         self.test_pay_debt_resident()  # Should fail for resident
+        self.test_export_debts()
+        self.test_compressed_debts()
+        
+        # Query count regression test runs in-process against a local MongoDB
+        if os.environ.get("MONGO_URL"):
+            self.test_get_debts_query_count()
+            self.test_balance_backfill()
+            self.test_billed_query_plan()
+            self.test_partial_issue_published()
         
         # Announcement tests
         self.test_create_announcement()
+        self.test_announcement_event_stream()
+        self.test_debt_events_coalesced()
         self.test_create_announcement_resident()  # Should fail for resident
         self.test_get_announcements()
+        self.test_search_announcements()
+        self.test_announcements_conditional_get()
         
         # WhatsApp integration test
         self.test_whatsapp_integration()
+        self.test_whatsapp_job_progress()
+        self.test_whatsapp_changed_campaign()
+        if os.environ.get("MONGO_URL"):
+            self.test_outbox_concurrency()
+            self.test_outbox_orphaned_job()
         
         # Apartment management tests
         self.test_update_household_info()
         self.test_get_apartment_details()
+        self.test_import_households_dry_run()
+        self.test_import_households_cp1254()
+        
+        # Metrics cover the requests made above
+        self.test_metrics()
         
         # Print test results
         print(f"\n📊 Tests completed: {self.tests_run}")
@@ -0,0 +1,131 @@
+"""Bytes on the wire and latency of representative responses with and without compression
+
+Usage: python benchmarks/compression.py [--rows 500,5000] [--bandwidth-mbps 5] [--rtt-ms 80]
+Each payload is served in-process through CompressionMiddleware and fetched
+with no Accept-Encoding, gzip and br. Server time is the median time to
+render, compress and receive the body; the estimated latency adds one round
+trip and the transfer time of the wire bytes at the given bandwidth, which
+is what a resident on mobile data waits for.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+import compression
+from responses import json_response
+from serialization import debt_rows
+
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+def apartment_rows(count):
+    return [{
+        "id": str(uuid.uuid4()),
+        "apartment_number": f"apartment{i + 1:02d}",
+        "unit_type": "apartment",
+        "occupant_count": 1 + i % 5,
+        "contact_phone": f"555{i:07d}",
+        "vehicles": [{"vehicle_type": "car", "has_vehicle": True, "plate_number": f"34ABC{i:03d}",
+                      "model": "Toyota Corolla"}],
+        "total_debt": 150.0 * (i % 4),
+    } for i in range(count)]
+
+
+def announcement_rows(count):
+    now = datetime.utcnow()
+    return [{
+        "id": str(uuid.uuid4()),
+        "title": f"Duyuru {i}",
+        "content": "Asansör bakımı nedeniyle yarın 10:00-16:00 arasında hizmet verilemeyecektir. " * 3,
+        "is_urgent": i % 7 == 0,
+        "created_date": now,
+    } for i in range(count)]
+
+
+def build_app(payloads: dict) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/json/{name}")
+    async def json_payload(name: str):
+        return json_response(payloads[name])
+
+    @app.get("/csv/{rows}")
+    async def csv_payload(rows: int):
+        def chunks():
+            # Written in batches, like exports.stream_csv
+            lines = ["apartment_number,amount,paid_amount,description,due_date,is_paid\n"]
+            for row in debt_rows(rows):
+                lines.append(f"{row['apartment_number']},{row['amount']},{row['paid_amount']},{row['description']},"
+                             f"{row['due_date'].isoformat()},{row['is_paid']}\n")
+                if len(lines) == 500:
+                    yield "".join(lines)
+                    lines = []
+            yield "".join(lines)
+        return StreamingResponse(chunks(), media_type="text/csv")
+
+    app.add_middleware(compression.CompressionMiddleware)
+    return app
+
+
+async def measure(client: httpx.AsyncClient, path: str, encoding: str, repeat: int):
+    timings = []
+    wire_bytes = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = await client.get(path, headers={"Accept-Encoding": encoding})
+        timings.append(time.perf_counter() - start)
+        wire_bytes = response.num_bytes_downloaded
+    return statistics.median(timings) * 1000, wire_bytes
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", default="500,5000", help="Debt listing sizes")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--bandwidth-mbps", type=float, default=5.0)
+    parser.add_argument("--rtt-ms", type=float, default=80.0)
+    parser.add_argument("--gzip-level", type=int, default=compression.COMPRESSION_GZIP_LEVEL)
+    parser.add_argument("--brotli-quality", type=int, default=compression.COMPRESSION_BROTLI_QUALITY)
+    args = parser.parse_args()
+
+    compression.COMPRESSION_GZIP_LEVEL = args.gzip_level
+    compression.COMPRESSION_BROTLI_QUALITY = args.brotli_quality
+    encodings = [encoding for encoding in ENCODINGS
+                 if encoding == "identity" or encoding in compression.COMPRESSION_ENCODINGS]
+
+    payloads = {"apartments": apartment_rows(64), "announcements": announcement_rows(20)}
+    paths = {"GET /api/apartments (64)": "/json/apartments", "GET /api/announcements (20)": "/json/announcements"}
+    for rows in [int(count) for count in args.rows.split(",")]:
+        payloads[f"debts{rows}"] = debt_rows(rows)
+        paths[f"GET /api/debts ({rows})"] = f"/json/debts{rows}"
+        paths[f"GET /api/debts/export ({rows})"] = f"/csv/{rows}"
+
+    transport = httpx.ASGITransport(app=build_app(payloads))
+    bytes_per_ms = args.bandwidth_mbps * 1_000_000 / 8 / 1000
+    print(f"median of {args.repeat} runs, estimated latency at {args.bandwidth_mbps} Mbit/s and {args.rtt_ms} ms RTT "
+          f"(gzip level {args.gzip_level}, brotli quality {args.brotli_quality})")
+    print(f"{'response':<32} {'encoding':<9} {'bytes':>9} {'ratio':>6} {'server ms':>10} {'est. ms':>8}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for label, path in paths.items():
+            identity_bytes = None
+            for encoding in encodings:
+                server_ms, wire_bytes = await measure(client, path, encoding, args.repeat)
+                identity_bytes = identity_bytes or wire_bytes
+                estimated = server_ms + args.rtt_ms + wire_bytes / bytes_per_ms
+                print(f"{label:<32} {encoding:<9} {wire_bytes:>9} {identity_bytes / wire_bytes:>5.1f}x "
+                      f"{server_ms:>10.2f} {estimated:>8.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
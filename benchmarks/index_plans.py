@@ -0,0 +1,107 @@
+"""Show query plans for the hot queries before and after the index registry is applied
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/index_plans.py
+Runs against a scratch database that is dropped afterwards.
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import indexes
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+BENCH_DB = "residence_site_index_bench"
+SITE_ID = "default"
+APARTMENTS = 64
+DEBTS_PER_APARTMENT = 200
+
+
+def plan_stages(plan: dict) -> list:
+    """Flatten a winning plan into its stage names, outermost first"""
+    stages = [plan.get("stage")]
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages += plan_stages(plan[child_key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return [stage for stage in stages if stage]
+
+
+async def seed(db):
+    now = datetime.utcnow()
+    apartment_ids = [str(uuid.uuid4()) for _ in range(APARTMENTS)]
+    await db.users.insert_many([
+        {"_id": str(uuid.uuid4()), "site_id": SITE_ID, "username": f"apartment{i:02d}", "apartment_id": apartment_id}
+        for i, apartment_id in enumerate(apartment_ids, 1)
+    ])
+    await db.debts.insert_many([{
+        "_id": str(uuid.uuid4()),
+        "site_id": SITE_ID,
+        "apartment_id": apartment_id,
+        "amount": 150.0,
+        "due_date": now - timedelta(days=30 * n),
+        "is_paid": n % 5 != 0,
+    } for apartment_id in apartment_ids for n in range(DEBTS_PER_APARTMENT)])
+    await db.announcements.insert_many([
+        {"_id": str(uuid.uuid4()), "site_id": SITE_ID, "title": f"Announcement {n}",
+         "created_date": now - timedelta(hours=n)}
+        for n in range(5000)
+    ])
+    return apartment_ids
+
+
+def queries(db, apartment_id):
+    return {
+        "users.find_one(site_id, username)": db.users.find({"site_id": SITE_ID, "username": "apartment07"}).limit(1),
+        "debts.find(apartment_id).sort(due_date)": db.debts.find({"apartment_id": apartment_id}).sort("due_date", -1),
+        "debts.find(site_id, is_paid=False)": db.debts.find({"site_id": SITE_ID, "is_paid": False}),
+        "announcements.find(site_id).sort(created_date)":
+            db.announcements.find({"site_id": SITE_ID}).sort("created_date", -1).limit(20),
+    }
+
+
+async def explain_all(db, apartment_id):
+    results = {}
+    for name, cursor in queries(db, apartment_id).items():
+        start = time.perf_counter()
+        plan = await cursor.explain()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stats = plan.get("executionStats", {})
+        results[name] = {
+            "stages": plan_stages(plan["queryPlanner"]["winningPlan"]),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "explain_ms": elapsed_ms,
+        }
+    return results
+
+
+def print_results(title, results):
+    print(f"\n{title}")
+    for name, result in results.items():
+        print(f"  {name:<45} {' <- '.join(result['stages']):<30} "
+              f"examined={result['docs_examined']} ({result['explain_ms']:.1f} ms)")
+
+
+async def main():
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[BENCH_DB]
+    await client.drop_database(BENCH_DB)
+    try:
+        apartment_ids = await seed(db)
+        print_results("Before ensure_indexes", await explain_all(db, apartment_ids[0]))
+        await indexes.ensure_indexes(db)
+        print_results("After ensure_indexes", await explain_all(db, apartment_ids[0]))
+    finally:
+        await client.drop_database(BENCH_DB)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
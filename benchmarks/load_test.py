@@ -0,0 +1,299 @@
+"""Concurrent load test of the main API endpoints with JSON baselines
+
+Usage:
+    DB_NAME=residence_site_bench uvicorn server:app --port 8001   # from backend/
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/load_test.py \
+        --db residence_site_bench --debts-per-unit 2000 --concurrency 20 --duration 15 \
+        --output benchmarks/results/$(git rev-parse --short HEAD).json \
+        --baseline benchmarks/results/main.json
+
+Run it against a scratch database: seeding adds --debts-per-unit debts to
+every unit of the site (skipped when they are already there) through the
+ledger, so balances stay consistent. Each scenario then runs for
+--duration seconds with --concurrency workers, and p50/p95/p99 latency and
+throughput are printed and written to --output. With --baseline the run is
+compared against an earlier output file and the exit status is 1 when any
+p95 got more than --max-regression percent slower. To check that search
+latency stays flat as the archive grows, run the search scenario after
+seeding --announcements 500 and again after 50000.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import httpx
+import jwt
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import ledger
+import search
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+SEED_BATCH_SIZE = 5000
+ANNOUNCEMENT_CONTENTS = [
+    "Asansör bakımı nedeniyle hizmet verilemeyecektir. " * 4,
+    "Yarın 10:00-16:00 arasında su kesintisi yaşanacaktır. " * 4,
+    "Yıllık olağan genel kurul toplantısı cumartesi günü yapılacaktır. " * 4,
+    "The elevator will be out of service for maintenance. " * 4,
+    "Notice of the annual residents meeting on Saturday. " * 4,
+]
+SCENARIOS = ["login", "debts_admin", "debts_resident", "announcements", "search", "household"]
+SEARCH_QUERIES = ["asansör bakımı", "elevator maintenance", "su kesintisi", "toplantı", "meeting notice"]
+
+
+async def seed(db, site_id: str, debts_per_unit: int, announcements: int):
+    """Top up load-test debts and announcements to the requested size"""
+    apartment_ids = [apartment["_id"] async for apartment in db.apartments.find({"site_id": site_id}, {"_id": 1})]
+    if not apartment_ids:
+        raise SystemExit(f"No apartments in site {site_id!r}; start the server once so it seeds the site")
+
+    existing = await db.debts.count_documents({"site_id": site_id, "load_test": True})
+    missing = debts_per_unit * len(apartment_ids) - existing
+    now = datetime.utcnow()
+    batch = []
+    inserted = 0
+    for n in range(max(missing, 0)):
+        month = (existing + n) // len(apartment_ids)
+        batch.append({
+            "_id": str(uuid.uuid4()),
+            "site_id": site_id,
+            "apartment_id": apartment_ids[(existing + n) % len(apartment_ids)],
+            "amount": 150.0,
+            "description": f"Aidat - load test {month}",
+            "due_date": now - timedelta(days=30 * month),
+            "debt_type": "monthly_fee",
+            "created_date": now,
+            # Most of the history is settled, as in a real ledger
+            "is_paid": month % 10 != 0,
+            "paid_amount": 150.0 if month % 10 != 0 else 0.0,
+            "paid_date": now if month % 10 != 0 else None,
+            "load_test": True
+        })
+        if len(batch) == SEED_BATCH_SIZE:
+            inserted += await ledger.record_debts(db, batch)
+            batch = []
+    if batch:
+        inserted += await ledger.record_debts(db, batch)
+
+    existing_announcements = await db.announcements.count_documents({"site_id": site_id, "load_test": True})
+    new_announcements = []
+    for n in range(existing_announcements, announcements):
+        title = f"Load test announcement {n}"
+        content = ANNOUNCEMENT_CONTENTS[n % len(ANNOUNCEMENT_CONTENTS)]
+        new_announcements.append({
+            "_id": str(uuid.uuid4()),
+            "site_id": site_id,
+            "title": title,
+            "content": content,
+            "is_urgent": n % 7 == 0,
+            "created_date": now - timedelta(hours=n),
+            "created_by": "load_test",
+            "search": search.search_fields(title, content),
+            "load_test": True
+        })
+    if new_announcements:
+        await db.announcements.insert_many(new_announcements)
+
+    print(f"Seeded {inserted} debts and {len(new_announcements)} announcements "
+          f"({len(apartment_ids)} units, {debts_per_unit} debts per unit)")
+
+
+async def login(client: httpx.AsyncClient, site_id: str, username: str, password: str) -> dict:
+    response = await client.post("/api/auth/login", json={
+        "username": username, "password": password, "site_id": site_id
+    })
+    response.raise_for_status()
+    token = response.json()["access_token"]
+    # Only the apartment_id is read here; the server checks the signature
+    claims = jwt.decode(token, options={"verify_signature": False})
+    return {"headers": {"Authorization": f"Bearer {token}"}, "apartment_id": claims.get("apartment_id"),
+            "username": username}
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+async def run_scenario(client: httpx.AsyncClient, request, concurrency: int, duration: float) -> dict:
+    """Issue request(worker, n) from concurrency workers for duration seconds"""
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id: int):
+        n = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await request(worker_id, n)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            n += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def scenario_requests(client: httpx.AsyncClient, site_id: str, admin: dict, residents: list) -> dict:
+    def resident(worker_id: int) -> dict:
+        return residents[worker_id % len(residents)]
+
+    async def login_request(worker_id, n):
+        username = resident(worker_id + n)["username"]
+        return await client.post("/api/auth/login", json={
+            "username": username, "password": username, "site_id": site_id
+        })
+
+    async def debts_admin(worker_id, n):
+        return await client.get("/api/debts", params={"limit": 500}, headers=admin["headers"])
+
+    async def debts_resident(worker_id, n):
+        return await client.get("/api/debts", params={"limit": 500}, headers=resident(worker_id)["headers"])
+
+    async def announcements(worker_id, n):
+        return await client.get("/api/announcements", headers=resident(worker_id)["headers"])
+
+    async def search_request(worker_id, n):
+        return await client.get("/api/announcements/search", headers=resident(worker_id)["headers"],
+                                params={"q": SEARCH_QUERIES[n % len(SEARCH_QUERIES)]})
+
+    async def household(worker_id, n):
+        user = resident(worker_id)
+        return await client.put(f"/api/apartments/{user['apartment_id']}/household", headers=user["headers"], json={
+            "occupant_count": 1 + n % 5,
+            "contact_phone": "",
+            "vehicles": [{"vehicle_type": "car", "has_vehicle": n % 2 == 0, "plate_number": None, "model": None}]
+        })
+
+    return {
+        "login": login_request,
+        "debts_admin": debts_admin,
+        "debts_resident": debts_resident,
+        "announcements": announcements,
+        "search": search_request,
+        "household": household,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    """Print p95 and throughput changes against a baseline, returning False on a p95 regression"""
+    ok = True
+    print(f"\nCompared with baseline {baseline.get('commit')} ({baseline.get('timestamp')})")
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        p95_change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        rps_change = ((result["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100
+                      if before["throughput_rps"] else 0.0)
+        regressed = p95_change > max_regression
+        ok = ok and not regressed
+        print(f"  {name:<16} p95 {before['p95_ms']:8.1f} -> {result['p95_ms']:8.1f} ms ({p95_change:+6.1f}%)  "
+              f"throughput {rps_change:+6.1f}%{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--db", default=os.environ.get("DB_NAME", "residence_site"), help="Database the server uses")
+    parser.add_argument("--site-id", default="default")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--debts-per-unit", type=int, default=1000)
+    parser.add_argument("--announcements", type=int, default=500)
+    parser.add_argument("--no-seed", action="store_true", help="Use the database as it is")
+    parser.add_argument("--residents", type=int, default=20, help="Resident accounts to spread requests over")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with a previous --output file")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="Allowed p95 slowdown in percent")
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        mongo = AsyncIOMotorClient(MONGO_URL)
+        try:
+            await seed(mongo[args.db], args.site_id, args.debts_per_unit, args.announcements)
+        finally:
+            mongo.close()
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        admin = await login(client, args.site_id, "admin", args.admin_password)
+        residents = await asyncio.gather(*(
+            login(client, args.site_id, f"apartment{i:02d}", f"apartment{i:02d}")
+            for i in range(1, args.residents + 1)
+        ))
+        requests = scenario_requests(client, args.site_id, admin, residents)
+
+        results = {}
+        print(f"{'scenario':<16} {'requests':>8} {'errors':>6} {'req/s':>8} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name in args.scenarios.split(","):
+            result = await run_scenario(client, requests[name], args.concurrency, args.duration)
+            results[name] = result
+            print(f"{name:<16} {result['requests']:>8} {result['errors']:>6} {result['throughput_rps']:>8.1f} "
+                  f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {key: getattr(args, key) for key in (
+            "base_url", "site_id", "debts_per_unit", "announcements", "residents", "concurrency", "duration"
+        )},
+        "results": results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,64 @@
+"""Compare password verification inline on the event loop with the hashing thread pool
+
+Usage: python benchmarks/login_throughput.py [--logins 40]
+While the logins run, a probe coroutine sleeps 10 ms in a loop and records
+how late it wakes up; that lag is what every other request would see.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import passwords
+
+
+async def probe_loop_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+
+async def inline_login(password, hashed):
+    return passwords.pwd_context.verify(password, hashed)
+
+
+async def pooled_login(password, hashed):
+    valid, _ = await passwords.verify_password(password, hashed)
+    return valid
+
+
+async def run(mode, login, logins, hashed):
+    stop = asyncio.Event()
+    lags = []
+    probe = asyncio.create_task(probe_loop_lag(stop, lags))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login("apartment01", hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe
+    assert all(results)
+    lags.sort()
+    print(f"{mode:<8} {logins / elapsed:8.1f} logins/s   "
+          f"loop lag p50={lags[len(lags) // 2] * 1000:7.1f} ms  max={lags[-1] * 1000:7.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=40)
+    args = parser.parse_args()
+
+    hashed = await passwords.hash_password("apartment01")
+    print(f"bcrypt rounds={passwords.BCRYPT_ROUNDS}, pool workers={passwords.PASSWORD_HASH_WORKERS}")
+    await run("inline", inline_login, args.logins, hashed)
+    await run("pooled", pooled_login, args.logins, hashed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""Serialization cost of a debt listing: FastAPI's default path versus json_response
+
+Usage: python benchmarks/serialization.py [--rows 5000] [--repeat 20]
+The default path is what an endpoint returning plain dicts used to cost:
+jsonable_encoder followed by JSONResponse (json.dumps). The new path renders
+the same dicts straight through the orjson-backed FastJSONResponse.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from responses import json_response
+
+
+def debt_rows(count):
+    now = datetime.utcnow()
+    return [{
+        "id": str(uuid.uuid4()),
+        "apartment_id": str(uuid.uuid4()),
+        "apartment_number": f"apartment{i % 62 + 1:02d}",
+        "amount": 150.0,
+        "paid_amount": 0.0,
+        "description": f"Aidat - {i}",
+        "due_date": now - timedelta(days=i),
+        "debt_type": "monthly_fee",
+        "created_date": now,
+        "is_paid": i % 3 == 0,
+        "paid_date": now if i % 3 == 0 else None,
+    } for i in range(count)]
+
+
+def default_path(rows):
+    return JSONResponse(jsonable_encoder(rows)).body
+
+
+def orjson_path(rows):
+    return json_response(rows).body
+
+
+def measure(func, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func(rows)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = debt_rows(args.rows)
+    before, before_size = measure(default_path, rows, args.repeat)
+    after, after_size = measure(orjson_path, rows, args.repeat)
+    print(f"{args.rows} debt rows, median of {args.repeat} runs")
+    print(f"  jsonable_encoder + json.dumps  {before:8.2f} ms  {before_size} bytes")
+    print(f"  json_response (orjson)         {after:8.2f} ms  {after_size} bytes")
+    print(f"  speedup                        {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Throughput of the API as the number of gunicorn workers grows
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/worker_scaling.py --workers 1,2,4
+For each worker count the API is started with gunicorn.conf.py on a
+scratch database, the load_test scenarios run against it, and throughput
+is reported next to the ideal linear speedup over one worker. Near-linear
+scaling needs the load generator and mongod to have cores to spare, so
+run it on a machine with more cores than the largest worker count.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import load_test
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+BENCH_DB = "residence_site_scaling_bench"
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DB_NAME": BENCH_DB,
+        "WEB_CONCURRENCY": str(workers),
+        "PORT": str(port),
+        "EVENTS_SOURCE": "broadcast",
+    }
+    return subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "server:app"], cwd=BACKEND_DIR, env=env,
+                            start_new_session=True)
+
+
+async def wait_ready(base_url: str, server: subprocess.Popen, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise SystemExit("Server exited during startup")
+            try:
+                # Every worker prepares on its own; a few ready answers in a row
+                # make it likely they all have
+                if all([(await client.get("/api/ready")).status_code == 200 for _ in range(8)]):
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise SystemExit("Server not ready in time")
+
+
+def stop_server(server: subprocess.Popen):
+    os.killpg(server.pid, signal.SIGTERM)
+    server.wait(timeout=30)
+
+
+async def measure(base_url: str, scenarios: list, concurrency: int, duration: float, residents: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        admin = await load_test.login(client, "default", "admin", "admin123")
+        users = await asyncio.gather(*(
+            load_test.login(client, "default", f"apartment{i:02d}", f"apartment{i:02d}")
+            for i in range(1, residents + 1)
+        ))
+        requests = load_test.scenario_requests(client, "default", admin, users)
+        return {name: await load_test.run_scenario(client, requests[name], concurrency, duration)
+                for name in scenarios}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--scenarios", default="login,debts_resident,announcements")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--residents", type=int, default=20)
+    parser.add_argument("--debts-per-unit", type=int, default=200)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    scenarios = args.scenarios.split(",")
+    mongo = AsyncIOMotorClient(load_test.MONGO_URL)
+    await mongo.drop_database(BENCH_DB)
+    results = {}
+    try:
+        for workers in [int(count) for count in args.workers.split(",")]:
+            server = start_server(workers, args.port)
+            try:
+                await wait_ready(base_url, server)
+                if not results:
+                    await load_test.seed(mongo[BENCH_DB], "default", args.debts_per_unit, 200)
+                results[workers] = await measure(base_url, scenarios, args.concurrency, args.duration,
+                                                 args.residents)
+            finally:
+                stop_server(server)
+    finally:
+        await mongo.drop_database(BENCH_DB)
+        mongo.close()
+
+    baseline_workers = min(results)
+    print(f"\n{'scenario':<16} {'workers':>7} {'req/s':>9} {'speedup':>8} {'ideal':>6} {'p95 ms':>8}")
+    for name in scenarios:
+        base = results[baseline_workers][name]["throughput_rps"]
+        for workers, by_scenario in results.items():
+            result = by_scenario[name]
+            speedup = result["throughput_rps"] / base if base else 0.0
+            print(f"{name:<16} {workers:>7} {result['throughput_rps']:>9.1f} {speedup:>7.2f}x "
+                  f"{workers / baseline_workers:>5.1f}x {result['p95_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -4,18 +4,28 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
+# One worker per CPU this container may use unless WEB_CONCURRENCY says
+# otherwise; gunicorn.conf.py works out the count and the settings that follow
 echo "Starting FastAPI backend"
-# Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
+gunicorn -c gunicorn.conf.py server:app &
 BACKEND_PID=$!
 
-echo "Waiting for backend to start..."
-sleep 30
-
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
-fi
+echo "Waiting for backend to become ready..."
+READY_TIMEOUT=${READY_TIMEOUT:-120}
+START_TIME=$(date +%s)
+until wget -q -O /dev/null http://127.0.0.1:8001/api/ready 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ $(( $(date +%s) - START_TIME )) -ge "$READY_TIMEOUT" ]; then
+        echo "Backend not ready after ${READY_TIMEOUT}s, exiting"
+        kill $BACKEND_PID
+        exit 1
+    fi
+    sleep 0.5
+done
+echo "Backend ready after $(( $(date +%s) - START_TIME ))s"
 
 # Start Nginx
 nginx -g 'daemon off;' &
@@ -0,0 +1,41 @@
+// Write a maximally compressed .gz next to every text asset of the build,
+// so nginx (gzip_static on) serves it without compressing per request.
+const fs = require("fs");
+const path = require("path");
+const zlib = require("zlib");
+
+const BUILD_DIR = path.join(__dirname, "..", "build");
+const EXTENSIONS = new Set([".js", ".css", ".html", ".json", ".svg", ".txt", ".ico"]);
+const MIN_SIZE = 1024;
+
+function* files(dir) {
+  for (const entry of fs.readdirSync(dir, { withFileTypes: true })) {
+    const fullPath = path.join(dir, entry.name);
+    if (entry.isDirectory()) {
+      yield* files(fullPath);
+    } else {
+      yield fullPath;
+    }
+  }
+}
+
+let original = 0;
+let compressed = 0;
+for (const file of files(BUILD_DIR)) {
+  if (!EXTENSIONS.has(path.extname(file))) {
+    continue;
+  }
+  const data = fs.readFileSync(file);
+  if (data.length < MIN_SIZE) {
+    continue;
+  }
+  const gzipped = zlib.gzipSync(data, { level: zlib.constants.Z_BEST_COMPRESSION });
+  // Same mtime as the original, so nginx sends the same Last-Modified and ETag for both
+  fs.writeFileSync(`${file}.gz`, gzipped);
+  const { atime, mtime } = fs.statSync(file);
+  fs.utimesSync(`${file}.gz`, atime, mtime);
+  original += data.length;
+  compressed += gzipped.length;
+}
+
+console.log(`Precompressed ${original} bytes of assets to ${compressed} bytes of gzip`);
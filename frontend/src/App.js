@@ -1,8 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import './App.css';
 
 const API_BASE_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+const SITE_ID = process.env.REACT_APP_SITE_ID;
+// Rows fetched per page of a list; further pages load on "Load more"
+const PAGE_SIZE = 100;
 
 // Language translations
 const translations = {
@@ -29,6 +32,8 @@ const translations = {
     adminDashboard: 'Yönetici Paneli',
     createDebt: 'Borç Ekle',
     sendReminders: 'WhatsApp Hatırlatma Gönder',
+    sendChangedReminders: 'Yalnızca Yeni Borçları Hatırlat',
+    exportDebts: 'Borç Dökümünü İndir (CSV)',
     createAnnouncement: 'Duyuru Ekle',
     
     // Debt Management
@@ -44,6 +49,7 @@ const translations = {
     isPaid: 'Ödendi',
     paymentDate: 'Ödeme Tarihi',
     markAsPaid: 'Ödendi Olarak İşaretle',
+    loadMore: 'Daha fazla yükle',
     
     // Announcements
     title: 'Başlık',
@@ -106,6 +112,8 @@ const translations = {
     adminDashboard: 'Admin Dashboard',
     createDebt: 'Create Debt',
     sendReminders: 'Send WhatsApp Reminders',
+    sendChangedReminders: 'Remind Only New Debts',
+    exportDebts: 'Export Debt Ledger (CSV)',
     createAnnouncement: 'Create Announcement',
     
     // Debt Management
@@ -121,6 +129,7 @@ const translations = {
     isPaid: 'Paid',
     paymentDate: 'Payment Date',
     markAsPaid: 'Mark as Paid',
+    loadMore: 'Load more',
     
     // Announcements
     title: 'Title',
@@ -172,6 +181,10 @@ function App() {
   // Data states
   const [apartments, setApartments] = useState([]);
   const [debts, setDebts] = useState([]);
+  const [debtSummary, setDebtSummary] = useState(null);
+  // Cursors of the next page of each list, null once it is fully loaded
+  const [apartmentsCursor, setApartmentsCursor] = useState(null);
+  const [debtsCursor, setDebtsCursor] = useState(null);
   const [announcements, setAnnouncements] = useState([]);
   const [selectedApartment, setSelectedApartment] = useState(null);
   
@@ -209,6 +222,64 @@ function App() {
     }
   }, []);
 
+  // Read by the event stream handlers, which outlive a render
+  const currentViewRef = useRef(currentView);
+  currentViewRef.current = currentView;
+
+  // Reload announcements and debts when the server pushes a change
+  useEffect(() => {
+    if (!user || !localStorage.getItem('token')) return;
+    
+    let source = null;
+    let closed = false;
+    let debtReload = null;
+    let reconnect = null;
+    // Changes arriving close together cause a single reload: of the summary,
+    // and of the debt list only while its view is open
+    const reloadDebts = () => {
+      clearTimeout(debtReload);
+      debtReload = setTimeout(() => {
+        loadDebtSummary();
+        if (currentViewRef.current === 'debts') loadDebts();
+      }, 500);
+    };
+    
+    // The stream URL carries a short-lived ticket rather than the login token,
+    // so a fresh one is needed whenever the browser gives up reconnecting
+    const connect = async () => {
+      try {
+        const { ticket } = await apiCall('/events/ticket', 'POST');
+        if (closed) return;
+        source = new EventSource(`${API_BASE_URL}/api/events?ticket=${encodeURIComponent(ticket)}`);
+        source.addEventListener('announcement_created', () => loadAnnouncements());
+        ['debt_created', 'debt_updated', 'debt_paid'].forEach(eventType =>
+          source.addEventListener(eventType, reloadDebts)
+        );
+        source.onerror = () => {
+          if (source.readyState === EventSource.CLOSED && !closed) {
+            reconnect = setTimeout(connect, 5000);
+          }
+        };
+      } catch (error) {
+        if (!closed) reconnect = setTimeout(connect, 5000);
+      }
+    };
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(debtReload);
+      clearTimeout(reconnect);
+      if (source) source.close();
+    };
+  }, [user?.username]);
+
+  // The dashboard only needs the summary; the debt list is fetched when its view opens
+  useEffect(() => {
+    if (currentView === 'debts' && user) {
+      loadDebts();
+    }
+  }, [currentView, user?.username]);
+
   // Load apartments when accessing create-debt view
   useEffect(() => {
     if (currentView === 'create-debt' && user?.role === 'admin' && apartments.length === 0) {
@@ -226,7 +297,7 @@ function App() {
     setTimeout(() => setMessage(''), 5000);
   };
 
-  const apiCall = async (endpoint, method = 'GET', data = null) => {
+  const apiCall = async (endpoint, method = 'GET', data = null, fullResponse = false) => {
     try {
       const token = localStorage.getItem('token');
       const config = {
@@ -237,7 +308,7 @@ function App() {
       };
       
       const response = await axios(config);
-      return response.data;
+      return fullResponse ? response : response.data;
     } catch (error) {
       console.error('API Error:', error);
       if (error.response?.status === 401) {
@@ -247,6 +318,15 @@ function App() {
     }
   };
 
+  // Fetch one page of a paginated list endpoint; its X-Next-Cursor header
+  // points at the next page, which is only fetched when the user asks for more
+  const apiCallPage = async (endpoint, cursor = null) => {
+    const separator = endpoint.includes('?') ? '&' : '?';
+    const url = cursor ? `${endpoint}${separator}cursor=${encodeURIComponent(cursor)}` : endpoint;
+    const response = await apiCall(url, 'GET', null, true);
+    return { items: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+  };
+
   const login = async (e) => {
     e.preventDefault();
     setLoading(true);
@@ -254,7 +334,8 @@ function App() {
     try {
       const response = await apiCall('/auth/login', 'POST', {
         ...loginForm,
-        language
+        language,
+        site_id: SITE_ID
       });
       
       localStorage.setItem('token', response.access_token);
@@ -263,7 +344,7 @@ function App() {
       
       // Load initial data based on user role
       try {
-        const promises = [loadDebts(), loadAnnouncements()];
+        const promises = [loadDebtSummary(), loadAnnouncements()];
         if (response.user.role === 'admin') {
           promises.push(loadApartments());
         }
@@ -289,7 +370,7 @@ function App() {
 
   const loadInitialData = async () => {
     try {
-      const promises = [loadDebts(), loadAnnouncements()];
+      const promises = [loadDebtSummary(), loadAnnouncements()];
       if (user?.role === 'admin') {
         promises.push(loadApartments());
       }
@@ -299,24 +380,40 @@ function App() {
     }
   };
 
-  const loadApartments = async () => {
+  const loadApartments = async (cursor = null) => {
     try {
-      const data = await apiCall('/apartments');
-      setApartments(data);
+      const page = await apiCallPage(`/apartments?limit=${PAGE_SIZE}`, cursor);
+      setApartments(previous => cursor ? [...previous, ...page.items] : page.items);
+      setApartmentsCursor(page.nextCursor);
     } catch (error) {
       console.error('Error loading apartments:', error);
     }
   };
 
-  const loadDebts = async () => {
+  // Without a cursor the list restarts from its first page
+  const loadDebts = async (cursor = null) => {
     try {
-      const data = await apiCall('/debts');
-      setDebts(data);
+      // Residents only render these columns
+      const endpoint = user?.role === 'resident'
+        ? `/debts?limit=${PAGE_SIZE}&fields=description,amount,due_date,is_paid`
+        : `/debts?limit=${PAGE_SIZE}`;
+      const page = await apiCallPage(endpoint, cursor);
+      setDebts(previous => cursor ? [...previous, ...page.items] : page.items);
+      setDebtsCursor(page.nextCursor);
     } catch (error) {
       console.error('Error loading debts:', error);
     }
   };
 
+  const loadDebtSummary = async () => {
+    try {
+      const summary = await apiCall('/debts/summary');
+      setDebtSummary(summary);
+    } catch (error) {
+      console.error('Error loading debt summary:', error);
+    }
+  };
+
   const loadAnnouncements = async () => {
     try {
       const data = await apiCall('/announcements');
@@ -339,8 +436,8 @@ function App() {
         due_date: '',
         debt_type: 'monthly_fee'
       });
-      loadDebts();
-      setCurrentView('debts'); // Navigate to debts view to see the new debt
+      loadDebtSummary();
+      setCurrentView('debts'); // Navigate to debts view, which loads the list with the new debt
       showMessage(t.debtCreated);
     } catch (error) {
       showMessage(t.error, true);
@@ -353,17 +450,18 @@ function App() {
     try {
       await apiCall(`/debts/${debtId}/pay`, 'POST');
       loadDebts();
+      loadDebtSummary();
       showMessage(t.success);
     } catch (error) {
       showMessage(t.error, true);
     }
   };
 
-  const sendWhatsAppReminders = async () => {
+  const sendWhatsAppReminders = async (mode = 'all') => {
     setLoading(true);
     try {
-      const result = await apiCall('/whatsapp/send-debt-reminders', 'POST');
-      showMessage(`${t.remindersSent}: ${result.sent_count} mesaj gönderildi`);
+      const result = await apiCall(`/whatsapp/send-debt-reminders?mode=${mode}`, 'POST');
+      showMessage(`${t.remindersSent}: ${result.queued_count} mesaj kuyruğa alındı`);
     } catch (error) {
       showMessage(t.error, true);
     } finally {
@@ -371,6 +469,26 @@ function App() {
     }
   };
 
+  // Download the ledger as a file; the backend streams it from the database
+  const exportDebts = async () => {
+    try {
+      const response = await axios({
+        method: 'GET',
+        url: `${API_BASE_URL}/api/debts/export?format=csv`,
+        headers: { Authorization: `Bearer ${localStorage.getItem('token')}` },
+        responseType: 'blob'
+      });
+      const url = window.URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `debts-${new Date().toISOString().slice(0, 10)}.csv`;
+      link.click();
+      window.URL.revokeObjectURL(url);
+    } catch (error) {
+      showMessage(t.error, true);
+    }
+  };
+
   const createAnnouncement = async (e) => {
     e.preventDefault();
     setLoading(true);
@@ -605,21 +723,20 @@ function App() {
                 {/* Quick Stats */}
                 <div className="bg-white p-6 rounded-lg shadow">
                   <h3 className="text-lg font-medium text-gray-900 mb-2">Total Apartments</h3>
-                  <p className="text-3xl font-bold text-blue-600">{apartments.length}</p>
+                  <p className="text-3xl font-bold text-blue-600">{apartments.length}{apartmentsCursor ? '+' : ''}</p>
                 </div>
                 
                 <div className="bg-white p-6 rounded-lg shadow">
                   <h3 className="text-lg font-medium text-gray-900 mb-2">Unpaid Debts</h3>
                   <p className="text-3xl font-bold text-red-600">
-                    {debts.filter(debt => !debt.is_paid).length}
+                    {debtSummary ? debtSummary.totals.outstanding_count : 0}
                   </p>
                 </div>
                 
                 <div className="bg-white p-6 rounded-lg shadow">
                   <h3 className="text-lg font-medium text-gray-900 mb-2">Total Debt Amount</h3>
                   <p className="text-3xl font-bold text-orange-600">
-                    {debts.filter(debt => !debt.is_paid)
-                      .reduce((sum, debt) => sum + debt.amount, 0).toFixed(2)} TL
+                    {(debtSummary ? debtSummary.totals.outstanding : 0).toFixed(2)} TL
                   </p>
                 </div>
 
@@ -634,12 +751,25 @@ function App() {
                       {t.createDebt}
                     </button>
                     <button
-                      onClick={sendWhatsAppReminders}
+                      onClick={() => sendWhatsAppReminders('all')}
                       disabled={loading}
                       className="bg-green-500 text-white px-4 py-2 rounded-lg hover:bg-green-600 disabled:opacity-50"
                     >
                       {loading ? t.loading : t.sendReminders}
                     </button>
+                    <button
+                      onClick={() => sendWhatsAppReminders('changed')}
+                      disabled={loading}
+                      className="bg-green-700 text-white px-4 py-2 rounded-lg hover:bg-green-800 disabled:opacity-50"
+                    >
+                      {loading ? t.loading : t.sendChangedReminders}
+                    </button>
+                    <button
+                      onClick={exportDebts}
+                      className="bg-gray-600 text-white px-4 py-2 rounded-lg hover:bg-gray-700"
+                    >
+                      {t.exportDebts}
+                    </button>
                     <button
                       onClick={() => setCurrentView('create-announcement')}
                       className="bg-purple-500 text-white px-4 py-2 rounded-lg hover:bg-purple-600"
@@ -655,7 +785,7 @@ function App() {
                 <div className="bg-white p-6 rounded-lg shadow">
                   <h3 className="text-lg font-medium text-gray-900 mb-2">My Debts</h3>
                   <p className="text-3xl font-bold text-red-600">
-                    {debts.filter(debt => !debt.is_paid).length}
+                    {debtSummary ? debtSummary.totals.outstanding_count : 0}
                   </p>
                   <p className="text-sm text-gray-600 mt-1">Unpaid debts</p>
                 </div>
@@ -663,8 +793,7 @@ function App() {
                 <div className="bg-white p-6 rounded-lg shadow">
                   <h3 className="text-lg font-medium text-gray-900 mb-2">Total Amount</h3>
                   <p className="text-3xl font-bold text-orange-600">
-                    {debts.filter(debt => !debt.is_paid)
-                      .reduce((sum, debt) => sum + debt.amount, 0).toFixed(2)} TL
+                    {(debtSummary ? debtSummary.totals.outstanding : 0).toFixed(2)} TL
                   </p>
                   <p className="text-sm text-gray-600 mt-1">Outstanding balance</p>
                 </div>
@@ -683,7 +812,7 @@ function App() {
               <div className="mb-4 p-4 bg-blue-50 border border-blue-200 rounded-lg">
                 <p className="text-blue-700">Loading apartments...</p>
                 <button
-                  onClick={loadApartments}
+                  onClick={() => loadApartments()}
                   className="mt-2 text-blue-600 hover:text-blue-800 underline"
                 >
                   Click here if apartments don't load automatically
@@ -710,6 +839,15 @@ function App() {
                       </option>
                     ))}
                   </select>
+                  {apartmentsCursor && (
+                    <button
+                      type="button"
+                      onClick={() => loadApartments(apartmentsCursor)}
+                      className="mt-2 text-sm text-blue-600 hover:text-blue-800 underline"
+                    >
+                      {t.loadMore}
+                    </button>
+                  )}
                   {apartments.length === 0 && (
                     <p className="text-sm text-gray-500 mt-1">
                       No apartments loaded. Please click the button above to load apartments.
@@ -872,6 +1010,17 @@ function App() {
                 </table>
               </div>
             </div>
+            
+            {debtsCursor && (
+              <div className="mt-4 text-center">
+                <button
+                  onClick={() => loadDebts(debtsCursor)}
+                  className="px-4 py-2 text-blue-600 hover:text-blue-800"
+                >
+                  {t.loadMore}
+                </button>
+              </div>
+            )}
           </div>
         )}
 